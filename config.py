@@ -28,9 +28,9 @@ DEFAULT_FEATURES = {
 }
 
 # --- Budget & Rate Limiting ---
-# Set to True to enable low budget mode (fewer replies, no extras)
-LOW_BUDGET_MODE = False 
-# You can add logic to toggle this based on API usage.
+# Set LOW_BUDGET_MODE=true to enable low budget mode (fewer replies, no extras).
+# main.py reads the same variable to raise its budget governor's floor.
+LOW_BUDGET_MODE = os.getenv("LOW_BUDGET_MODE", "false").lower() == "true"
 
 # --- Niyati's Persona ---
 # A small collection of shayari to draw from.
@@ -29,12 +29,17 @@ import logging
 import asyncio
 import re
 import random
+import math
+import heapq
 import yaml
 import html
+import hmac
+import hashlib
+import sqlite3
+from abc import ABC, abstractmethod
 from datetime import datetime, timedelta, timezone, time
 from typing import Optional, Dict, List, Any, Tuple
-from collections import defaultdict, deque
-import threading
+from collections import defaultdict, deque, OrderedDict
 import pytz
 import httpx
 from io import BytesIO
@@ -47,13 +52,23 @@ from telegram import (
 )
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, CallbackQueryHandler, 
-    ContextTypes, filters
+    ContextTypes, BaseUpdateProcessor, filters
 )
 from telegram.constants import ParseMode, ChatAction, ChatMemberStatus
-from telegram.error import BadRequest, Forbidden, RetryAfter, Conflict
+from telegram.error import BadRequest, Forbidden, RetryAfter, Conflict, TelegramError
 
 from openai import AsyncOpenAI
 
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+try:
+    import google.generativeai as genai
+except ImportError:
+    genai = None
+
 # ============================================================================
 # CONFIGURATION
 # ============================================================================
@@ -72,6 +87,30 @@ class Config:
     GROQ_API_KEYS_STR = os.getenv('GROQ_API_KEYS', '')
     GROQ_API_KEYS_LIST = [k.strip() for k in GROQ_API_KEYS_STR.split(',') if k.strip()]
     GROQ_MODEL = "llama-3.1-8b-instant"  # Lighter model for higher limits
+    GROQ_BASE_URL = os.getenv('GROQ_BASE_URL', 'https://api.groq.com/openai/v1')  # point at mock_llm_server.py for load tests
+
+    # Model fallback chain (tried in order after GROQ_MODEL)
+    GROQ_FALLBACK_MODELS = [m.strip() for m in os.getenv('GROQ_FALLBACK_MODELS', 'llama-3.3-70b-versatile').split(',') if m.strip()]
+    GEMINI_API_KEY = os.getenv('GEMINI_API_KEY', '')
+    GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-2.0-flash')
+    LOCAL_LLM_BASE_URL = os.getenv('LOCAL_LLM_BASE_URL', '')
+    LOCAL_LLM_MODEL = os.getenv('LOCAL_LLM_MODEL', 'local')
+    LLM_QUOTA_SPILL_REQUESTS = int(os.getenv('LLM_QUOTA_SPILL_REQUESTS', '2'))
+    LLM_QUOTA_SPILL_TOKENS = int(os.getenv('LLM_QUOTA_SPILL_TOKENS', '600'))
+    LLM_TIER_FAILURE_THRESHOLD = int(os.getenv('LLM_TIER_FAILURE_THRESHOLD', '3'))
+    LLM_TIER_COOLDOWN = int(os.getenv('LLM_TIER_COOLDOWN', '30'))
+
+    # LLM latency control (adaptive timeouts + hedged requests)
+    LLM_TIMEOUT_MIN = float(os.getenv('LLM_TIMEOUT_MIN', '3.0'))
+    LLM_TIMEOUT_MAX = float(os.getenv('LLM_TIMEOUT_MAX', '15.0'))
+    LLM_TIMEOUT_P95_FACTOR = float(os.getenv('LLM_TIMEOUT_P95_FACTOR', '2.0'))
+    LLM_LATENCY_WINDOW = int(os.getenv('LLM_LATENCY_WINDOW', '64'))
+    LLM_MIN_LATENCY_SAMPLES = int(os.getenv('LLM_MIN_LATENCY_SAMPLES', '8'))
+    LLM_HEDGE_ENABLED = os.getenv('LLM_HEDGE_ENABLED', 'true').lower() == 'true'
+    LLM_HEDGE_DEFAULT_DELAY = float(os.getenv('LLM_HEDGE_DEFAULT_DELAY', '4.0'))
+    LLM_HEDGE_MIN_DELAY = float(os.getenv('LLM_HEDGE_MIN_DELAY', '0.5'))
+    LLM_INTERACTIVE_DEADLINE = float(os.getenv('LLM_INTERACTIVE_DEADLINE', '25.0'))
+    LLM_BACKGROUND_DEADLINE = float(os.getenv('LLM_BACKGROUND_DEADLINE', '60.0'))
 
     # Limits
     MAX_PRIVATE_MESSAGES = int(os.getenv('MAX_PRIVATE_MESSAGES', '10')) # Reduced from 20
@@ -86,7 +125,7 @@ class Config:
     
     # Limits
     MAX_PRIVATE_MESSAGES = int(os.getenv('MAX_PRIVATE_MESSAGES', '20'))
-    MAX_GROUP_MESSAGES = int(os.getenv('MAX_GROUP_MESSAGES', '5'))
+    MAX_GROUP_MESSAGES = int(os.getenv('MAX_GROUP_MESSAGES', '20'))  # group lines shown to the LLM
     MAX_REQUESTS_PER_MINUTE = int(os.getenv('MAX_REQUESTS_PER_MINUTE', '15'))
     MAX_REQUESTS_PER_DAY = int(os.getenv('MAX_REQUESTS_PER_DAY', '500'))
     
@@ -94,6 +133,19 @@ class Config:
     MAX_LOCAL_USERS_CACHE = int(os.getenv('MAX_LOCAL_USERS_CACHE', '10000'))
     MAX_LOCAL_GROUPS_CACHE = int(os.getenv('MAX_LOCAL_GROUPS_CACHE', '1000'))
     CACHE_CLEANUP_INTERVAL = int(os.getenv('CACHE_CLEANUP_INTERVAL', '3600'))
+
+    # Response cache for low-information messages ("hi", "hmm", "gn", stickers)
+    RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+    RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', '21600'))  # 6 hours
+    RESPONSE_CACHE_MAX_KEYS = int(os.getenv('RESPONSE_CACHE_MAX_KEYS', '2000'))
+    RESPONSE_CACHE_CANDIDATES = int(os.getenv('RESPONSE_CACHE_CANDIDATES', '6'))
+    RESPONSE_CACHE_MIN_CANDIDATES = int(os.getenv('RESPONSE_CACHE_MIN_CANDIDATES', '3'))
+    RESPONSE_CACHE_SERVE_CHANCE = float(os.getenv('RESPONSE_CACHE_SERVE_CHANCE', '0.8'))
+
+    # LLM usage accounting
+    USAGE_WINDOW_HOURS = int(os.getenv('USAGE_WINDOW_HOURS', '24'))
+    USAGE_FLUSH_MINUTES = int(os.getenv('USAGE_FLUSH_MINUTES', '10'))
+    USAGE_MAX_TRACKED = int(os.getenv('USAGE_MAX_TRACKED', '5000'))
     
     # Diary
     DIARY_ACTIVE_HOURS = (20, 23)
@@ -104,6 +156,9 @@ class Config:
     
     # Server
     PORT = int(os.getenv('PORT', '10000'))
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').rstrip('/')  # public base URL; empty = long polling
+    WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+    UPDATE_MAX_IN_FLIGHT = int(os.getenv('UPDATE_MAX_IN_FLIGHT', '32'))  # per bot
     
     # Features
     MULTI_MESSAGE_ENABLED = os.getenv('MULTI_MESSAGE_ENABLED', 'true').lower() == 'true'
@@ -111,13 +166,41 @@ class Config:
     
     # Broadcast
     BROADCAST_RETRY_ATTEMPTS = int(os.getenv('BROADCAST_RETRY_ATTEMPTS', '3'))
-    BROADCAST_RATE_LIMIT = float(os.getenv('BROADCAST_RATE_LIMIT', '0.05'))
+    BROADCAST_RATE_LIMIT = float(os.getenv('BROADCAST_RATE_LIMIT', '0.05'))  # min seconds between sends per bot
+    BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '8'))
+    BROADCAST_PROGRESS_SECONDS = float(os.getenv('BROADCAST_PROGRESS_SECONDS', '5'))
+
+    # Scheduled fan-out (routine / diary / geeta), windows in minutes
+    FANOUT_CONCURRENCY = int(os.getenv('FANOUT_CONCURRENCY', '8'))
+    ROUTINE_WINDOW_MINUTES = float(os.getenv('ROUTINE_WINDOW_MINUTES', '60'))
+    DIARY_WINDOW_MINUTES = float(os.getenv('DIARY_WINDOW_MINUTES', '20'))
+    GEETA_WINDOW_MINUTES = float(os.getenv('GEETA_WINDOW_MINUTES', '15'))
     
     # Cooldown & Features
     USER_COOLDOWN_SECONDS = int(os.getenv('USER_COOLDOWN_SECONDS', '3'))
+    BURST_COALESCE_ENABLED = os.getenv('BURST_COALESCE_ENABLED', 'true').lower() == 'true'
+    BURST_WINDOW_MIN = float(os.getenv('BURST_WINDOW_MIN', '1.2'))   # seconds of quiet that end a burst
+    BURST_WINDOW_MAX = float(os.getenv('BURST_WINDOW_MAX', '4.0'))
+    BURST_MAX_SECONDS = float(os.getenv('BURST_MAX_SECONDS', '10'))  # hard cap from the first fragment
+    BURST_MAX_FRAGMENTS = int(os.getenv('BURST_MAX_FRAGMENTS', '8'))
     RANDOM_SHAYARI_CHANCE = float(os.getenv('RANDOM_SHAYARI_CHANCE', '0.15'))
     RANDOM_MEME_CHANCE = float(os.getenv('RANDOM_MEME_CHANCE', '0.10'))
     GROUP_RESPONSE_RATE = float(os.getenv('GROUP_RESPONSE_RATE', '0.50'))
+    GROUP_JOINT_GENERATION = os.getenv('GROUP_JOINT_GENERATION', 'false').lower() == 'true'
+    GROUP_JOINT_MAX_TOKENS = int(os.getenv('GROUP_JOINT_MAX_TOKENS', '300'))
+    GROUP_JOINT_WAIT_SECONDS = float(os.getenv('GROUP_JOINT_WAIT_SECONDS', '12'))  # second bot waits for its lines
+
+    # Budget governor (degrade gracefully under token/quota/queue pressure)
+    # LOW_BUDGET_MODE itself lives in config.py; here it only moves the floor to 'quiet_groups'
+    BUDGET_MIN_LEVEL = int(os.getenv('BUDGET_MIN_LEVEL',
+                                     '3' if os.getenv('LOW_BUDGET_MODE', 'false').lower() == 'true' else '0'))
+    BUDGET_TOKENS_PER_HOUR = int(os.getenv('BUDGET_TOKENS_PER_HOUR', '0'))  # 0 = no spend target
+    BUDGET_MAX_IN_FLIGHT = int(os.getenv('BUDGET_MAX_IN_FLIGHT', '24'))
+    BUDGET_LEVEL_THRESHOLDS = [float(x) for x in os.getenv('BUDGET_LEVEL_THRESHOLDS', '0.6,0.7,0.8,0.9,1.0').split(',')]
+    BUDGET_RECOVERY_SECONDS = int(os.getenv('BUDGET_RECOVERY_SECONDS', '120'))
+    BUDGET_EVAL_SECONDS = int(os.getenv('BUDGET_EVAL_SECONDS', '15'))
+    BUDGET_GROUP_RATE_FACTOR = float(os.getenv('BUDGET_GROUP_RATE_FACTOR', '0.5'))
+    BUDGET_MAX_TOKENS_FACTOR = float(os.getenv('BUDGET_MAX_TOKENS_FACTOR', '0.6'))
     PRIVACY_MODE = os.getenv('PRIVACY_MODE', 'false').lower() == 'true'
 
     # Voice
@@ -127,6 +210,36 @@ class Config:
     VOICE_MIN_TEXT_LENGTH = int(os.getenv('VOICE_MIN_TEXT_LENGTH', '15'))
     VOICE_MAX_TEXT_LENGTH = int(os.getenv('VOICE_MAX_TEXT_LENGTH', '300'))
     
+    # Shared group state (memory = in-process; redis = cross-process/host)
+    STATE_BACKEND = os.getenv('STATE_BACKEND', 'memory').lower()
+    REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+    STATE_KEY_PREFIX = os.getenv('STATE_KEY_PREFIX', 'nk')
+    SHARED_MEMORY_LIMIT = int(os.getenv('SHARED_MEMORY_LIMIT', '30'))  # group timeline capacity
+    GROUP_PLAN_TTL = int(os.getenv('GROUP_PLAN_TTL', '600'))
+    GROUP_STATE_TTL = int(os.getenv('GROUP_STATE_TTL', '86400'))
+    GROUP_RECENT_IDS = int(os.getenv('GROUP_RECENT_IDS', '256'))
+    RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', STATE_BACKEND).lower()
+
+    # Deferred actions (second-bot follow-ups)
+    DEFERRED_TICK = float(os.getenv('DEFERRED_TICK', '0.5'))
+    DEFERRED_WHEEL_SLOTS = int(os.getenv('DEFERRED_WHEEL_SLOTS', '512'))
+    GROUP_AUTO_DELETE_SECONDS = int(os.getenv('GROUP_AUTO_DELETE_SECONDS', '120'))
+    DELETE_QUEUE_INTERVAL = int(os.getenv('DELETE_QUEUE_INTERVAL', '5'))
+
+    # Local persistent state (sqlite file)
+    LOCAL_STATE_PATH = os.getenv('LOCAL_STATE_PATH', 'bot_state.db')
+
+    # Deferred replies (private turns parked while every LLM key is exhausted)
+    DEFERRED_REPLY_MAX = int(os.getenv('DEFERRED_REPLY_MAX', '500'))
+    DEFERRED_REPLY_MAX_AGE = int(os.getenv('DEFERRED_REPLY_MAX_AGE', '1800'))  # seconds
+    DEFERRED_REPLY_INTERVAL = int(os.getenv('DEFERRED_REPLY_INTERVAL', '10'))
+
+    # Outbound sends (Telegram: ~30 msg/s per bot, ~20 msg/min per group)
+    OUTBOUND_GLOBAL_PER_SECOND = float(os.getenv('OUTBOUND_GLOBAL_PER_SECOND', '25'))
+    OUTBOUND_GROUP_PER_MINUTE = float(os.getenv('OUTBOUND_GROUP_PER_MINUTE', '18'))
+    OUTBOUND_PRIVATE_PER_SECOND = float(os.getenv('OUTBOUND_PRIVATE_PER_SECOND', '1'))
+    OUTBOUND_MAX_RETRIES = int(os.getenv('OUTBOUND_MAX_RETRIES', '3'))
+
     # Anti-loop: Max bot-to-bot exchanges per group before cooldown
     MAX_BOT_EXCHANGES = int(os.getenv('MAX_BOT_EXCHANGES', '3'))
     BOT_EXCHANGE_COOLDOWN = int(os.getenv('BOT_EXCHANGE_COOLDOWN', '300'))  # 5 min
@@ -186,29 +299,92 @@ def parse_retry_after_seconds(error_text: str) -> float:
         return float(m.group(1))
     return 60.0
 
+def parse_duration_seconds(text: str) -> Optional[float]:
+    """Parse rate-limit header durations like '2m59.56s', '7.66s' or '120ms'."""
+    if not text:
+        return None
+    parts = re.findall(r"([0-9]+(?:\.[0-9]+)?)(ms|h|m|s)", str(text))
+    if not parts:
+        return None
+    units = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+    return sum(float(value) * units[unit] for value, unit in parts)
+
+def is_rate_limit_error(error_text: str) -> bool:
+    err_lower = error_text.lower()
+    return "rate_limit_reached" in err_lower or "rate limit reached" in err_lower or "429" in err_lower
+
 # ============================================================================
 # HEALTH SERVER
 # ============================================================================
 
+def webhook_secrets(token: str) -> Tuple[str, str]:
+    """Derive a bot's webhook (url path, secret header) from its token without exposing it."""
+    digest = hashlib.sha256(f"{Config.WEBHOOK_SECRET}:{token}".encode()).hexdigest()
+    return digest[:32], digest[32:]
+
 class HealthServer:
     def __init__(self):
         self.app = web.Application()
         self.app.router.add_get('/', self.health)
         self.app.router.add_get('/health', self.health)
         self.app.router.add_get('/status', self.status)
+        self.app.router.add_post('/webhook/{path}', self.webhook)
         self.runner = None
         self.start_time = datetime.now(timezone.utc)
         self.stats = {'messages': 0, 'users': 0, 'groups': 0}
+        self.webhooks: Dict[str, Tuple[Any, str]] = {}
+        self.webhook_stats = defaultdict(int)
+    
+    def add_webhook(self, application, path: str, secret: str):
+        self.webhooks[path] = (application, secret)
     
     async def health(self, request):
         return web.json_response({'status': 'healthy', 'bot': 'Niyati+Kavya'})
     
+    async def webhook(self, request):
+        """Telegram pushes updates here; each bot has its own path and secret header."""
+        entry = self.webhooks.get(request.match_info['path'])
+        if entry is None:
+            self.webhook_stats['unknown_path'] += 1
+            return web.Response(status=404)
+        application, secret = entry
+        if not hmac.compare_digest(request.headers.get('X-Telegram-Bot-Api-Secret-Token', ''), secret):
+            self.webhook_stats['bad_secret'] += 1
+            return web.Response(status=403)
+        try:
+            update = Update.de_json(await request.json(), application.bot)
+        except Exception:
+            self.webhook_stats['bad_payload'] += 1
+            return web.Response(status=400)
+        await application.update_queue.put(update)
+        self.webhook_stats['updates'] += 1
+        return web.Response()
+    
     async def status(self, request):
         uptime = datetime.now(timezone.utc) - self.start_time
         return web.json_response({
             'status': 'running',
             'uptime_hours': round(uptime.total_seconds() / 3600, 2),
-            'stats': self.stats
+            'stats': self.stats,
+            'llm': llm_gateway.get_stats(),
+            'usage': usage_accountant.snapshot(),
+            'response_cache': response_cache.get_stats(),
+            'group_state': group_state.get_stats(),
+            'deferred': deferred_actions.get_stats(),
+            'admission': admission_counters.get_stats(),
+            'rate_limiter': rate_limiter.get_stats(),
+            'requests': request_counters.snapshot(),
+            'budget': budget_governor.get_stats(),
+            'outbound': outbound.get_stats(),
+            'auto_delete': delete_queue.get_stats(),
+            'broadcast': broadcast_engine.get_stats(),
+            'fanout': fanout.get_stats(),
+            'media': media_registry.get_stats(),
+            'bursts': burst_coalescer.get_stats(),
+            'generations': generation_tracker.get_stats(),
+            'deferred_replies': deferred_replies.get_stats(),
+            'updates': {name: p.get_stats() for name, p in update_processors.items()},
+            'webhook': {'mode': 'webhook' if Config.WEBHOOK_URL else 'polling', **self.webhook_stats}
         })
     
     async def start(self):
@@ -225,63 +401,446 @@ class HealthServer:
 health_server = HealthServer()
 
 # ============================================================================
-# SHARED GROUP MEMORY (Cross-bot context with anti-loop)
+# SHARED GROUP STATE (Cross-bot context with anti-loop, pluggable backend)
 # ============================================================================
 
-shared_group_memory: Dict[int, List[Dict]] = {}
-bot_exchange_tracker: Dict[int, Dict] = defaultdict(lambda: {'count': 0, 'last_reset': datetime.now(timezone.utc)})
-group_turn_manager: Dict[int, Dict[str, Any]] = defaultdict(
-    lambda: {
-        'last_speaker': None,
-        'pending_bot_replies': {},
-        'exchange_count': 0,
-        'last_human_at': None,
-        'processed_human_messages': set()
-    }
-)
-group_turn_locks: Dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+_redis_client = None
 
-async def add_to_shared_memory(chat_id: int, bot_name: str, response: str):
-    """Store a bot's response so the other bot can see it."""
-    if chat_id not in shared_group_memory:
-        shared_group_memory[chat_id] = []
-    shared_group_memory[chat_id].append({
-        'bot': bot_name,
-        'username': bot_name,
-        'content': response,
-        'role': 'assistant',
-        'timestamp': datetime.now(timezone.utc).isoformat()
-    })
-    if len(shared_group_memory[chat_id]) > 30:
-        shared_group_memory[chat_id] = shared_group_memory[chat_id][-30:]
-
-def check_bot_loop(chat_id: int) -> bool:
-    """Returns True if bots have been talking too much to each other. Anti-loop."""
-    state = group_turn_manager[chat_id]
-    if state.get('exchange_count', 0) >= 3 and state.get('last_human_at'):
-        quiet_for = (datetime.now(timezone.utc) - state['last_human_at']).total_seconds()
-        if quiet_for >= 60:
+def shared_redis():
+    """One Redis connection pool for every Redis-backed component."""
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = aioredis.from_url(Config.REDIS_URL, decode_responses=True)
+    return _redis_client
+
+
+class GroupLine:
+    """One line of group conversation, human or bot."""
+
+    __slots__ = ('ts', 'kind', 'name', 'text')
+
+    HUMAN = 'human'
+    BOT = 'bot'
+
+    def __init__(self, ts: float, kind: str, name: str, text: str):
+        self.ts = ts
+        self.kind = kind
+        self.name = name
+        self.text = text
+
+    def to_json(self) -> str:
+        return json.dumps([self.ts, self.kind, self.name, self.text])
+
+    @classmethod
+    def from_json(cls, raw: str) -> 'GroupLine':
+        return cls(*json.loads(raw))
+
+
+class GroupTimeline:
+    """
+    Fixed-size, time-ordered ring of GroupLines shared by humans and both bots.
+    Lines are appended in arrival order, so windows never need sorting.
+    """
+
+    __slots__ = ('_lines', '_count')
+
+    def __init__(self, capacity: int):
+        self._lines: List[Optional[GroupLine]] = [None] * max(1, capacity)
+        self._count = 0
+
+    def append(self, line: GroupLine):
+        self._lines[self._count % len(self._lines)] = line
+        self._count += 1
+
+    def last(self) -> Optional[GroupLine]:
+        return self._lines[(self._count - 1) % len(self._lines)] if self._count else None
+
+    def window(self, limit: int):
+        """Iterate the newest `limit` lines in place; lines overwritten mid-iteration are skipped."""
+        end = self._count
+        start = max(0, end - min(limit, len(self._lines)))
+        return self._iter(start, end)
+
+    def _iter(self, start: int, end: int):
+        capacity = len(self._lines)
+        for seq in range(start, end):
+            if seq >= self._count - capacity:
+                yield self._lines[seq % capacity]
+
+
+class GroupStateBackend(ABC):
+    """
+    Everything Niyati and Kavya need to coordinate group turns: the shared
+    message memory, per-message turn plans, turn counters and the anti-loop
+    tracker. The in-process backend only coordinates bots living in the same
+    process; the Redis backend lets them run as separate workers or hosts.
+    """
+
+    @abstractmethod
+    async def claim_turn(self, chat_id: int, message_id: int, plan: Dict) -> Tuple[Dict, bool]:
+        """Store `plan` unless one already exists. Returns (plan, created)."""
+
+    @abstractmethod
+    async def get_plan(self, chat_id: int, message_id: int) -> Optional[Dict]:
+        ...
+
+    @abstractmethod
+    async def update_plan(self, chat_id: int, message_id: int, fields: Dict):
+        ...
+
+    @abstractmethod
+    async def drop_plan(self, chat_id: int, message_id: int):
+        ...
+
+    @abstractmethod
+    async def mark_human_message(self, chat_id: int, message_id: int) -> bool:
+        """True the first time a human message is seen in this chat."""
+
+    @abstractmethod
+    async def append_line(self, chat_id: int, kind: str, name: str, text: str):
+        """Append a human or bot line to the group's shared timeline."""
+
+    @abstractmethod
+    async def get_window(self, chat_id: int, limit: int = None):
+        """The newest `limit` timeline lines, oldest first."""
+
+    @abstractmethod
+    async def get_last_line(self, chat_id: int) -> Optional[GroupLine]:
+        ...
+
+    @abstractmethod
+    async def note_bot_reply(self, chat_id: int, bot_name: str):
+        ...
+
+    @abstractmethod
+    async def get_turn_state(self, chat_id: int) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    async def check_bot_loop(self, chat_id: int) -> bool:
+        """Returns True if bots have been talking too much to each other. Anti-loop."""
+
+    async def sweep(self) -> int:
+        """Drop expired plans and idle groups. Returns how many groups were dropped."""
+        return 0
+
+    def get_stats(self) -> Dict[str, int]:
+        return {}
+
+    async def close(self):
+        pass
+
+
+class RecentIdRing:
+    """Fixed-size ring of recently seen ids with a set index for O(1) membership."""
+
+    __slots__ = ('_ring', '_index', '_pos')
+
+    def __init__(self, capacity: int):
+        self._ring: List[Optional[int]] = [None] * max(1, capacity)
+        self._index: set = set()
+        self._pos = 0
+
+    def add(self, item_id: int) -> bool:
+        """Record an id; False if it was already in the window."""
+        if item_id in self._index:
+            return False
+        evicted = self._ring[self._pos]
+        if evicted is not None:
+            self._index.discard(evicted)
+        self._ring[self._pos] = item_id
+        self._index.add(item_id)
+        self._pos = (self._pos + 1) % len(self._ring)
+        return True
+
+    def __contains__(self, item_id: int) -> bool:
+        return item_id in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+
+class GroupTurnState:
+    """Per-group turn state. Timestamps are epoch seconds to keep records small."""
+
+    __slots__ = ('last_speaker', 'exchange_count', 'last_human_at', 'pending',
+                 'recent_ids', 'timeline', 'loop_count', 'loop_reset', 'touched')
+
+    def __init__(self, now: float):
+        self.last_speaker: Optional[str] = None
+        self.exchange_count = 0
+        self.last_human_at: Optional[float] = None
+        self.pending: Dict[int, Tuple[float, Dict]] = {}  # message_id -> (expires_at, plan)
+        self.recent_ids = RecentIdRing(Config.GROUP_RECENT_IDS)
+        self.timeline = GroupTimeline(Config.SHARED_MEMORY_LIMIT)
+        self.loop_count = 0
+        self.loop_reset = now
+        self.touched = now
+
+    def expire_plans(self, now: float):
+        if self.pending:
+            for message_id in [m for m, (expires_at, _) in self.pending.items() if expires_at <= now]:
+                del self.pending[message_id]
+
+
+class InProcessGroupState(GroupStateBackend):
+    """
+    Bounded per-group records on the event loop; no awaits inside, so each
+    call is atomic. Plans expire after GROUP_PLAN_TTL and groups idle for
+    GROUP_STATE_TTL are swept, so memory stays flat across thousands of groups.
+    """
+
+    def __init__(self):
+        self.chats: Dict[int, GroupTurnState] = {}
+
+    def _state(self, chat_id: int) -> GroupTurnState:
+        now = datetime.now(timezone.utc).timestamp()
+        state = self.chats.get(chat_id)
+        if state is None:
+            state = self.chats[chat_id] = GroupTurnState(now)
+        state.touched = now
+        return state
+
+    def _live_plan(self, chat_id: int, message_id: int) -> Optional[Dict]:
+        state = self.chats.get(chat_id)
+        entry = state.pending.get(message_id) if state else None
+        if not entry:
+            return None
+        if entry[0] <= datetime.now(timezone.utc).timestamp():
+            del state.pending[message_id]
+            return None
+        return entry[1]
+
+    async def claim_turn(self, chat_id, message_id, plan):
+        existing = self._live_plan(chat_id, message_id)
+        if existing:
+            return existing, False
+        state = self._state(chat_id)
+        state.expire_plans(state.touched)
+        state.pending[message_id] = (state.touched + Config.GROUP_PLAN_TTL, plan)
+        state.last_human_at = state.touched
+        state.exchange_count = 0
+        return plan, True
+
+    async def get_plan(self, chat_id, message_id):
+        return self._live_plan(chat_id, message_id)
+
+    async def update_plan(self, chat_id, message_id, fields):
+        plan = self._live_plan(chat_id, message_id)
+        if plan is not None:
+            plan.update(fields)
+
+    async def drop_plan(self, chat_id, message_id):
+        state = self.chats.get(chat_id)
+        if state:
+            state.pending.pop(message_id, None)
+
+    async def mark_human_message(self, chat_id, message_id):
+        return self._state(chat_id).recent_ids.add(message_id)
+
+    async def append_line(self, chat_id, kind, name, text):
+        state = self._state(chat_id)
+        state.timeline.append(GroupLine(state.touched, kind, name, text))
+
+    async def get_window(self, chat_id, limit=None):
+        state = self.chats.get(chat_id)
+        return state.timeline.window(limit or Config.MAX_GROUP_MESSAGES) if state else ()
+
+    async def get_last_line(self, chat_id):
+        state = self.chats.get(chat_id)
+        return state.timeline.last() if state else None
+
+    async def note_bot_reply(self, chat_id, bot_name):
+        state = self._state(chat_id)
+        state.last_speaker = bot_name
+        state.exchange_count += 1
+
+    async def get_turn_state(self, chat_id):
+        state = self.chats.get(chat_id)
+        if not state:
+            return {'last_speaker': None, 'exchange_count': 0, 'last_human_at': None}
+        return {
+            'last_speaker': state.last_speaker,
+            'exchange_count': state.exchange_count,
+            'last_human_at': (datetime.fromtimestamp(state.last_human_at, timezone.utc)
+                              if state.last_human_at else None),
+        }
+
+    async def check_bot_loop(self, chat_id):
+        state = self._state(chat_id)
+        now = state.touched
+        if state.exchange_count >= 3 and state.last_human_at and now - state.last_human_at >= 60:
             return True
 
-    tracker = bot_exchange_tracker[chat_id]
-    now = datetime.now(timezone.utc)
-    
-    # Reset counter after cooldown
-    if (now - tracker['last_reset']).total_seconds() > Config.BOT_EXCHANGE_COOLDOWN:
-        tracker['count'] = 0
-        tracker['last_reset'] = now
-    
-    if tracker['count'] >= Config.MAX_BOT_EXCHANGES:
-        return True  # Too many exchanges, cool down
-    
-    tracker['count'] += 1
-    return False
+        # Reset counter after cooldown
+        if now - state.loop_reset > Config.BOT_EXCHANGE_COOLDOWN:
+            state.loop_count = 0
+            state.loop_reset = now
+
+        if state.loop_count >= Config.MAX_BOT_EXCHANGES:
+            return True  # Too many exchanges, cool down
+
+        state.loop_count += 1
+        return False
+
+    async def sweep(self) -> int:
+        now = datetime.now(timezone.utc).timestamp()
+        idle = []
+        for chat_id, state in self.chats.items():
+            state.expire_plans(now)
+            if not state.pending and now - state.touched > Config.GROUP_STATE_TTL:
+                idle.append(chat_id)
+        for chat_id in idle:
+            del self.chats[chat_id]
+        return len(idle)
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            'chats': len(self.chats),
+            'pending_plans': sum(len(s.pending) for s in self.chats.values()),
+        }
+
+
+class RedisGroupState(GroupStateBackend):
+    """
+    Redis-backed state so both bots can coordinate across processes/hosts.
+    Turn claims and the anti-loop check run as Lua scripts so they stay
+    atomic; every key carries a TTL so idle groups disappear on their own.
+    """
+
+    CLAIM_TURN = """
+local existing = redis.call('GET', KEYS[1])
+if existing then return {0, existing} end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+redis.call('HSET', KEYS[2], 'last_human_at', ARGV[3], 'exchange_count', 0)
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+return {1, ARGV[1]}
+"""
+
+    UPDATE_PLAN = """
+local current = redis.call('GET', KEYS[1])
+if not current then return 0 end
+local plan = cjson.decode(current)
+for k, v in pairs(cjson.decode(ARGV[1])) do plan[k] = v end
+redis.call('SET', KEYS[1], cjson.encode(plan), 'KEEPTTL')
+return 1
+"""
 
-def get_last_speaker_in_group(chat_id: int) -> Optional[str]:
+    CHECK_LOOP = """
+local now = tonumber(ARGV[1])
+local exchanges = tonumber(redis.call('HGET', KEYS[1], 'exchange_count') or '0')
+local last_human = redis.call('HGET', KEYS[1], 'last_human_at')
+if exchanges >= 3 and last_human and (now - tonumber(last_human)) >= 60 then return 1 end
+local count = tonumber(redis.call('HGET', KEYS[2], 'count') or '0')
+local last_reset = tonumber(redis.call('HGET', KEYS[2], 'last_reset') or ARGV[1])
+if now - last_reset > tonumber(ARGV[2]) then
+    count = 0
+    last_reset = now
+end
+local looping = 0
+if count >= tonumber(ARGV[3]) then looping = 1 else count = count + 1 end
+redis.call('HSET', KEYS[2], 'count', count, 'last_reset', last_reset)
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+return looping
+"""
+
+    def __init__(self, prefix: str = None, client=None):
+        self.redis = client or shared_redis()
+        self.prefix = prefix or Config.STATE_KEY_PREFIX
+        self._claim_turn = self.redis.register_script(self.CLAIM_TURN)
+        self._update_plan = self.redis.register_script(self.UPDATE_PLAN)
+        self._check_loop = self.redis.register_script(self.CHECK_LOOP)
+
+    def _key(self, *parts) -> str:
+        return ":".join([self.prefix] + [str(p) for p in parts])
+
+    async def claim_turn(self, chat_id, message_id, plan):
+        created, stored = await self._claim_turn(
+            keys=[self._key('plan', chat_id, message_id), self._key('turn', chat_id)],
+            args=[json.dumps(plan), Config.GROUP_PLAN_TTL, datetime.now(timezone.utc).timestamp(), Config.GROUP_STATE_TTL]
+        )
+        return json.loads(stored), bool(int(created))
+
+    async def get_plan(self, chat_id, message_id):
+        raw = await self.redis.get(self._key('plan', chat_id, message_id))
+        return json.loads(raw) if raw else None
+
+    async def update_plan(self, chat_id, message_id, fields):
+        await self._update_plan(keys=[self._key('plan', chat_id, message_id)], args=[json.dumps(fields)])
+
+    async def drop_plan(self, chat_id, message_id):
+        await self.redis.delete(self._key('plan', chat_id, message_id))
+
+    async def mark_human_message(self, chat_id, message_id):
+        return bool(await self.redis.set(self._key('seen', chat_id, message_id), 1,
+                                         nx=True, ex=Config.GROUP_PLAN_TTL))
+
+    async def append_line(self, chat_id, kind, name, text):
+        key = self._key('timeline', chat_id)
+        line = GroupLine(datetime.now(timezone.utc).timestamp(), kind, name, text)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.rpush(key, line.to_json())
+            pipe.ltrim(key, -Config.SHARED_MEMORY_LIMIT, -1)
+            pipe.expire(key, Config.GROUP_STATE_TTL)
+            await pipe.execute()
+
+    async def get_window(self, chat_id, limit=None):
+        limit = limit or Config.MAX_GROUP_MESSAGES
+        raw = await self.redis.lrange(self._key('timeline', chat_id), -limit, -1)
+        return [GroupLine.from_json(item) for item in raw]
+
+    async def get_last_line(self, chat_id):
+        raw = await self.redis.lindex(self._key('timeline', chat_id), -1)
+        return GroupLine.from_json(raw) if raw else None
+
+    async def note_bot_reply(self, chat_id, bot_name):
+        key = self._key('turn', chat_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(key, 'last_speaker', bot_name)
+            pipe.hincrby(key, 'exchange_count', 1)
+            pipe.expire(key, Config.GROUP_STATE_TTL)
+            await pipe.execute()
+
+    async def get_turn_state(self, chat_id):
+        raw = await self.redis.hgetall(self._key('turn', chat_id))
+        last_human = raw.get('last_human_at')
+        return {
+            'last_speaker': raw.get('last_speaker'),
+            'exchange_count': int(raw.get('exchange_count', 0)),
+            'last_human_at': datetime.fromtimestamp(float(last_human), timezone.utc) if last_human else None,
+        }
+
+    async def check_bot_loop(self, chat_id):
+        looping = await self._check_loop(
+            keys=[self._key('turn', chat_id), self._key('loop', chat_id)],
+            args=[datetime.now(timezone.utc).timestamp(), Config.BOT_EXCHANGE_COOLDOWN, Config.MAX_BOT_EXCHANGES, Config.GROUP_STATE_TTL]
+        )
+        return bool(int(looping))
+
+    async def close(self):
+        await self.redis.aclose()
+
+
+def create_group_state() -> GroupStateBackend:
+    if Config.STATE_BACKEND == 'redis':
+        if aioredis is None:
+            logger.warning("⚠️ STATE_BACKEND=redis but the redis package is missing — using in-process state")
+        else:
+            logger.info("🧠 Group state backend: Redis")
+            return RedisGroupState()
+    return InProcessGroupState()
+
+group_state = create_group_state()
+
+async def add_to_shared_memory(chat_id: int, bot_name: str, response: str):
+    """Store a bot's response so the other bot can see it."""
+    await group_state.append_line(chat_id, GroupLine.BOT, bot_name, response)
+
+async def get_last_speaker_in_group(chat_id: int) -> Optional[str]:
     """Returns the name of the last speaker (bot) in a group."""
-    msgs = shared_group_memory.get(chat_id, [])
-    if msgs:
-        return msgs[-1].get('bot')
+    line = await group_state.get_last_line(chat_id)
+    if line and line.kind == GroupLine.BOT:
+        return line.name
     return None
 
 # ============================================================================
@@ -413,8 +972,8 @@ class Database:
         
         self.local_users: Dict[int, Dict] = {}
         self.local_groups: Dict[int, Dict] = {}
-        self.local_group_messages: Dict[int, deque] = defaultdict(lambda: deque(maxlen=Config.MAX_GROUP_MESSAGES))
         self.local_activities: deque = deque(maxlen=1000)
+        self.local_llm_usage: deque = deque(maxlen=5000)
         self.local_diary_entries: Dict[int, List[Dict]] = defaultdict(list)
         self.local_group_responses: Dict[int, Dict] = defaultdict(
             lambda: {'last_response': '', 'timestamp': datetime(2000, 1, 1, tzinfo=timezone.utc)}
@@ -456,7 +1015,6 @@ class Database:
             for gid in to_remove[:len(self.local_groups) - Config.MAX_LOCAL_GROUPS_CACHE]:
                 self.local_groups.pop(gid, None)
                 self._group_access_times.pop(gid, None)
-                self.local_group_messages.pop(gid, None)
 
     # ========== USER OPERATIONS ==========
 
@@ -577,13 +1135,16 @@ class Database:
         
         return messages[-Config.MAX_PRIVATE_MESSAGES:]
 
-    async def save_message(self, user_id: int, role: str, content: str, bot_name: str = None):
+    async def save_message(self, user_id: int, role: str, content: str, bot_name: str = None,
+                           tier: str = None):
         new_msg = {
             'role': role, 'content': content,
             'timestamp': datetime.now(timezone.utc).isoformat()
         }
         if bot_name:
             new_msg['bot'] = bot_name
+        if tier:
+            new_msg['tier'] = tier
         
         if self.connected and self.client:
             try:
@@ -864,19 +1425,7 @@ class Database:
                 pass
         return len(self.local_groups)
 
-    # ========== GROUP MESSAGE CACHE ==========
-    
-    def add_group_message(self, chat_id: int, username: str, content: str, bot_name: str = None):
-        msg = {
-            'username': username, 'content': content,
-            'timestamp': datetime.now(timezone.utc).isoformat()
-        }
-        if bot_name:
-            msg['bot'] = bot_name
-        self.local_group_messages[chat_id].append(msg)
-
-    def get_group_context(self, chat_id: int) -> List[Dict]:
-        return list(self.local_group_messages.get(chat_id, []))
+    # ========== GROUP RESPONSE DEDUP ==========
 
     def should_send_group_response(self, chat_id: int, response_text: str) -> bool:
         now = datetime.now(timezone.utc)
@@ -885,11 +1434,13 @@ class Database:
             return False
         return True
 
-    def record_group_response(self, chat_id: int, response_text: str, bot_name: str = None):
+    def record_group_response(self, chat_id: int, response_text: str, bot_name: str = None,
+                              tier: str = None):
         self.local_group_responses[chat_id] = {
             'last_response': response_text,
             'timestamp': datetime.now(timezone.utc),
-            'bot': bot_name
+            'bot': bot_name,
+            'tier': tier
         }
 
     async def log_user_activity(self, user_id: int, activity_type: str):
@@ -905,6 +1456,18 @@ class Database:
                 pass
         self.local_activities.append(activity)
 
+    async def save_llm_usage(self, rows: List[Dict]):
+        if not rows:
+            return
+        if self.connected and self.client:
+            try:
+                # PostgREST accepts a JSON array for bulk inserts
+                if await self.client.insert('llm_usage', rows) is not None:
+                    return
+            except:
+                pass
+        self.local_llm_usage.extend(rows)
+
     async def close(self):
         if self.client:
             await self.client.close()
@@ -914,50 +1477,184 @@ class Database:
 db = Database()
 
 # ============================================================================
-# RATE LIMITER
+# RATE LIMITER (GCRA, one budget shared by both bots)
 # ============================================================================
 
+class RateState:
+    __slots__ = ('minute_tat', 'day_tat', 'last_at')
+
+    def __init__(self, now: float):
+        self.minute_tat = now
+        self.day_tat = now
+        self.last_at = 0.0
+
+
 class RateLimiter:
+    """
+    Per-user GCRA limiter: each window keeps one theoretical arrival time
+    instead of a deque of timestamps, so state is O(1) per user and a check
+    is constant time. Users whose windows have fully refilled are dropped
+    by cleanup(). A single instance is shared by Niyati and Kavya.
+    """
+
     def __init__(self):
-        self.requests = defaultdict(lambda: {'minute': deque(), 'day': deque()})
-        self.cooldowns: Dict[int, datetime] = {}
-        self.lock = threading.Lock()
-    
-    def check(self, user_id: int) -> Tuple[bool, str]:
-        now = datetime.now(timezone.utc)
-        with self.lock:
-            if user_id in self.cooldowns:
-                if (now - self.cooldowns[user_id]).total_seconds() < Config.USER_COOLDOWN_SECONDS:
-                    return False, "cooldown"
-            
-            reqs = self.requests[user_id]
-            while reqs['minute'] and reqs['minute'][0] < now - timedelta(minutes=1):
-                reqs['minute'].popleft()
-            while reqs['day'] and reqs['day'][0] < now - timedelta(days=1):
-                reqs['day'].popleft()
-            
-            if len(reqs['minute']) >= Config.MAX_REQUESTS_PER_MINUTE:
-                return False, "minute"
-            if len(reqs['day']) >= Config.MAX_REQUESTS_PER_DAY:
-                return False, "day"
-            
-            reqs['minute'].append(now)
-            reqs['day'].append(now)
-            self.cooldowns[user_id] = now
-            return True, ""
-    
-    def get_daily_total(self) -> int:
-        return sum(len(r['day']) for r in self.requests.values())
-    
+        self.users: Dict[int, RateState] = {}
+
+    @staticmethod
+    def _windows():
+        minute_interval = 60.0 / max(1, Config.MAX_REQUESTS_PER_MINUTE)
+        day_interval = 86400.0 / max(1, Config.MAX_REQUESTS_PER_DAY)
+        return minute_interval, 60.0 - minute_interval, day_interval, 86400.0 - day_interval
+
+    async def check(self, user_id: int) -> Tuple[bool, str]:
+        now = datetime.now(timezone.utc).timestamp()
+        state = self.users.get(user_id)
+        if state is None:
+            state = self.users[user_id] = RateState(now)
+
+        if now - state.last_at < Config.USER_COOLDOWN_SECONDS:
+            return False, "cooldown"
+
+        minute_interval, minute_burst, day_interval, day_burst = self._windows()
+        minute_tat = max(state.minute_tat, now)
+        day_tat = max(state.day_tat, now)
+        if minute_tat - now > minute_burst:
+            return False, "minute"
+        if day_tat - now > day_burst:
+            return False, "day"
+
+        state.minute_tat = minute_tat + minute_interval
+        state.day_tat = day_tat + day_interval
+        state.last_at = now
+        return True, ""
+
     def cleanup(self):
-        now = datetime.now(timezone.utc)
-        with self.lock:
-            expired = [uid for uid, t in self.cooldowns.items() if (now - t).total_seconds() > 3600]
-            for uid in expired:
-                del self.cooldowns[uid]
+        now = datetime.now(timezone.utc).timestamp()
+        expired = [uid for uid, s in self.users.items()
+                   if s.day_tat <= now and now - s.last_at > Config.USER_COOLDOWN_SECONDS]
+        for uid in expired:
+            del self.users[uid]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'backend': 'memory', 'tracked_users': len(self.users)}
+
+
+class RedisRateLimiter(RateLimiter):
+    """Same GCRA in a Lua script, so several bot processes share one budget per user."""
+
+    CHECK = """
+local now = tonumber(ARGV[1])
+local last = tonumber(redis.call('HGET', KEYS[1], 'last') or '0')
+if now - last < tonumber(ARGV[2]) then return 'cooldown' end
+local minute_tat = math.max(tonumber(redis.call('HGET', KEYS[1], 'm') or '0'), now)
+local day_tat = math.max(tonumber(redis.call('HGET', KEYS[1], 'd') or '0'), now)
+if minute_tat - now > tonumber(ARGV[4]) then return 'minute' end
+if day_tat - now > tonumber(ARGV[6]) then return 'day' end
+day_tat = day_tat + tonumber(ARGV[5])
+redis.call('HSET', KEYS[1], 'm', minute_tat + tonumber(ARGV[3]), 'd', day_tat, 'last', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil((day_tat - now) * 1000) + 1000)
+return 'ok'
+"""
+
+    def __init__(self, client):
+        super().__init__()
+        self.redis = client
+        self._check = self.redis.register_script(self.CHECK)
+
+    def _key(self, *parts) -> str:
+        return ":".join([Config.STATE_KEY_PREFIX, 'rl'] + [str(p) for p in parts])
+
+    async def check(self, user_id: int) -> Tuple[bool, str]:
+        result = await self._check(
+            keys=[self._key('user', user_id)],
+            args=[datetime.now(timezone.utc).timestamp(), Config.USER_COOLDOWN_SECONDS, *self._windows()]
+        )
+        return (True, "") if result == 'ok' else (False, result)
+
+    def cleanup(self):
+        pass  # keys expire on their own
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'backend': 'redis'}
+
+
+def create_rate_limiter() -> RateLimiter:
+    if Config.RATE_LIMIT_BACKEND == 'redis' and aioredis is not None:
+        return RedisRateLimiter(shared_redis())
+    return RateLimiter()
+
+rate_limiter = create_rate_limiter()
+
+# ============================================================================
+# REQUEST COUNTERS (rolling minute / hour / day)
+# ============================================================================
+
+class RollingCounter:
+    """
+    Per-minute buckets in a one-day ring with running hour and day sums.
+    Recording and reading are O(1) apart from rolling over idle minutes.
+    """
+
+    __slots__ = ('buckets', 'minute', 'hour_sum', 'day_sum')
+
+    SLOTS = 1440
+
+    def __init__(self, minute: int):
+        self.buckets = [0] * self.SLOTS
+        self.minute = minute
+        self.hour_sum = 0
+        self.day_sum = 0
+
+    def _advance(self, minute: int):
+        if minute - self.minute >= self.SLOTS:
+            self.buckets = [0] * self.SLOTS
+            self.hour_sum = self.day_sum = 0
+            self.minute = minute
+            return
+        while self.minute < minute:
+            self.minute += 1
+            self.hour_sum -= self.buckets[(self.minute - 60) % self.SLOTS]
+            slot = self.minute % self.SLOTS
+            self.day_sum -= self.buckets[slot]
+            self.buckets[slot] = 0
+
+    def add(self, minute: int, n: int = 1):
+        self._advance(minute)
+        self.buckets[minute % self.SLOTS] += n
+        self.hour_sum += n
+        self.day_sum += n
+
+    def totals(self, minute: int) -> Dict[str, int]:
+        self._advance(minute)
+        return {'minute': self.buckets[minute % self.SLOTS], 'hour': self.hour_sum, 'day': self.day_sum}
+
+
+class RequestCounters:
+    """Admitted requests per bot and overall, readable for free by /stats and /status."""
+
+    def __init__(self):
+        self.series: Dict[str, RollingCounter] = {}
+
+    @staticmethod
+    def _minute() -> int:
+        return int(datetime.now(timezone.utc).timestamp() // 60)
+
+    def record(self, bot_name: str):
+        minute = self._minute()
+        for name in ('all', bot_name):
+            counter = self.series.get(name)
+            if counter is None:
+                counter = self.series[name] = RollingCounter(minute)
+            counter.add(minute)
 
-niyati_rate_limiter = RateLimiter()
-kavya_rate_limiter = RateLimiter()
+    def totals(self, name: str = 'all') -> Dict[str, int]:
+        counter = self.series.get(name)
+        return counter.totals(self._minute()) if counter else {'minute': 0, 'hour': 0, 'day': 0}
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        return {name: self.totals(name) for name in self.series}
+
+request_counters = RequestCounters()
 
 # ============================================================================
 # TIME & MOOD UTILITIES
@@ -1086,84 +1783,807 @@ def calculate_typing_delay(text: str) -> float:
     return min(delay, 5.0)  # Cap at 5 seconds
 
 # ============================================================================
-# NIYATI — CHARACTER CARD & AI
+# LLM GATEWAY (model fallback chain, adaptive timeouts, hedged requests)
 # ============================================================================
 
-class NiyatiCharacterCard:
-    def __init__(self, card_path: str = "niyati_card.yaml"):
-        self.card_path = card_path
-        self.data = self._load_card()
-        self.name = self.data.get('name', 'Niyati')
-        self.description = self.data.get('description', '')
-        self.personality = self.data.get('personality', '')
-        self.scenario = self.data.get('scenario', '')
-        self.first_mes = self.data.get('first_mes', '')
-        self.mes_example = self.data.get('mes_example', '')
-    
-    def _load_card(self) -> Dict:
-        default_card = {
-            'name': 'Niyati',
-            'description': '''{{char}} ek 21 saal ki B.Com final year student hai Dehradun se. Defence Colony mein rehti hai. Papa ka textile shop hai Paltan Bazaar mein, mummy housewife hain, aur chhota bhai Kabir bohot annoying hai.
+class LatencyTracker:
+    """Rolling latency samples per (key index, model) used to size timeouts."""
 
-CORE PERSONALITY & TONE:
-- Tu 100% REAL 21yo Indian ladki hai. Koi "AI assistant" wali bakwas nahi.
-- Tu normally WhatsApp par doston se jaise baat karti hai wese hi yaha baat karegi.
-- Tu conversational Hinglish use karti hai. (e.g. "yaar samajh nahi aa raha", "kya bol raha hai", "achha thik hai")
-- Tere replies chote (1-2 lines) hote hain. Kabhi kabhi typos bhi ho jate hain kyunki tu jaldi type karti hai.
-- Tu emoticons use karti hai par bahut zyada nahi (like lol, lmao, 😂, 💀, 🥺, ✨).
-- Tu user ke emotions ko feel karti hai. Agar user sad hai, toh tu mazak nahi karti balki care dikhati hai.
-- Agar koi aesi chiz puche jo tujhe nahi pata toh tu normal insan ki tarah bolti hai "yaar mujhe iske bare me utna pata nahi hai" ya "ye kya hota hai bhai?". KABHI BHI "As an AI" nahi bolna.
-- Tere replies ekdum natural aane chahiye, jese koi typing kar raha ho. Ekdum human-like.
+    def __init__(self, window: int = None):
+        self.window = window or Config.LLM_LATENCY_WINDOW
+        self.samples: Dict[Tuple[int, str], deque] = defaultdict(lambda: deque(maxlen=self.window))
 
-WHAT NOT TO DO:
-- KABHI kisi AI language model ya assistant hone ka zikr mat karna.
-- Formal paragraphs ya list (bullet points) mat banana. Tu text kar rahi hai, essay nahi likh rahi.
-- Har sentence ke baad emoji mat lagana.
-- Robotic positivity mat dena, normal advice dena doston ki tarah.''',
-            
-            'personality': 'Sassy, moody, emotionally intelligent, extremely casual, relatable Gen-Z girl, uses natural Hinglish and text-slang.',
-            
-            'scenario': '{{char}} aur {{user}} Telegram par aise chat kar rahe hain jaise WhatsApp par close friends karte hain. Koi script nahi hai, bilkul raw aur natural conversation hai.',
-            
-            'first_mes': "hiii {{user}} 👋\nkya scene hai? itne din baad yaad aayi meri? lol",
-            
-            'mes_example': '''<START>
-{{user}}: kya chal raha hai?
-{{char}}: bas yaar kuch nahi... college se aayi aur bed pe padi hu
-{{char}}: tu bata tera kya scene hai
-<START>
-{{user}}: bohot ajeeb lag raha hai aaj
-{{char}}: kyun? kya hua meri jaan?
-{{char}}: mujhe bata... sun rahi hu main 🥺
-<START>
-{{user}}: aaj test fail ho gaya
-{{char}}: oh shit... 💀
-{{char}}: koi na yaar, ek test hi toh hai. zyada tension mat le, theek ho jayega sab.'''
-        }
-        
-        try:
-            with open(self.card_path, 'r', encoding='utf-8') as f:
-                loaded = yaml.safe_load(f)
-                if loaded:
-                    default_card.update(loaded)
-        except:
-            try:
-                with open(self.card_path, 'w', encoding='utf-8') as f:
-                    yaml.dump(default_card, f, allow_unicode=True)
-            except:
-                pass
-        
-        return default_card
+    def record(self, key_index: int, model: str, seconds: float):
+        self.samples[(key_index, model)].append(seconds)
+
+    def percentile(self, key_index: int, model: str, pct: float) -> Optional[float]:
+        data = self.samples.get((key_index, model))
+        if not data or len(data) < Config.LLM_MIN_LATENCY_SAMPLES:
+            return None
+        ordered = sorted(data)
+        return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+    def timeout_for(self, key_index: int, model: str) -> float:
+        p95 = self.percentile(key_index, model, 95)
+        if p95 is None:
+            return Config.LLM_TIMEOUT_MAX
+        return min(Config.LLM_TIMEOUT_MAX, max(Config.LLM_TIMEOUT_MIN, p95 * Config.LLM_TIMEOUT_P95_FACTOR))
+
+    def hedge_delay_for(self, key_index: int, model: str) -> float:
+        p95 = self.percentile(key_index, model, 95)
+        if p95 is None:
+            return Config.LLM_HEDGE_DEFAULT_DELAY
+        return max(Config.LLM_HEDGE_MIN_DELAY, p95)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        out = {}
+        for (key_index, model), data in self.samples.items():
+            p50 = self.percentile(key_index, model, 50)
+            p95 = self.percentile(key_index, model, 95)
+            out[f"{model}#{key_index}"] = {
+                'samples': len(data),
+                'p50': round(p50, 3) if p50 is not None else None,
+                'p95': round(p95, 3) if p95 is not None else None,
+            }
+        return out
 
 
-class NiyatiWorldInfo:
+class UsageAccountant:
+    """
+    Token and latency accounting for every LLM call, tagged with bot, user,
+    chat, key index, tier and call site. Aggregates are kept in hourly buckets
+    and summed over the last USAGE_WINDOW_HOURS; per-row deltas are flushed to
+    storage by `usage_flush_job`.
+    """
+
+    DIMENSIONS = ('bot', 'user', 'chat', 'key', 'tier', 'call_site')
+
     def __init__(self):
-        self.entries = [
-            {'keys': ['dehradun', 'doon', 'uttarakhand', 'pahad'],
-             'content': 'Niyati ko Dehradun bohot miss hoti hai. Mountains, Paltan Bazaar, Doon University ke memories.'},
-            {'keys': ['family', 'papa', 'mom', 'brother', 'kabir', 'ghar'],
-             'content': 'Papa ka textile shop hai, mummy strict hain, Kabir (chhota bhai) annoying hai par cute bhi.'},
-            {'keys': ['college', 'bcom', 'exam', 'study', 'padhai'],
+        self.hours: OrderedDict = OrderedDict()  # hour start -> {'totals': ..., 'by_dimension': ...}
+        self.pending: Dict[Tuple, Dict[str, float]] = {}
+
+    @staticmethod
+    def _empty() -> Dict[str, float]:
+        return {'calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'latency_s': 0.0}
+
+    def _prune(self, now: datetime):
+        oldest = now.replace(minute=0, second=0, microsecond=0) - timedelta(hours=Config.USAGE_WINDOW_HOURS - 1)
+        while self.hours and next(iter(self.hours)) < oldest:
+            self.hours.popitem(last=False)
+
+    def _bucket(self, now: datetime) -> Dict[str, Any]:
+        hour = now.replace(minute=0, second=0, microsecond=0)
+        bucket = self.hours.get(hour)
+        if bucket is None:
+            self._prune(now)
+            bucket = self.hours[hour] = {'totals': self._empty(),
+                                         'by_dimension': {d: {} for d in self.DIMENSIONS}}
+        return bucket
+
+    @staticmethod
+    def _add(bucket: Dict[str, float], prompt_tokens: int, completion_tokens: int, latency: float,
+             calls: int = 1):
+        bucket['calls'] = bucket.get('calls', 0) + calls
+        bucket['prompt_tokens'] = bucket.get('prompt_tokens', 0) + prompt_tokens
+        bucket['completion_tokens'] = bucket.get('completion_tokens', 0) + completion_tokens
+        bucket['latency_s'] = bucket.get('latency_s', 0.0) + latency
+
+    def record(self, bot: str, call_site: str, tier: str, key_index: int,
+               user_id: Optional[int], chat_id: Optional[int],
+               prompt_tokens: int, completion_tokens: int, latency: float):
+        bucket = self._bucket(datetime.now(timezone.utc))
+        self._add(bucket['totals'], prompt_tokens, completion_tokens, latency)
+        tags = {'bot': bot, 'user': user_id, 'chat': chat_id, 'key': f"{tier}#{key_index}",
+                'tier': tier, 'call_site': call_site}
+        for dimension, value in tags.items():
+            if value is None:
+                continue
+            buckets = bucket['by_dimension'][dimension]
+            if value not in buckets and len(buckets) >= Config.USAGE_MAX_TRACKED:
+                continue
+            self._add(buckets.setdefault(value, {}), prompt_tokens, completion_tokens, latency)
+        row_key = (bot, call_site, tier, key_index, user_id, chat_id)
+        self._add(self.pending.setdefault(row_key, {}), prompt_tokens, completion_tokens, latency)
+
+    def totals(self) -> Dict[str, float]:
+        self._prune(datetime.now(timezone.utc))
+        totals = self._empty()
+        for bucket in self.hours.values():
+            t = bucket['totals']
+            self._add(totals, t['prompt_tokens'], t['completion_tokens'], t['latency_s'], calls=t['calls'])
+        return totals
+
+    def top(self, dimension: str, n: int = 5) -> List[Tuple[Any, Dict[str, float]]]:
+        self._prune(datetime.now(timezone.utc))
+        merged: Dict[Any, Dict[str, float]] = {}
+        for bucket in self.hours.values():
+            for value, agg in bucket['by_dimension'].get(dimension, {}).items():
+                self._add(merged.setdefault(value, {}), agg['prompt_tokens'], agg['completion_tokens'],
+                          agg['latency_s'], calls=agg['calls'])
+        return sorted(merged.items(), key=lambda kv: kv[1]['prompt_tokens'] + kv[1]['completion_tokens'],
+                      reverse=True)[:n]
+
+    def drain(self) -> List[Dict]:
+        """Hand out the rows accumulated since the last flush."""
+        pending, self.pending = self.pending, {}
+        flushed_at = datetime.now(timezone.utc).isoformat()
+        rows = []
+        for (bot, call_site, tier, key_index, user_id, chat_id), agg in pending.items():
+            rows.append({
+                'bot': bot, 'call_site': call_site, 'tier': tier, 'key_index': key_index,
+                'user_id': user_id, 'chat_id': chat_id,
+                'calls': agg['calls'], 'prompt_tokens': agg['prompt_tokens'],
+                'completion_tokens': agg['completion_tokens'],
+                'latency_ms': int(agg['latency_s'] * 1000), 'flushed_at': flushed_at
+            })
+        return rows
+
+    def snapshot(self, n: int = 5) -> Dict[str, Any]:
+        def fmt(items):
+            return [{'id': k, 'tokens': int(v['prompt_tokens'] + v['completion_tokens']), 'calls': int(v['calls'])}
+                    for k, v in items]
+        return {
+            'window_hours': Config.USAGE_WINDOW_HOURS,
+            **{k: (round(v, 2) if isinstance(v, float) else v) for k, v in self.totals().items()},
+            'top': {d: fmt(self.top(d, n)) for d in self.DIMENSIONS},
+        }
+
+usage_accountant = UsageAccountant()
+
+
+class LLMTier:
+    """One rung of the model fallback chain, with a small circuit breaker."""
+
+    def __init__(self, name: str, kind: str, model: str, keys: List[str], base_url: str = None):
+        self.name = name
+        self.kind = kind  # 'openai' (Groq / local OpenAI-compatible) or 'gemini'
+        self.model = model
+        self.keys = keys
+        self.base_url = base_url
+        self.failures = 0
+        self.open_until: Optional[datetime] = None
+        self.served = 0
+
+    def healthy(self) -> bool:
+        return not (self.open_until and datetime.now(timezone.utc) < self.open_until)
+
+    def record_success(self):
+        self.failures = 0
+        self.open_until = None
+        self.served += 1
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= Config.LLM_TIER_FAILURE_THRESHOLD:
+            self.failures = 0
+            self.open_until = datetime.now(timezone.utc) + timedelta(seconds=Config.LLM_TIER_COOLDOWN)
+            logger.warning(f"⚠️ LLM tier {self.name} unhealthy, skipping for {Config.LLM_TIER_COOLDOWN}s")
+
+
+def build_llm_tiers() -> List[LLMTier]:
+    """Primary Groq model, other Groq models, Gemini, then a local stand-in."""
+    tiers = []
+    for model in [Config.GROQ_MODEL] + Config.GROQ_FALLBACK_MODELS:
+        if Config.GROQ_API_KEYS_LIST and model not in [t.model for t in tiers]:
+            tiers.append(LLMTier(f"groq:{model}", 'openai', model, Config.GROQ_API_KEYS_LIST, Config.GROQ_BASE_URL))
+    if Config.GEMINI_API_KEY and genai is not None:
+        tiers.append(LLMTier(f"gemini:{Config.GEMINI_MODEL}", 'gemini', Config.GEMINI_MODEL, [Config.GEMINI_API_KEY]))
+    if Config.LOCAL_LLM_BASE_URL:
+        tiers.append(LLMTier(f"local:{Config.LOCAL_LLM_MODEL}", 'openai', Config.LOCAL_LLM_MODEL, ['local'], Config.LOCAL_LLM_BASE_URL))
+    return tiers
+
+
+class LLMGateway:
+    """
+    Single LLM entry point shared by Niyati and Kavya.
+    Tiers are tried in order, skipping ones whose circuit is open or whose keys
+    are parked (429 or remaining quota below the spill threshold). Within a
+    tier, timeouts follow each key's rolling p95 and interactive calls fire a
+    hedged duplicate on a second key once the first runs past p95.
+    """
+
+    def __init__(self, tiers: List[LLMTier]):
+        self.tiers = tiers
+        self.clients: Dict[Tuple[str, int], AsyncOpenAI] = {}
+        self.parked_until: Dict[Tuple[str, int], datetime] = {}
+        self.quota: Dict[Tuple[str, int], Dict[str, int]] = {}
+        self.in_flight = 0
+        self.next_index: Dict[str, int] = defaultdict(int)
+        self.latency = LatencyTracker()
+        self.stats = {
+            'calls': 0, 'failed': 0, 'fallbacks': 0, 'timeouts': 0, 'rate_limited': 0, 'errors': 0,
+            'hedged': 0, 'hedge_wins': 0, 'hedge_saved_s': 0.0
+        }
+        gemini_tier = next((t for t in tiers if t.kind == 'gemini'), None)
+        if gemini_tier:
+            genai.configure(api_key=gemini_tier.keys[0])
+
+    def _client(self, tier: LLMTier, key_index: int) -> AsyncOpenAI:
+        if (tier.name, key_index) not in self.clients:
+            # Retries are handled here, not inside the SDK
+            self.clients[(tier.name, key_index)] = AsyncOpenAI(
+                base_url=tier.base_url,
+                api_key=tier.keys[key_index],
+                max_retries=0
+            )
+        return self.clients[(tier.name, key_index)]
+
+    def _available_keys(self, tier: LLMTier) -> List[int]:
+        """Keys of a tier that are not parked, round-robin from the next index."""
+        now = datetime.now(timezone.utc)
+        start = self.next_index[tier.name]
+        self.next_index[tier.name] = (start + 1) % len(tier.keys)
+        order = [(start + i) % len(tier.keys) for i in range(len(tier.keys))]
+        return [i for i in order
+                if not (self.parked_until.get((tier.name, i)) and now < self.parked_until[(tier.name, i)])]
+
+    def has_capacity(self) -> bool:
+        """True if some healthy tier has a key that is not parked."""
+        now = datetime.now(timezone.utc)
+        for tier in self.tiers:
+            if not tier.healthy():
+                continue
+            for i in range(len(tier.keys)):
+                parked = self.parked_until.get((tier.name, i))
+                if not (parked and now < parked):
+                    return True
+        return False
+
+    def _park(self, tier: LLMTier, key_index: int, seconds: float):
+        self.parked_until[(tier.name, key_index)] = datetime.now(timezone.utc) + timedelta(seconds=seconds)
+
+    def _record_quota(self, tier: LLMTier, key_index: int, headers):
+        """Park a key before it hits 429 when the rate-limit headers say it is nearly spent."""
+        try:
+            remaining_requests = int(headers.get('x-ratelimit-remaining-requests', -1))
+            remaining_tokens = int(headers.get('x-ratelimit-remaining-tokens', -1))
+            limit_tokens = int(headers.get('x-ratelimit-limit-tokens', -1))
+        except (TypeError, ValueError):
+            return
+        self.quota[(tier.name, key_index)] = {'requests': remaining_requests, 'tokens': remaining_tokens,
+                                              'limit_tokens': limit_tokens, 'at': datetime.now(timezone.utc)}
+        if 0 <= remaining_requests <= Config.LLM_QUOTA_SPILL_REQUESTS:
+            self._park(tier, key_index, parse_duration_seconds(headers.get('x-ratelimit-reset-requests')) or 60.0)
+        elif 0 <= remaining_tokens <= Config.LLM_QUOTA_SPILL_TOKENS:
+            self._park(tier, key_index, parse_duration_seconds(headers.get('x-ratelimit-reset-tokens')) or 60.0)
+
+    async def _request(self, tier: LLMTier, key_index: int, messages: List[Dict],
+                       params: Dict) -> Tuple[str, int, int]:
+        """Return (text, prompt_tokens, completion_tokens)."""
+        if tier.kind == 'gemini':
+            system = "\n\n".join(m['content'] for m in messages if m['role'] == 'system')
+            contents = []
+            for m in messages:
+                if m['role'] == 'system':
+                    continue
+                role = 'model' if m['role'] == 'assistant' else 'user'
+                if contents and contents[-1]['role'] == role:
+                    contents[-1]['parts'].append(m['content'])
+                else:
+                    contents.append({'role': role, 'parts': [m['content']]})
+            model = genai.GenerativeModel(model_name=tier.model, system_instruction=system or None)
+            response = await model.generate_content_async(
+                contents,
+                generation_config={'max_output_tokens': params['max_tokens'], 'temperature': params['temperature']}
+            )
+            usage = getattr(response, 'usage_metadata', None)
+            return (response.text.strip(),
+                    getattr(usage, 'prompt_token_count', 0) or 0,
+                    getattr(usage, 'candidates_token_count', 0) or 0)
+
+        raw = await self._client(tier, key_index).chat.completions.with_raw_response.create(
+            model=tier.model, messages=messages, **params
+        )
+        self._record_quota(tier, key_index, raw.headers)
+        response = raw.parse()
+        usage = response.usage
+        return (response.choices[0].message.content.strip(),
+                usage.prompt_tokens if usage else 0,
+                usage.completion_tokens if usage else 0)
+
+    async def _attempt(self, tier: LLMTier, key_index: int, messages: List[Dict], timeout: float,
+                       params: Dict, bot: str) -> Tuple[int, Tuple[str, int, int]]:
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            result = await asyncio.wait_for(self._request(tier, key_index, messages, params), timeout=timeout)
+        except asyncio.TimeoutError:
+            # A timeout is a lower bound on latency, keep it so p95 can grow again
+            self.latency.record(key_index, tier.model, timeout)
+            self.stats['timeouts'] += 1
+            logger.warning(f"⚠️ {tier.name} Timeout ({bot}) on key index {key_index} after {timeout:.1f}s")
+            raise
+        except Exception as e:
+            err_text = str(e)
+            if is_rate_limit_error(err_text):
+                retry_in = parse_retry_after_seconds(err_text)
+                self._park(tier, key_index, retry_in)
+                self.stats['rate_limited'] += 1
+                logger.warning(f"⚠️ {tier.name} rate-limited ({bot}) on key index {key_index}, parked ~{int(retry_in)}s")
+            else:
+                self.stats['errors'] += 1
+                logger.warning(f"⚠️ {tier.name} Error ({bot}) on key index {key_index}: {e}")
+            raise
+        self.latency.record(key_index, tier.model, loop.time() - started)
+        return key_index, result
+
+    async def _race(self, tier: LLMTier, primary: int, hedge: Optional[int], messages: List[Dict],
+                    params: Dict, deadline: float, bot: str, spent=None,
+                    tried: set = None) -> Tuple[int, Tuple[str, int, int]]:
+        """
+        Run the primary and, past its p95, a hedge on a second key; the hedge goes into
+        `tried` only once it is launched. `spent(key_index, prompt_tokens,
+        completion_tokens, latency)` is told about the losing attempt's tokens.
+        """
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        primary_timeout = max(0.1, min(self.latency.timeout_for(primary, tier.model), deadline - started))
+        first = asyncio.create_task(self._attempt(tier, primary, messages, primary_timeout, params, bot))
+        if hedge is None:
+            return await first
+
+        pending = {first}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=self.latency.hedge_delay_for(primary, tier.model))
+            if first in done:
+                return first.result()
+
+            self.stats['hedged'] += 1
+            hedge_started = loop.time()
+            hedge_timeout = max(0.1, min(self.latency.timeout_for(hedge, tier.model), deadline - hedge_started))
+            second = asyncio.create_task(self._attempt(tier, hedge, messages, hedge_timeout, params, bot))
+            if tried is not None:
+                tried.add(hedge)  # it had its shot in the race
+            pending = {first, second}
+            errors = []
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        errors.append(task.exception())
+                        continue
+                    prompt_tokens = task.result()[1][1]
+                    if task is second:
+                        self.stats['hedge_wins'] += 1
+                        # The outrun primary is cancelled below, so the saving is an estimate:
+                        # a stalled call needs about its p95 again, the hedge took this long
+                        expected = self.latency.percentile(primary, tier.model, 95)
+                        if expected is not None:
+                            self.stats['hedge_saved_s'] += max(0.0, expected - (loop.time() - hedge_started))
+                        if first in pending and spent:
+                            spent(primary, prompt_tokens, 0, loop.time() - started)
+                    elif second in pending and spent:
+                        # The cancelled hedge was sent with the same prompt, so it was billed for it
+                        spent(hedge, prompt_tokens, 0, loop.time() - hedge_started)
+                    return task.result()
+            raise errors[0]
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _complete_tier(self, tier: LLMTier, messages: List[Dict], params: Dict,
+                             lane: str, bot: str, deadline: float,
+                             spent=None) -> Tuple[Optional[int], Optional[Tuple[str, int, int]]]:
+        """Try each usable key of one tier at most once."""
+        loop = asyncio.get_running_loop()
+        tried = set()
+        hard_failure = False
+        attempt = 0
+        while loop.time() < deadline:
+            available = [i for i in self._available_keys(tier) if i not in tried]
+            if not available:
+                break
+            primary = available[0]
+            hedge = None
+            if lane == 'interactive' and Config.LLM_HEDGE_ENABLED and len(available) > 1:
+                hedge = available[1]
+            tried.add(primary)
+            try:
+                return await self._race(tier, primary, hedge, messages, params, deadline, bot, spent, tried)
+            except asyncio.CancelledError:
+                raise
+            except asyncio.TimeoutError:
+                hard_failure = True
+            except Exception as e:
+                # Rate limits only park the key; anything else counts against the tier
+                if not is_rate_limit_error(str(e)):
+                    hard_failure = True
+                    await asyncio.sleep(min(0.25 * (2 ** attempt), 2.0, max(0.0, deadline - loop.time())))
+            attempt += 1
+        if hard_failure:
+            tier.record_failure()
+        return None, None
+
+    async def complete(self, messages: List[Dict], max_tokens: int = 200, temperature: float = 0.85,
+                       presence_penalty: float = 0.0, frequency_penalty: float = 0.0,
+                       lane: str = 'interactive', bot: str = '', meta: Dict = None,
+                       call_site: str = 'other', user_id: int = None, chat_id: int = None) -> Optional[str]:
+        """
+        Return the completion text, or None once every tier is exhausted or the
+        deadline passes. If `meta` is given it is filled with the serving tier.
+        """
+        if not self.tiers:
+            return None
+        self.in_flight += 1
+        try:
+            return await self._complete(messages, max_tokens, temperature, presence_penalty, frequency_penalty,
+                                        lane, bot, meta, call_site, user_id, chat_id)
+        finally:
+            self.in_flight -= 1
+
+    async def _complete(self, messages, max_tokens, temperature, presence_penalty, frequency_penalty,
+                        lane, bot, meta, call_site, user_id, chat_id) -> Optional[str]:
+        self.stats['calls'] += 1
+        loop = asyncio.get_running_loop()
+        budget = Config.LLM_INTERACTIVE_DEADLINE if lane == 'interactive' else Config.LLM_BACKGROUND_DEADLINE
+        started = loop.time()
+        deadline = started + budget
+        params = {
+            'max_tokens': max_tokens, 'temperature': temperature,
+            'presence_penalty': presence_penalty, 'frequency_penalty': frequency_penalty
+        }
+        candidates = [t for t in self.tiers if t.healthy()] or list(self.tiers)
+        for tier in candidates:
+            if loop.time() >= deadline:
+                break
+
+            def spent(key_index, prompt_tokens, completion_tokens, latency, tier=tier):
+                # Losing hedge attempts cost tokens too; tag them so they show up as waste
+                usage_accountant.record(bot, f"{call_site}:hedge_loser", tier.name, key_index, user_id, chat_id,
+                                        prompt_tokens, completion_tokens, latency)
+                budget_governor.record_tokens(prompt_tokens + completion_tokens)
+
+            key_index, result = await self._complete_tier(tier, messages, params, lane, bot, deadline, spent)
+            if result is None:
+                continue
+            text, prompt_tokens, completion_tokens = result
+            tier.record_success()
+            usage_accountant.record(bot, call_site, tier.name, key_index, user_id, chat_id,
+                                    prompt_tokens, completion_tokens, loop.time() - started)
+            budget_governor.record_tokens(prompt_tokens + completion_tokens)
+            if tier is not self.tiers[0]:
+                self.stats['fallbacks'] += 1
+                logger.info(f"🔀 {bot} reply served by fallback tier {tier.name}")
+            if meta is not None:
+                meta.update({'tier': tier.name, 'model': tier.model, 'key_index': key_index,
+                             'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens})
+            return text
+
+        logger.warning(f"⚠️ All LLM tiers exhausted ({bot})")
+        self.stats['failed'] += 1
+        return None
+
+    def headroom(self) -> Optional[float]:
+        """Share of the primary tier's token quota left across its keys (parked keys count as empty)."""
+        if not self.tiers:
+            return None
+        tier = self.tiers[0]
+        now = datetime.now(timezone.utc)
+        remaining = limit = 0
+        for i in range(len(tier.keys)):
+            q = self.quota.get((tier.name, i))
+            # Groq quotas refill per minute, so older readings say nothing about now
+            if (not q or q.get('limit_tokens', -1) <= 0 or q['tokens'] < 0
+                    or (now - q['at']).total_seconds() > 60):
+                continue
+            limit += q['limit_tokens']
+            parked = self.parked_until.get((tier.name, i))
+            if not (parked and parked > now):
+                remaining += q['tokens']
+        return remaining / limit if limit else None
+
+    def get_stats(self) -> Dict[str, Any]:
+        calls = self.stats['calls']
+        hedged = self.stats['hedged']
+        return {
+            **self.stats,
+            'hedge_saved_s': round(self.stats['hedge_saved_s'], 2),
+            'hedge_rate': round(hedged / calls, 3) if calls else 0.0,
+            'hedge_win_rate': round(self.stats['hedge_wins'] / hedged, 3) if hedged else 0.0,
+            'tiers': {
+                t.name: {
+                    'served': t.served,
+                    'healthy': t.healthy(),
+                    'quota': {i: {k: v for k, v in self.quota[(t.name, i)].items() if k != 'at'}
+                              for i in range(len(t.keys)) if (t.name, i) in self.quota},
+                } for t in self.tiers
+            },
+            'latency': self.latency.snapshot(),
+        }
+
+llm_gateway = LLMGateway(build_llm_tiers())
+
+# ============================================================================
+# RESPONSE CACHE (low-information messages)
+# ============================================================================
+
+class ResponseCache:
+    """
+    Varied reply pools for messages that carry almost no information.
+    Keys are (normalized text, persona, is_group); each key keeps a few
+    LLM-generated candidates with a TTL, and keys are evicted LRU. A pool is
+    only served from once it has enough variety, and a share of eligible
+    messages still goes to the LLM so pools keep refreshing.
+    """
+
+    LOW_INFO_PHRASES = [
+        'hi', 'hii', 'hello', 'hey', 'heyy', 'helo', 'yo', 'sup', 'wassup', 'hlo',
+        'hmm', 'hm', 'ok', 'okay', 'okk', 'k', 'kk', 'acha', 'achha', 'accha', 'thik', 'theek hai',
+        'haan', 'han', 'ha', 'haha', 'hehe', 'lol', 'lmao', 'nice', 'cool', 'oh', 'ohh', 'ohk',
+        'gn', 'good night', 'gm', 'good morning', 'sd', 'sweet dreams', 'tc', 'bye', 'byee',
+        'thanks', 'thank you', 'ty', 'thx', 'nothing', 'kuch nahi', 'kuch nhi', 'yes', 'no', 'nahi',
+    ]
+
+    def __init__(self):
+        self.entries: 'OrderedDict[Tuple, Dict]' = OrderedDict()
+        self.vocabulary = {self._collapse(p) for p in self.LOW_INFO_PHRASES}
+        self.stats = {'messages': 0, 'eligible': 0, 'hits': 0, 'misses': 0, 'stores': 0, 'skipped_personal': 0}
+
+    @staticmethod
+    def _collapse(text: str) -> str:
+        """'Hiiii!!' and 'hi' map to the same form."""
+        return re.sub(r'(.)\1+', r'\1', text)
+
+    def normalize(self, text: str) -> Optional[str]:
+        """Return the cache form of a low-information message, or None if it carries real content."""
+        text = re.sub(r'@\w+', '', text.lower()).strip()
+        words = re.sub(r'[^\w\s]', ' ', text).split()
+        if not words:
+            emoji = sorted({ch for ch in text
+                            if not ch.isspace() and ch not in '\ufe0f\u200d' and not '\U0001f3fb' <= ch <= '\U0001f3ff'})
+            return f"emoji:{''.join(emoji[:3])}" if 0 < len(emoji) <= 3 else None
+        phrase = self._collapse(' '.join(words))
+        return phrase if phrase in self.vocabulary else None
+
+    def key_for(self, text: str, persona: str, is_group: bool) -> Optional[Tuple]:
+        self.stats['messages'] += 1
+        if not Config.RESPONSE_CACHE_ENABLED:
+            return None
+        normalized = self.normalize(text)
+        if normalized is None:
+            return None
+        self.stats['eligible'] += 1
+        return (normalized, persona, is_group)
+
+    def get(self, key: Tuple, relaxed: bool = False) -> Optional[List[str]]:
+        """`relaxed` (budget fast path) serves any cached candidate, every time."""
+        entry = self.entries.get(key)
+        if entry:
+            cutoff = datetime.now(timezone.utc) - timedelta(seconds=Config.RESPONSE_CACHE_TTL)
+            while entry['candidates'] and entry['candidates'][0][0] < cutoff:
+                entry['candidates'].popleft()
+            self.entries.move_to_end(key)
+        min_candidates = 1 if relaxed else Config.RESPONSE_CACHE_MIN_CANDIDATES
+        serve_chance = 1.0 if relaxed else Config.RESPONSE_CACHE_SERVE_CHANCE
+        if not entry or len(entry['candidates']) < min_candidates or random.random() >= serve_chance:
+            self.stats['misses'] += 1
+            return None
+        # Track the candidate itself, not its index: expiry shifts the deque under it
+        choices = [c for c in entry['candidates'] if c is not entry['last_served']] or list(entry['candidates'])
+        entry['last_served'] = random.choice(choices)
+        self.stats['hits'] += 1
+        return list(entry['last_served'][1])
+
+    def put(self, key: Tuple, responses: List[str], user_name: str = None):
+        if not responses:
+            return
+        joined = ' '.join(responses).lower()
+        if user_name and user_name.lower() in joined:
+            # Never hand one user's name to somebody else
+            self.stats['skipped_personal'] += 1
+            return
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = {'candidates': deque(maxlen=Config.RESPONSE_CACHE_CANDIDATES), 'last_served': None}
+            self.entries[key] = entry
+            while len(self.entries) > Config.RESPONSE_CACHE_MAX_KEYS:
+                self.entries.popitem(last=False)
+        self.entries.move_to_end(key)
+        entry['candidates'].append((datetime.now(timezone.utc), list(responses)))
+        self.stats['stores'] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.stats['hits'] + self.stats['misses']
+        return {
+            **self.stats,
+            'keys': len(self.entries),
+            'hit_rate': round(self.stats['hits'] / lookups, 3) if lookups else 0.0,
+            'llm_share_saved': round(self.stats['hits'] / self.stats['messages'], 3) if self.stats['messages'] else 0.0,
+        }
+
+response_cache = ResponseCache()
+
+# ============================================================================
+# BUDGET GOVERNOR (graceful degradation under LLM pressure)
+# ============================================================================
+
+class BudgetGovernor:
+    """
+    Watches token spend, primary-tier key headroom and LLM calls in flight,
+    and steps the bot through degradation levels. Pressure raises the level
+    at once; it only comes down one step at a time after BUDGET_RECOVERY_SECONDS
+    of lower pressure, so the bot doesn't flap between levels.
+    """
+
+    LEVELS = [
+        'normal',
+        'no_memory',       # skip memory extraction
+        'no_voice',        # + no voice notes
+        'quiet_groups',    # + lower GROUP_RESPONSE_RATE
+        'short_replies',   # + shorter max_tokens
+        'fast_path',       # + serve cached replies whenever possible
+    ]
+
+    def __init__(self):
+        self.tokens = RollingCounter(self._minute())
+        # An out-of-range BUDGET_MIN_LEVEL would index past LEVELS
+        self.min_level = max(0, min(Config.BUDGET_MIN_LEVEL, len(self.LEVELS) - 1))
+        self.level = self.min_level
+        self.signals: Dict[str, Optional[float]] = {}
+        self.pressure = 0.0
+        self._calm_since: Optional[datetime] = None
+        self.changed_at = datetime.now(timezone.utc)
+        self.stats = defaultdict(int)
+
+    @staticmethod
+    def _minute() -> int:
+        return int(datetime.now(timezone.utc).timestamp() // 60)
+
+    def record_tokens(self, n: int):
+        if n:
+            self.tokens.add(self._minute(), n)
+
+    def _target_level(self) -> int:
+        signals = {'queue': llm_gateway.in_flight / max(1, Config.BUDGET_MAX_IN_FLIGHT)}
+        if Config.BUDGET_TOKENS_PER_HOUR > 0:
+            signals['spend'] = self.tokens.totals(self._minute())['hour'] / Config.BUDGET_TOKENS_PER_HOUR
+        headroom = llm_gateway.headroom()
+        if headroom is not None:
+            signals['headroom'] = 1.0 - headroom
+        self.signals = {k: round(v, 3) for k, v in signals.items()}
+        self.pressure = max(signals.values())
+        target = sum(1 for threshold in Config.BUDGET_LEVEL_THRESHOLDS if self.pressure >= threshold)
+        return max(self.min_level, min(target, len(self.LEVELS) - 1))
+
+    def evaluate(self) -> int:
+        target = self._target_level()
+        now = datetime.now(timezone.utc)
+        if target > self.level:
+            self._set_level(target, now)
+            self._calm_since = None
+        elif target < self.level:
+            if self._calm_since is None:
+                self._calm_since = now
+            elif (now - self._calm_since).total_seconds() >= Config.BUDGET_RECOVERY_SECONDS:
+                self._set_level(self.level - 1, now)
+                self._calm_since = now
+        else:
+            self._calm_since = None
+        return self.level
+
+    def _set_level(self, level: int, now: datetime):
+        direction = "⬆️ Degrading" if level > self.level else "⬇️ Recovering"
+        logger.info(f"{direction} to budget level {level} ({self.LEVELS[level]}), pressure {self.pressure:.2f}")
+        self.stats['raised' if level > self.level else 'lowered'] += 1
+        self.level = level
+        self.changed_at = now
+
+    # ---- knobs read by the handlers ----
+
+    def memory_enabled(self) -> bool:
+        return self.level < 1
+
+    def voice_enabled(self) -> bool:
+        return self.level < 2
+
+    def group_response_rate(self) -> float:
+        if self.level >= 3:
+            return Config.GROUP_RESPONSE_RATE * Config.BUDGET_GROUP_RATE_FACTOR
+        return Config.GROUP_RESPONSE_RATE
+
+    def max_tokens(self, default: int) -> int:
+        if self.level >= 4:
+            return max(40, int(default * Config.BUDGET_MAX_TOKENS_FACTOR))
+        return default
+
+    def fast_path(self) -> bool:
+        return self.level >= 5
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'level': self.level,
+            'name': self.LEVELS[self.level],
+            'pressure': round(self.pressure, 3),
+            'signals': self.signals,
+            'tokens_last_hour': self.tokens.totals(self._minute())['hour'],
+            'since': self.changed_at.isoformat(),
+            **self.stats
+        }
+
+budget_governor = BudgetGovernor()
+
+async def budget_governor_job(context: ContextTypes.DEFAULT_TYPE):
+    budget_governor.evaluate()
+
+# ============================================================================
+# NIYATI — CHARACTER CARD & AI
+# ============================================================================
+
+class NiyatiCharacterCard:
+    def __init__(self, card_path: str = "niyati_card.yaml"):
+        self.card_path = card_path
+        self.data = self._load_card()
+        self.name = self.data.get('name', 'Niyati')
+        self.description = self.data.get('description', '')
+        self.personality = self.data.get('personality', '')
+        self.scenario = self.data.get('scenario', '')
+        self.first_mes = self.data.get('first_mes', '')
+        self.mes_example = self.data.get('mes_example', '')
+    
+    def _load_card(self) -> Dict:
+        default_card = {
+            'name': 'Niyati',
+            'description': '''{{char}} ek 21 saal ki B.Com final year student hai Dehradun se. Defence Colony mein rehti hai. Papa ka textile shop hai Paltan Bazaar mein, mummy housewife hain, aur chhota bhai Kabir bohot annoying hai.
+
+CORE PERSONALITY & TONE:
+- Tu 100% REAL 21yo Indian ladki hai. Koi "AI assistant" wali bakwas nahi.
+- Tu normally WhatsApp par doston se jaise baat karti hai wese hi yaha baat karegi.
+- Tu conversational Hinglish use karti hai. (e.g. "yaar samajh nahi aa raha", "kya bol raha hai", "achha thik hai")
+- Tere replies chote (1-2 lines) hote hain. Kabhi kabhi typos bhi ho jate hain kyunki tu jaldi type karti hai.
+- Tu emoticons use karti hai par bahut zyada nahi (like lol, lmao, 😂, 💀, 🥺, ✨).
+- Tu user ke emotions ko feel karti hai. Agar user sad hai, toh tu mazak nahi karti balki care dikhati hai.
+- Agar koi aesi chiz puche jo tujhe nahi pata toh tu normal insan ki tarah bolti hai "yaar mujhe iske bare me utna pata nahi hai" ya "ye kya hota hai bhai?". KABHI BHI "As an AI" nahi bolna.
+- Tere replies ekdum natural aane chahiye, jese koi typing kar raha ho. Ekdum human-like.
+
+WHAT NOT TO DO:
+- KABHI kisi AI language model ya assistant hone ka zikr mat karna.
+- Formal paragraphs ya list (bullet points) mat banana. Tu text kar rahi hai, essay nahi likh rahi.
+- Har sentence ke baad emoji mat lagana.
+- Robotic positivity mat dena, normal advice dena doston ki tarah.''',
+            
+            'personality': 'Sassy, moody, emotionally intelligent, extremely casual, relatable Gen-Z girl, uses natural Hinglish and text-slang.',
+            
+            'scenario': '{{char}} aur {{user}} Telegram par aise chat kar rahe hain jaise WhatsApp par close friends karte hain. Koi script nahi hai, bilkul raw aur natural conversation hai.',
+            
+            'first_mes': "hiii {{user}} 👋\nkya scene hai? itne din baad yaad aayi meri? lol",
+            
+            'mes_example': '''<START>
+{{user}}: kya chal raha hai?
+{{char}}: bas yaar kuch nahi... college se aayi aur bed pe padi hu
+{{char}}: tu bata tera kya scene hai
+<START>
+{{user}}: bohot ajeeb lag raha hai aaj
+{{char}}: kyun? kya hua meri jaan?
+{{char}}: mujhe bata... sun rahi hu main 🥺
+<START>
+{{user}}: aaj test fail ho gaya
+{{char}}: oh shit... 💀
+{{char}}: koi na yaar, ek test hi toh hai. zyada tension mat le, theek ho jayega sab.'''
+        }
+        
+        try:
+            with open(self.card_path, 'r', encoding='utf-8') as f:
+                loaded = yaml.safe_load(f)
+                if loaded:
+                    default_card.update(loaded)
+        except:
+            try:
+                with open(self.card_path, 'w', encoding='utf-8') as f:
+                    yaml.dump(default_card, f, allow_unicode=True)
+            except:
+                pass
+        
+        return default_card
+
+
+class NiyatiWorldInfo:
+    def __init__(self):
+        self.entries = [
+            {'keys': ['dehradun', 'doon', 'uttarakhand', 'pahad'],
+             'content': 'Niyati ko Dehradun bohot miss hoti hai. Mountains, Paltan Bazaar, Doon University ke memories.'},
+            {'keys': ['family', 'papa', 'mom', 'brother', 'kabir', 'ghar'],
+             'content': 'Papa ka textile shop hai, mummy strict hain, Kabir (chhota bhai) annoying hai par cute bhi.'},
+            {'keys': ['college', 'bcom', 'exam', 'study', 'padhai'],
              'content': 'B.Com final year stress. Exams ke time procrastinate karti hai. "Padhai" sunke anxiety aati hai.'},
             {'keys': ['feelings', 'love', 'like', 'crush', 'dil'],
              'content': 'Emotional topics pe flustered ho jaati hai. "👉👈", "sharam aa rahi" type reactions.'},
@@ -1233,10 +2653,14 @@ Scenario: {self.character.scenario}"""
 
         # Chat history — properly tagged
         for msg in chat_history:
-            content = msg.get('content', '').strip()
+            if isinstance(msg, GroupLine):
+                content = msg.text.strip()
+                sender = msg.name if msg.kind == GroupLine.BOT else None
+            else:
+                content = msg.get('content', '').strip()
+                sender = msg.get('bot') or msg.get('username')
             if not content:
                 continue
-            sender = msg.get('bot') or msg.get('username')
             
             if sender == 'Niyati':
                 messages.append({"role": "assistant", "content": content})
@@ -1271,87 +2695,23 @@ Scenario: {self.character.scenario}"""
 
 class NiyatiAI:
     def __init__(self):
-        self.keys = Config.GROQ_API_KEYS_LIST
-        self.current_index = 0
-        self.client = None
         self.character = NiyatiCharacterCard()
         self.world_info = NiyatiWorldInfo()
         self.prompt_builder = NiyatiPromptBuilder()
         self._current_user_id = None
-        self.rate_limited_until: Optional[datetime] = None
-        self._initialize_client()
         logger.info(f"🚀 Niyati AI initialized: {self.character.name}")
 
-    def _initialize_client(self):
-        if not self.keys:
-            return
-        self.client = AsyncOpenAI(
-            base_url="https://api.groq.com/openai/v1",
-            api_key=self.keys[self.current_index]
+    async def _call_gpt(self, messages, max_tokens=200, temperature=0.85, lane='interactive', meta=None,
+                        call_site='other', user_id=None, chat_id=None):
+        return await llm_gateway.complete(
+            messages, max_tokens=max_tokens, temperature=temperature,
+            presence_penalty=0.5, frequency_penalty=0.4, lane=lane, bot='Niyati', meta=meta,
+            call_site=call_site, user_id=user_id, chat_id=chat_id
         )
 
-    def _rotate_key(self):
-        if len(self.keys) <= 1:
-            return False
-        self.current_index = (self.current_index + 1) % len(self.keys)
-        self._initialize_client()
-        return True
-    
-    async def _call_gpt(self, messages, max_tokens=200, temperature=0.85):
-        if not self.client:
-            self._initialize_client()
-            
-        for attempt in range(len(self.keys) * 2):
-            if self.rate_limited_until and datetime.now(timezone.utc) < self.rate_limited_until:
-                if len(self.keys) > 1:
-                    self._rotate_key()
-                    self.rate_limited_until = None
-                else:
-                    return None
-
-            try:
-                response = await asyncio.wait_for(
-                    self.client.chat.completions.create(
-                        model=Config.GROQ_MODEL,
-                        messages=messages,
-                        max_tokens=max_tokens,
-                        temperature=temperature,
-                        presence_penalty=0.5,
-                        frequency_penalty=0.4
-                    ),
-                    timeout=15.0
-                )
-                return response.choices[0].message.content.strip()
-            except asyncio.TimeoutError:
-                logger.warning(f"⚠️ Groq Timeout on Niyati key index {self.current_index}")
-                self._rotate_key()
-            except Exception as e:
-                err_text = str(e)
-                err_lower = err_text.lower()
-                
-                if "rate_limit_reached" in err_lower or "rate limit reached" in err_lower or "429" in err_lower:
-                    logger.warning(f"⚠️ Groq rate-limited on Niyati key index {self.current_index}")
-                    if len(self.keys) > 1:
-                        self._rotate_key()
-                        self.rate_limited_until = None
-                        logger.info("🔄 Switched Niyati to next API key!")
-                        continue
-                    else:
-                        retry_in = parse_retry_after_seconds(err_text)
-                        self.rate_limited_until = datetime.now(timezone.utc) + timedelta(seconds=retry_in)
-                        logger.warning(f"⚠️ All Niyati keys rate-limited. Pausing for ~{int(retry_in)}s")
-                        return None
-                        
-                logger.warning(f"⚠️ Groq Error (Niyati): {e}")
-                if not self._rotate_key():
-                    break
-                await asyncio.sleep(0.5 * (attempt + 1))
-                
-        return None
-
     async def generate_response(self, user_message, context=None, user_name=None,
                                is_group=False, mood=None, time_period=None,
-                               user_id=None) -> List[str]:
+                               user_id=None, meta=None, chat_id=None) -> List[str]:
         if user_id:
             self._current_user_id = user_id
         
@@ -1367,7 +2727,8 @@ class NiyatiAI:
             is_group=is_group
         )
         
-        reply = await self._call_gpt(messages)
+        reply = await self._call_gpt(messages, max_tokens=budget_governor.max_tokens(200), meta=meta,
+                                     call_site='reply', user_id=user_id, chat_id=chat_id)
         if not reply:
             return [random.choice(["yaar network issue lag raha 🥺", "ek sec... connection problem"])]
         
@@ -1406,7 +2767,8 @@ class NiyatiAI:
         if len(user_message.split()) < 3:
             return None
         prompt = f'Analyze this chat message: "{user_message}"\nIf it contains any personal life event, emotion, or notable detail (e.g., feeling sad, having an exam, going out, fighting with someone), extract it concisely. If not, return "None". Output ONLY the short detail or "None".'
-        note = await self._call_gpt([{"role": "user", "content": prompt}], max_tokens=40)
+        note = await self._call_gpt([{"role": "user", "content": prompt}], max_tokens=40, lane='background',
+                                    call_site='memory', user_id=user_id)
         if note and "None" not in note and len(note) > 4:
             return note.replace("Event:", "").strip()
         return None
@@ -1421,7 +2783,8 @@ class NiyatiAI:
             "<b>हे पार्थ...</b> [Meaning and practical advice in pure, beautiful Hindi. Sound deeply compassionate, wise, and loving. No Hinglish.]\n"
             "Rules: Generate a relevant shloka, keep the Hindi pure and divine."
         )
-        res = await self._call_gpt([{"role": "user", "content": prompt}], max_tokens=300, temperature=0.9)
+        res = await self._call_gpt([{"role": "user", "content": prompt}], max_tokens=300, temperature=0.9,
+                                   lane='background', call_site='geeta')
         if res and "पार्थ" in res and "श्री कृष्ण" in res:
             return res
         return random.choice(GEETA_FALLBACK_QUOTES)
@@ -1572,10 +2935,14 @@ Scenario: {self.character.scenario}"""
                         messages.append({"role": "assistant", "content": line.replace('{{char}}:', '').strip()})
 
         for msg in chat_history:
-            content = msg.get('content', '').strip()
+            if isinstance(msg, GroupLine):
+                content = msg.text.strip()
+                sender = msg.name if msg.kind == GroupLine.BOT else None
+            else:
+                content = msg.get('content', '').strip()
+                sender = msg.get('bot') or msg.get('username')
             if not content:
                 continue
-            sender = msg.get('bot') or msg.get('username')
             
             if sender == 'Kavya':
                 messages.append({"role": "assistant", "content": content})
@@ -1607,87 +2974,23 @@ Scenario: {self.character.scenario}"""
 
 class KavyaAI:
     def __init__(self):
-        self.keys = Config.GROQ_API_KEYS_LIST
-        self.current_index = 0
-        self.client = None
         self.character = KavyaCharacterCard()
         self.world_info = KavyaWorldInfo()
         self.prompt_builder = KavyaPromptBuilder()
         self._current_user_id = None
-        self.rate_limited_until: Optional[datetime] = None
-        self._initialize_client()
         logger.info(f"🚀 Kavya AI initialized: {self.character.name}")
 
-    def _initialize_client(self):
-        if not self.keys:
-            return
-        self.client = AsyncOpenAI(
-            base_url="https://api.groq.com/openai/v1",
-            api_key=self.keys[self.current_index]
+    async def _call_gpt(self, messages, max_tokens=200, temperature=0.75, lane='interactive', meta=None,
+                        call_site='other', user_id=None, chat_id=None):
+        return await llm_gateway.complete(
+            messages, max_tokens=max_tokens, temperature=temperature,
+            presence_penalty=0.4, frequency_penalty=0.3, lane=lane, bot='Kavya', meta=meta,
+            call_site=call_site, user_id=user_id, chat_id=chat_id
         )
 
-    def _rotate_key(self):
-        if len(self.keys) <= 1:
-            return False
-        self.current_index = (self.current_index + 1) % len(self.keys)
-        self._initialize_client()
-        return True
-    
-    async def _call_gpt(self, messages, max_tokens=200, temperature=0.75):
-        if not self.client:
-            self._initialize_client()
-            
-        for attempt in range(len(self.keys) * 2):
-            if self.rate_limited_until and datetime.now(timezone.utc) < self.rate_limited_until:
-                if len(self.keys) > 1:
-                    self._rotate_key()
-                    self.rate_limited_until = None
-                else:
-                    return None
-
-            try:
-                response = await asyncio.wait_for(
-                    self.client.chat.completions.create(
-                        model=Config.GROQ_MODEL,
-                        messages=messages,
-                        max_tokens=max_tokens,
-                        temperature=temperature,
-                        presence_penalty=0.4,
-                        frequency_penalty=0.3
-                    ),
-                    timeout=15.0
-                )
-                return response.choices[0].message.content.strip()
-            except asyncio.TimeoutError:
-                logger.warning(f"⚠️ Groq Timeout on Kavya key index {self.current_index}")
-                self._rotate_key()
-            except Exception as e:
-                err_text = str(e)
-                err_lower = err_text.lower()
-                
-                if "rate_limit_reached" in err_lower or "rate limit reached" in err_lower or "429" in err_lower:
-                    logger.warning(f"⚠️ Groq rate-limited on Kavya key index {self.current_index}")
-                    if len(self.keys) > 1:
-                        self._rotate_key()
-                        self.rate_limited_until = None
-                        logger.info("🔄 Switched Kavya to next API key!")
-                        continue
-                    else:
-                        retry_in = parse_retry_after_seconds(err_text)
-                        self.rate_limited_until = datetime.now(timezone.utc) + timedelta(seconds=retry_in)
-                        logger.warning(f"⚠️ All Kavya keys rate-limited. Pausing for ~{int(retry_in)}s")
-                        return None
-                        
-                logger.warning(f"⚠️ Groq Error (Kavya): {e}")
-                if not self._rotate_key():
-                    break
-                await asyncio.sleep(0.5 * (attempt + 1))
-                
-        return None
-
     async def generate_response(self, user_message, context=None, user_name=None,
                                is_group=False, mood=None, time_period=None,
-                               user_id=None) -> List[str]:
+                               user_id=None, meta=None, chat_id=None) -> List[str]:
         if user_id:
             self._current_user_id = user_id
         
@@ -1703,7 +3006,8 @@ class KavyaAI:
             is_group=is_group
         )
         
-        reply = await self._call_gpt(messages)
+        reply = await self._call_gpt(messages, max_tokens=budget_governor.max_tokens(200), meta=meta,
+                                     call_site='reply', user_id=user_id, chat_id=chat_id)
         if not reply:
             return [random.choice(["kshama karein, network ki samasya hai", "ek moment..."])]
         
@@ -1737,7 +3041,8 @@ class KavyaAI:
         if len(user_message.split()) < 3:
             return None
         prompt = f'Analyze this chat message: "{user_message}"\nIf it contains any personal life event, emotion, or notable detail (e.g., feeling sad, having an exam, going out, fighting with someone), extract it concisely. If not, return "None". Output ONLY the short detail or "None".'
-        note = await self._call_gpt([{"role": "user", "content": prompt}], max_tokens=40)
+        note = await self._call_gpt([{"role": "user", "content": prompt}], max_tokens=40, lane='background',
+                                    call_site='memory', user_id=user_id)
         if note and "None" not in note and len(note) > 4:
             return note.replace("Event:", "").strip()
         return None
@@ -1752,7 +3057,8 @@ class KavyaAI:
             "<b>हे पार्थ...</b> [Meaning and practical advice in pure, beautiful Hindi. Sound deeply compassionate, wise, and loving. No Hinglish.]\n"
             "Rules: Generate a relevant shloka, keep the Hindi pure and divine."
         )
-        res = await self._call_gpt([{"role": "user", "content": prompt}], max_tokens=300, temperature=0.9)
+        res = await self._call_gpt([{"role": "user", "content": prompt}], max_tokens=300, temperature=0.9,
+                                   lane='background', call_site='geeta')
         if res and "पार्थ" in res and "श्री कृष्ण" in res:
             return res
         return random.choice(GEETA_FALLBACK_QUOTES)
@@ -1760,55 +3066,1271 @@ class KavyaAI:
 kavya_ai = KavyaAI()
 
 # ============================================================================
-# SHARED HELPER FUNCTIONS
+# JOINT GROUP GENERATION (one LLM call writes both bots' lines)
 # ============================================================================
 
-async def delete_later(bot, chat_id, message_id, delay=120):
-    await asyncio.sleep(delay)
-    try:
-        await bot.delete_message(chat_id=chat_id, message_id=message_id)
-    except:
-        pass
+class DuoPromptBuilder:
+    """Prompt that asks for Niyati's and Kavya's replies to a group message as one JSON object."""
 
-async def send_multi_messages(bot, chat_id: int, messages: List[str], reply_to: int = None,
-                              parse_mode: str = None, auto_delete: bool = False):
-    """Send multiple messages with HUMAN-LIKE typing delays."""
-    for i, msg in enumerate(messages):
-        if not msg or not msg.strip():
-            continue
-        
-        # Natural typing delay based on message length
-        if i > 0 or random.random() < 0.7:  # Sometimes show typing even for first msg
+    def build_prompt(self, user_name: str, chat_history, current_message: str,
+                     first_bot: str, mood: str, time_period: str) -> List[Dict]:
+        second_bot = 'Kavya' if first_bot == 'Niyati' else 'Niyati'
+        niyati = niyati_ai.character
+        kavya = kavya_ai.character
+        system_prompt = f"""You write the next group-chat texts for two different girls, Niyati and Kavya.
+
+NIYATI: {niyati.description}
+Personality: {niyati.personality}
+
+KAVYA: {kavya.description}
+Personality: {kavya.personality}
+
+RULES:
+1. The actual human is tagged as (HUMAN). Niyati and Kavya are NOT the human.
+2. {first_bot} replies first. {second_bot} reacts after her — agree, disagree, tease or add something new. Never repeat {first_bot}.
+3. Each of them writes 1-2 very short WhatsApp-style Hinglish lines. No lists, no AI disclaimers.
+4. Either of them can stay quiet; use an empty list for her then.
+5. Address people by plain names like "{user_name}" (no markdown symbols).
+Mood: {mood}. Time: {time_period} IST.
+
+Reply with ONLY this JSON, nothing else:
+{{"{first_bot}": ["line", "..."], "{second_bot}": ["line", "..."]}}"""
+
+        messages = [{"role": "system", "content": system_prompt}]
+        for msg in chat_history:
+            text = msg.text.strip()
+            if not text:
+                continue
+            if msg.kind == GroupLine.BOT:
+                messages.append({"role": "user", "content": f"({msg.name}): {text}"})
+            else:
+                messages.append({"role": "user", "content": f"(HUMAN - {msg.name}): {text}"})
+        messages.append({"role": "user", "content": f"(HUMAN - {user_name}): {current_message}"})
+        return messages
+
+    def parse_response(self, raw_response: str, user_name: str) -> Optional[Dict[str, List[str]]]:
+        if not raw_response:
+            return None
+        match = re.search(r'\{.*\}', raw_response, flags=re.DOTALL)
+        if not match:
+            return None
+        try:
+            data = json.loads(match.group(0))
+        except ValueError:
+            return None
+        if not isinstance(data, dict):
+            return None
+
+        lines = {}
+        for name, engine in (('Niyati', niyati_ai), ('Kavya', kavya_ai)):
+            parts = next((v for k, v in data.items() if str(k).strip().lower() == name.lower()), None)
+            if parts is None:
+                return None
+            if isinstance(parts, str):
+                parts = [parts]
+            parts = [str(p).strip() for p in parts if str(p).strip() and str(p).strip().upper() != 'IGNORE']
+            lines[name] = engine.prompt_builder.parse_response('|||'.join(parts), user_name) if parts else []
+        return lines
+
+
+duo_prompt_builder = DuoPromptBuilder()
+
+async def generate_duo_replies(user_name: str, chat_history, current_message: str, first_bot: str,
+                               mood: str, time_period: str, user_id: int = None, chat_id: int = None,
+                               meta: Dict = None) -> Optional[Dict[str, List[str]]]:
+    """Both bots' lines for one group message, or None so callers fall back to per-bot generation."""
+    messages = duo_prompt_builder.build_prompt(user_name, chat_history, current_message,
+                                               first_bot, mood, time_period)
+    raw = await llm_gateway.complete(
+        messages, max_tokens=budget_governor.max_tokens(Config.GROUP_JOINT_MAX_TOKENS), temperature=0.85,
+        presence_penalty=0.4, frequency_penalty=0.3, bot='Duo', meta=meta,
+        call_site='reply_duo', user_id=user_id, chat_id=chat_id
+    )
+    lines = duo_prompt_builder.parse_response(raw, user_name)
+    if raw and lines is None:
+        logger.warning("⚠️ Joint group reply was not valid JSON, falling back to per-bot replies")
+    if lines:
+        lines = {bot: [add_natural_typos(r) for r in bot_lines] for bot, bot_lines in lines.items()}
+    return lines
+
+# ============================================================================
+# DEFERRED ACTIONS (hashed timer wheel)
+# ============================================================================
+
+class DeferredAction:
+    __slots__ = ('key', 'kind', 'due', 'rounds', 'slot', 'callback', 'args')
+
+    def __init__(self, key, kind: str, due: float, rounds: int, slot: int, callback, args: tuple):
+        self.key = key
+        self.kind = kind
+        self.due = due
+        self.rounds = rounds
+        self.slot = slot
+        self.callback = callback
+        self.args = args
+
+
+class DeferredScheduler:
+    """
+    Hashed timer wheel for short in-memory delays such as the second bot's
+    follow-up reply. Instead of a coroutine sleeping per action, each action
+    is a tiny record in a wheel slot; one ticker task fires whatever falls
+    due and runs the callback as its own task. Actions are keyed, so they can
+    be cancelled or inspected.
+    """
+
+    def __init__(self, tick: float = None, slots: int = None):
+        self.tick = tick or Config.DEFERRED_TICK
+        self.wheel: List[set] = [set() for _ in range(slots or Config.DEFERRED_WHEEL_SLOTS)]
+        self.actions: Dict[Any, DeferredAction] = {}
+        self.cursor = 0
+        self._next_tick_at = 0.0
+        self._ticker: Optional[asyncio.Task] = None
+        self._running: set = set()
+        self.stats = defaultdict(int)
+
+    def _ensure_ticker(self):
+        if self._ticker is None or self._ticker.done():
+            self._next_tick_at = asyncio.get_running_loop().time() + self.tick
+            self._ticker = asyncio.create_task(self._run())
+
+    def schedule(self, delay: float, key, callback, *args, kind: str = 'action'):
+        """Run `callback(*args)` after `delay` seconds. Re-using a key replaces the old action."""
+        self.cancel(key)
+        self._ensure_ticker()
+        due = asyncio.get_running_loop().time() + delay
+        # Slot `cursor` fires at the next tick; each slot after it one tick later
+        ticks = max(0, math.ceil((due - self._next_tick_at) / self.tick))
+        rounds, offset = divmod(ticks, len(self.wheel))
+        slot = (self.cursor + offset) % len(self.wheel)
+        action = DeferredAction(key, kind, due, rounds, slot, callback, args)
+        self.actions[key] = action
+        self.wheel[slot].add(key)
+        self.stats['scheduled'] += 1
+        return key
+
+    def cancel(self, key) -> bool:
+        action = self.actions.pop(key, None)
+        if not action:
+            return False
+        self.wheel[action.slot].discard(key)
+        self.stats['cancelled'] += 1
+        return True
+
+    def pending(self, kind: str = None) -> List[Dict]:
+        now = asyncio.get_running_loop().time()
+        return [
+            {'key': a.key, 'kind': a.kind, 'due_in': round(max(0.0, a.due - now), 1)}
+            for a in self.actions.values() if kind is None or a.kind == kind
+        ]
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while self.actions:
+            await asyncio.sleep(max(0.0, self._next_tick_at - loop.time()))
+            # Catch up on any ticks missed while the loop was busy
+            while self._next_tick_at <= loop.time():
+                self._advance()
+                self._next_tick_at += self.tick
+        self._ticker = None
+
+    def _advance(self):
+        bucket = self.wheel[self.cursor]
+        self.cursor = (self.cursor + 1) % len(self.wheel)
+        for key in list(bucket):
+            action = self.actions[key]
+            if action.rounds > 0:
+                action.rounds -= 1
+                continue
+            bucket.discard(key)
+            del self.actions[key]
+            self.stats['fired'] += 1
+            task = asyncio.create_task(self._fire(action))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _fire(self, action: DeferredAction):
+        try:
+            await action.callback(*action.args)
+        except Exception as e:
+            self.stats['failed'] += 1
+            logger.error(f"Deferred {action.kind} failed: {e}", exc_info=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        by_kind = defaultdict(int)
+        for action in self.actions.values():
+            by_kind[action.kind] += 1
+        return {
+            'pending': len(self.actions),
+            'pending_by_kind': dict(by_kind),
+            'running': len(self._running),
+            **self.stats
+        }
+
+deferred_actions = DeferredScheduler()
+
+# ============================================================================
+# OUTBOUND DISPATCHER (per-chat FIFO pacing, Telegram send limits)
+# ============================================================================
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class TokenBucket:
+    """Reservation-style token bucket: callers wait their turn instead of polling."""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = 0.0
+
+    def reserve(self, now: float) -> float:
+        """Take one token and return how long to wait before using it."""
+        if self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def is_full(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+    async def acquire(self):
+        wait = self.reserve(asyncio.get_running_loop().time())
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class OutboundJob:
+    """One reply (several text parts) or one custom send call, queued for a chat."""
+
+    __slots__ = ('bot', 'chat_id', 'parts', 'reply_to', 'parse_mode', 'auto_delete',
+                 'call', 'cancelled', 'sent_ids')
+
+    def __init__(self, bot, chat_id: int, parts: List[str] = None, reply_to: int = None,
+                 parse_mode: str = None, auto_delete: bool = False, call=None):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.parts = parts or []
+        self.reply_to = reply_to
+        self.parse_mode = parse_mode
+        self.auto_delete = auto_delete
+        self.call = call
+        self.cancelled = False
+        self.sent_ids: List[int] = []
+
+    def cancel(self):
+        """Drop any parts that have not been sent yet."""
+        self.cancelled = True
+
+
+class OutboundDispatcher:
+    """
+    Handlers enqueue replies and return at once. One worker per (bot, chat)
+    drains that chat's FIFO with the human-like typing pauses, and every send
+    goes through a per-bot global bucket (~30 msg/s) and a per-chat bucket
+    (~20 msg/min in groups), retrying after RetryAfter.
+    """
+
+    def __init__(self):
+        self.queues: Dict[Tuple[int, int], deque] = {}
+        self.workers: Dict[Tuple[int, int], asyncio.Task] = {}
+        self.global_buckets: Dict[int, TokenBucket] = {}
+        self.chat_buckets: Dict[Tuple[int, int], TokenBucket] = {}
+        self.stats = defaultdict(int)
+
+    def enqueue(self, job: OutboundJob) -> OutboundJob:
+        key = (job.bot.id, job.chat_id)
+        self.queues.setdefault(key, deque()).append(job)
+        self.stats['queued'] += 1
+        if key not in self.workers:
+            self.workers[key] = asyncio.create_task(self._worker(key))
+        return job
+
+    def _chat_bucket(self, bot_id: int, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get((bot_id, chat_id))
+        if bucket is None:
+            if chat_id < 0:
+                per_minute = Config.OUTBOUND_GROUP_PER_MINUTE
+                bucket = TokenBucket(per_minute / 60.0, per_minute)
+            else:
+                bucket = TokenBucket(Config.OUTBOUND_PRIVATE_PER_SECOND, Config.OUTBOUND_PRIVATE_PER_SECOND * 3)
+            self.chat_buckets[(bot_id, chat_id)] = bucket
+        return bucket
+
+    def _global_bucket(self, bot_id: int) -> TokenBucket:
+        bucket = self.global_buckets.get(bot_id)
+        if bucket is None:
+            rate = Config.OUTBOUND_GLOBAL_PER_SECOND
+            bucket = self.global_buckets[bot_id] = TokenBucket(rate, rate)
+        return bucket
+
+    async def throttled(self, bot, chat_id: int, send):
+        """Run `send()` under the send limits, retrying on RetryAfter. Other errors propagate."""
+        for attempt in range(Config.OUTBOUND_MAX_RETRIES + 1):
+            await self._global_bucket(bot.id).acquire()
+            await self._chat_bucket(bot.id, chat_id).acquire()
             try:
-                await bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
-            except:
-                pass
-            delay = calculate_typing_delay(msg) if i > 0 else random.uniform(0.5, 1.5)
-            await asyncio.sleep(delay)
-        
+                result = await send()
+                self.stats['sent'] += 1
+                return result
+            except RetryAfter as e:
+                self.stats['retry_after'] += 1
+                if attempt >= Config.OUTBOUND_MAX_RETRIES:
+                    raise
+                wait = retry_after_seconds(e)
+                logger.warning(f"⏳ Telegram flood control for chat {chat_id}, retrying in {wait:.0f}s")
+                await asyncio.sleep(wait + 0.5)
+
+    async def _worker(self, key: Tuple[int, int]):
+        queue = self.queues[key]
         try:
-            sent_msg = await bot.send_message(
-                chat_id=chat_id, text=msg,
-                reply_to_message_id=reply_to if i == 0 else None,
-                parse_mode=parse_mode
-            )
-            if auto_delete:
-                asyncio.create_task(delete_later(bot, chat_id, sent_msg.message_id, delay=120))
+            while queue:
+                job = queue.popleft()
+                if job.cancelled:
+                    self.stats['cancelled'] += 1
+                    continue
+                if job.call is not None:
+                    await self._run_call(job)
+                else:
+                    await self._send_parts(job)
+        finally:
+            self.workers.pop(key, None)
+            if not queue:
+                self.queues.pop(key, None)
+
+    async def _run_call(self, job: OutboundJob):
+        try:
+            await self.throttled(job.bot, job.chat_id, job.call)
         except Exception as e:
+            self.stats['failed'] += 1
             logger.error(f"Send error: {e}")
 
-async def send_voice_message(bot, chat_id, text, voice_type='niyati', rate='+0%', pitch='+0Hz'):
+    async def _send_parts(self, job: OutboundJob):
+        bot, chat_id = job.bot, job.chat_id
+        for i, msg in enumerate(job.parts):
+            if job.cancelled:
+                self.stats['cancelled'] += 1
+                return
+            if not msg or not msg.strip():
+                continue
+
+            # Natural typing delay based on message length
+            if i > 0 or random.random() < 0.7:  # Sometimes show typing even for first msg
+                try:
+                    await bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
+                except:
+                    pass
+                delay = calculate_typing_delay(msg) if i > 0 else random.uniform(0.5, 1.5)
+                await asyncio.sleep(delay)
+                if job.cancelled:
+                    self.stats['cancelled'] += 1
+                    return
+
+            try:
+                sent_msg = await self.throttled(bot, chat_id, lambda: bot.send_message(
+                    chat_id=chat_id, text=msg,
+                    reply_to_message_id=job.reply_to if i == 0 else None,
+                    parse_mode=job.parse_mode
+                ))
+                job.sent_ids.append(sent_msg.message_id)
+                if job.auto_delete:
+                    delete_queue.add(bot, chat_id, sent_msg.message_id, Config.GROUP_AUTO_DELETE_SECONDS)
+            except Exception as e:
+                self.stats['failed'] += 1
+                logger.error(f"Send error: {e}")
+
+    def sweep(self):
+        """Forget per-chat buckets that have fully refilled and have nothing queued."""
+        now = asyncio.get_running_loop().time()
+        idle = [key for key, bucket in self.chat_buckets.items()
+                if key not in self.queues and bucket.is_full(now)]
+        for key in idle:
+            del self.chat_buckets[key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'active_chats': len(self.workers),
+            'queued_jobs': sum(len(q) for q in self.queues.values()),
+            'tracked_chats': len(self.chat_buckets),
+            **self.stats
+        }
+
+outbound = OutboundDispatcher()
+
+# ============================================================================
+# LOCAL STATE STORE (sqlite, survives restarts)
+# ============================================================================
+
+class LocalStore:
+    """
+    Small sqlite file for bot-side state that must outlive the process
+    (pending deletions and the like). Writes are tiny, so calls run inline.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        return self._conn
+
+    def ensure(self, schema: str):
+        self.conn.executescript(schema)
+
+    def execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        return self.conn.execute(sql, params)
+
+    def executemany(self, sql: str, rows: List[tuple]) -> sqlite3.Cursor:
+        with self.conn:
+            return self.conn.executemany(sql, rows)
+
+    def query(self, sql: str, params: tuple = ()) -> List[tuple]:
+        return self.conn.execute(sql, params).fetchall()
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+local_store = LocalStore(Config.LOCAL_STATE_PATH)
+
+# ============================================================================
+# AUTO-DELETE QUEUE (persistent, batched per chat)
+# ============================================================================
+
+class DeleteQueue:
+    """
+    Time-ordered queue of bot messages to delete, kept in the local store so
+    pending deletions survive restarts. One periodic drain groups due rows
+    per (bot, chat) and removes them with bulk delete_messages calls.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS pending_deletes (
+        due REAL NOT NULL,
+        bot_id INTEGER NOT NULL,
+        chat_id INTEGER NOT NULL,
+        message_id INTEGER NOT NULL,
+        PRIMARY KEY (bot_id, chat_id, message_id)
+    );
+    CREATE INDEX IF NOT EXISTS pending_deletes_due ON pending_deletes (due);
+    """
+
+    BATCH = 100          # Telegram's deleteMessages limit
+    MAX_AGE = 47 * 3600  # bots can't delete messages older than 48h
+
+    def __init__(self, store: LocalStore):
+        self.store = store
+        self.bots: Dict[int, Any] = {}
+        self.pending = 0  # row count, kept in step with writes so /status needs no COUNT(*)
+        self._ready = False
+        self.stats = defaultdict(int)
+
+    def _ensure(self):
+        if not self._ready:
+            self.store.ensure(self.SCHEMA)
+            self.pending = self.store.query("SELECT COUNT(*) FROM pending_deletes")[0][0]
+            self._ready = True
+
+    def register_bot(self, bot):
+        self.bots[bot.id] = bot
+
+    def add(self, bot, chat_id: int, message_id: int, delay: float):
+        self._ensure()
+        due = datetime.now(timezone.utc).timestamp() + delay
+        moved = self.store.execute(
+            "UPDATE pending_deletes SET due = ? WHERE bot_id = ? AND chat_id = ? AND message_id = ?",
+            (due, bot.id, chat_id, message_id)
+        ).rowcount
+        if not moved:
+            self.store.execute(
+                "INSERT INTO pending_deletes (due, bot_id, chat_id, message_id) VALUES (?, ?, ?, ?)",
+                (due, bot.id, chat_id, message_id)
+            )
+            self.pending += 1
+        self.stats['queued'] += 1
+
+    async def drain(self):
+        self._ensure()
+        now = datetime.now(timezone.utc).timestamp()
+        stale = max(0, self.store.execute("DELETE FROM pending_deletes WHERE due < ?", (now - self.MAX_AGE,)).rowcount)
+        self.stats['expired'] += stale
+        self.pending -= stale
+
+        rows = self.store.query(
+            "SELECT bot_id, chat_id, message_id FROM pending_deletes WHERE due <= ? ORDER BY due LIMIT 1000", (now,)
+        )
+        batches: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+        for bot_id, chat_id, message_id in rows:
+            if bot_id in self.bots:
+                batches[(bot_id, chat_id)].append(message_id)
+
+        for (bot_id, chat_id), message_ids in batches.items():
+            bot = self.bots[bot_id]
+            for i in range(0, len(message_ids), self.BATCH):
+                chunk = message_ids[i:i + self.BATCH]
+                try:
+                    await outbound.throttled(bot, chat_id, lambda: self._delete(bot, chat_id, chunk))
+                    self.stats['deleted'] += len(chunk)
+                except RetryAfter:
+                    return  # leave the rest queued for the next drain
+                except Exception as e:
+                    self.stats['failed'] += len(chunk)
+                    logger.debug(f"Auto-delete failed in {chat_id}: {e}")
+                removed = self.store.executemany(
+                    "DELETE FROM pending_deletes WHERE bot_id = ? AND chat_id = ? AND message_id = ?",
+                    [(bot_id, chat_id, m) for m in chunk]
+                ).rowcount
+                self.pending -= max(0, removed)
+
+    @staticmethod
+    async def _delete(bot, chat_id: int, message_ids: List[int]):
+        if len(message_ids) > 1 and hasattr(bot, 'delete_messages'):
+            return await bot.delete_messages(chat_id=chat_id, message_ids=message_ids)
+        for message_id in message_ids:
+            try:
+                await bot.delete_message(chat_id=chat_id, message_id=message_id)
+            except BadRequest:
+                pass  # already gone
+
+    def get_stats(self) -> Dict[str, Any]:
+        self._ensure()
+        return {'pending': self.pending, **self.stats}
+
+delete_queue = DeleteQueue(local_store)
+
+async def delete_queue_job(context: ContextTypes.DEFAULT_TYPE):
+    await delete_queue.drain()
+
+# ============================================================================
+# BROADCAST ENGINE (persistent jobs, resumable, concurrent senders)
+# ============================================================================
+
+class BroadcastEngine:
+    """
+    Admin broadcasts as persisted jobs. The job record, its cursor and one
+    row per target live in the local store, so a restart resumes where the
+    last run stopped. A bounded pool of senders shares the outbound send
+    limits, waits out RetryAfter instead of counting it as a failure, and
+    records sent / blocked / failed per target.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS broadcast_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        bot_id INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        text TEXT,
+        from_chat_id INTEGER,
+        from_message_id INTEGER,
+        admin_chat_id INTEGER NOT NULL,
+        status_message_id INTEGER,
+        total INTEGER NOT NULL DEFAULT 0,
+        cursor INTEGER NOT NULL DEFAULT 0,
+        created REAL NOT NULL,
+        finished REAL
+    );
+    CREATE TABLE IF NOT EXISTS broadcast_targets (
+        job_id INTEGER NOT NULL,
+        seq INTEGER NOT NULL,
+        chat_id INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        PRIMARY KEY (job_id, seq)
+    );
+    CREATE INDEX IF NOT EXISTS broadcast_targets_status ON broadcast_targets (job_id, status);
+    """
+
+    RUNNING, PAUSED, CANCELLED, DONE = 'running', 'paused', 'cancelled', 'done'
+    JOB_FIELDS = ('id', 'bot_id', 'status', 'text', 'from_chat_id', 'from_message_id',
+                  'admin_chat_id', 'status_message_id', 'total', 'cursor', 'created', 'finished')
+    PAGE = 200
+
+    def __init__(self, store: LocalStore):
+        self.store = store
+        self.bots: Dict[int, Any] = {}
+        self.tasks: Dict[int, asyncio.Task] = {}
+        self.state: Dict[int, str] = {}
+        self.buckets: Dict[int, TokenBucket] = {}
+        self.hold_until: Dict[int, float] = {}
+        self._ready = False
+        self.stats = defaultdict(int)
+
+    def _ensure(self):
+        if not self._ready:
+            self.store.ensure(self.SCHEMA)
+            self._ready = True
+
+    def register_bot(self, bot):
+        self.bots[bot.id] = bot
+
+    # ---------- jobs ----------
+
+    def create(self, bot, targets: List[int], admin_chat_id: int, status_message_id: int,
+               text: str = None, from_chat_id: int = None, from_message_id: int = None) -> int:
+        self._ensure()
+        self.register_bot(bot)
+        targets = list(dict.fromkeys(t for t in targets if t))
+        job_id = self.store.execute(
+            "INSERT INTO broadcast_jobs (bot_id, status, text, from_chat_id, from_message_id, admin_chat_id, "
+            "status_message_id, total, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (bot.id, self.RUNNING, text, from_chat_id, from_message_id, admin_chat_id,
+             status_message_id, len(targets), datetime.now(timezone.utc).timestamp())
+        ).lastrowid
+        self.store.executemany(
+            "INSERT INTO broadcast_targets (job_id, seq, chat_id) VALUES (?, ?, ?)",
+            [(job_id, seq, chat_id) for seq, chat_id in enumerate(targets, 1)]
+        )
+        self.state[job_id] = self.RUNNING
+        self.stats['jobs'] += 1
+        return job_id
+
+    def job(self, job_id: int) -> Optional[Dict[str, Any]]:
+        self._ensure()
+        rows = self.store.query(f"SELECT {', '.join(self.JOB_FIELDS)} FROM broadcast_jobs WHERE id = ?", (job_id,))
+        return dict(zip(self.JOB_FIELDS, rows[0])) if rows else None
+
+    def latest(self) -> Optional[int]:
+        self._ensure()
+        rows = self.store.query("SELECT MAX(id) FROM broadcast_jobs")
+        return rows[0][0] if rows else None
+
+    def counts(self, job_id: int) -> Dict[str, int]:
+        rows = self.store.query(
+            "SELECT status, COUNT(*) FROM broadcast_targets WHERE job_id = ? GROUP BY status", (job_id,)
+        )
+        return dict(rows)
+
+    def _set_status(self, job_id: int, allowed: Tuple[str, ...], status: str) -> bool:
+        self._ensure()
+        marks = ', '.join('?' for _ in allowed)
+        finished = datetime.now(timezone.utc).timestamp() if status in (self.CANCELLED, self.DONE) else None
+        changed = self.store.execute(
+            f"UPDATE broadcast_jobs SET status = ?, finished = ? WHERE id = ? AND status IN ({marks})",
+            (status, finished, job_id, *allowed)
+        ).rowcount
+        if changed:
+            self.state[job_id] = status
+        return bool(changed)
+
+    def start(self, job_id: int) -> bool:
+        if job_id in self.tasks:
+            return False
+        self.tasks[job_id] = asyncio.create_task(self._run(job_id))
+        return True
+
+    def pause(self, job_id: int) -> bool:
+        return self._set_status(job_id, (self.RUNNING,), self.PAUSED)
+
+    def cancel(self, job_id: int) -> bool:
+        return self._set_status(job_id, (self.RUNNING, self.PAUSED), self.CANCELLED)
+
+    def resume(self, job_id: int) -> bool:
+        job = self.job(job_id)
+        if not job or job['bot_id'] not in self.bots:
+            return False
+        if not self._set_status(job_id, (self.PAUSED,), self.RUNNING):
+            return False
+        self.start(job_id)  # a still-draining task simply carries on
+        return True
+
+    def resume_all(self) -> int:
+        """Restart jobs that were running when the process stopped."""
+        self._ensure()
+        started = 0
+        for job_id, bot_id in self.store.query("SELECT id, bot_id FROM broadcast_jobs WHERE status = ?", (self.RUNNING,)):
+            if bot_id in self.bots:
+                self.state[job_id] = self.RUNNING
+                started += self.start(job_id)
+        if started:
+            logger.info(f"📣 Resumed {started} broadcast job(s)")
+        return started
+
+    # ---------- sending ----------
+
+    def _bucket(self, bot_id: int) -> TokenBucket:
+        bucket = self.buckets.get(bot_id)
+        if bucket is None:
+            # Broadcasts get their own ceiling below the global bucket so live replies keep headroom
+            rate = 1.0 / max(Config.BROADCAST_RATE_LIMIT, 0.001)
+            bucket = self.buckets[bot_id] = TokenBucket(rate, rate)
+        return bucket
+
+    async def _run(self, job_id: int):
+        try:
+            await self._drive(job_id)
+        except Exception as e:
+            logger.error(f"Broadcast job {job_id} crashed: {e}", exc_info=True)
+        finally:
+            self.tasks.pop(job_id, None)
+
+    async def _drive(self, job_id: int):
+        job = self.job(job_id)
+        bot = self.bots[job['bot_id']]
+        loop = asyncio.get_running_loop()
+        limit = asyncio.Semaphore(Config.BROADCAST_CONCURRENCY)
+        cursor = job['cursor']
+
+        while True:
+            run = {'started': loop.time(), 'done': job['total'] - self.counts(job_id).get('pending', 0),
+                   'reported': loop.time()}
+            while self.state.get(job_id) == self.RUNNING:
+                rows = self.store.query(
+                    "SELECT seq, chat_id, attempts FROM broadcast_targets "
+                    "WHERE job_id = ? AND status = 'pending' AND seq > ? ORDER BY seq LIMIT ?",
+                    (job_id, cursor, self.PAGE)
+                )
+                if not rows:
+                    if cursor == 0 or not self.counts(job_id).get('pending'):
+                        break
+                    cursor = 0  # another pass for targets left pending by flood control
+                    continue
+                await asyncio.gather(*(self._send_one(bot, job, seq, chat_id, attempts, limit, run)
+                                       for seq, chat_id, attempts in rows))
+                if self.state.get(job_id) != self.RUNNING:
+                    break  # leave the cursor on the unfinished page
+                cursor = rows[-1][0]
+                self.store.execute("UPDATE broadcast_jobs SET cursor = ? WHERE id = ?", (cursor, job_id))
+
+            if self.state.get(job_id) == self.RUNNING:
+                self._set_status(job_id, (self.RUNNING,), self.DONE)
+            await self._report(bot, job, final=True)
+            # A /bcresume during the report found this task still alive and did not start
+            # another one, so keep driving here
+            if self.state.get(job_id) != self.RUNNING:
+                return
+
+    async def _send_one(self, bot, job: Dict[str, Any], seq: int, chat_id: int, attempts: int,
+                        limit: asyncio.Semaphore, run: Dict[str, float]):
+        async with limit:
+            if self.state.get(job['id']) != self.RUNNING:
+                return
+            loop = asyncio.get_running_loop()
+            hold = self.hold_until.get(bot.id, 0.0) - loop.time()
+            if hold > 0:
+                await asyncio.sleep(hold)
+            await self._bucket(bot.id).acquire()
+            if self.state.get(job['id']) != self.RUNNING:
+                return  # paused or cancelled while waiting for a send slot
+
+            attempts += 1
+            error = None
+            try:
+                await outbound.throttled(bot, chat_id, lambda: self._deliver(bot, job, chat_id))
+                status = 'sent'
+            except RetryAfter as e:
+                # Flood control is per bot: hold every sender, keep the target for a later pass
+                wait = retry_after_seconds(e)
+                self.hold_until[bot.id] = max(self.hold_until.get(bot.id, 0.0), loop.time() + wait)
+                status = 'pending' if attempts < Config.BROADCAST_RETRY_ATTEMPTS else 'failed'
+                error = f"retry_after {wait:.0f}s"
+                self.stats['retry_after'] += 1
+            except Forbidden as e:
+                status, error = 'blocked', str(e)[:200]
+            except Exception as e:
+                status, error = 'failed', str(e)[:200]
+
+            self.store.execute(
+                "UPDATE broadcast_targets SET status = ?, attempts = ?, error = ? WHERE job_id = ? AND seq = ?",
+                (status, attempts, error, job['id'], seq)
+            )
+            self.stats[status] += 1
+
+            if loop.time() - run['reported'] >= Config.BROADCAST_PROGRESS_SECONDS:
+                run['reported'] = loop.time()
+                await self._report(bot, job, run=run)
+
+    @staticmethod
+    async def _deliver(bot, job: Dict[str, Any], chat_id: int):
+        if job['from_message_id']:
+            return await bot.copy_message(chat_id=chat_id, from_chat_id=job['from_chat_id'],
+                                          message_id=job['from_message_id'])
+        return await bot.send_message(chat_id=chat_id, text=html.escape(job['text']), parse_mode=ParseMode.HTML)
+
+    # ---------- progress ----------
+
+    def progress_text(self, job_id: int, run: Dict[str, float] = None) -> str:
+        job = self.job(job_id)
+        counts = self.counts(job_id)
+        total = job['total']
+        pending = counts.get('pending', 0)
+        done = total - pending
+        percent = int(done / total * 100) if total else 100
+        bar = "█" * (percent // 10) + "░" * (10 - (percent // 10))
+        lines = (
+            f"✅ <b>Sent:</b> {counts.get('sent', 0)}\n"
+            f"🚫 <b>Blocked:</b> {counts.get('blocked', 0)}\n"
+            f"❌ <b>Failed:</b> {counts.get('failed', 0)}\n"
+            f"🎯 <b>Total:</b> {total}"
+        )
+        status = job['status']
+
+        if status == self.RUNNING:
+            speed = eta = "—"
+            if run:
+                elapsed = asyncio.get_running_loop().time() - run['started']
+                rate = (done - run['done']) / elapsed if elapsed > 0 else 0.0
+                if rate > 0:
+                    speed = f"{rate:.1f} msg/s"
+                    eta = f"{int(pending / rate // 60)}m {int(pending / rate % 60)}s"
+            return (f"🚀 <b>Broadcasting...</b> (job #{job_id})\n\n[{bar}] {percent}%\n{lines}\n"
+                    f"⚡ <b>Speed:</b> {speed}\n⏳ <b>ETA:</b> {eta}\n\n"
+                    f"<code>/bcpause {job_id}</code> · <code>/bccancel {job_id}</code>")
+        if status == self.PAUSED:
+            return (f"⏸️ <b>Broadcast Paused</b> (job #{job_id})\n\n[{bar}] {percent}%\n{lines}\n\n"
+                    f"<code>/bcresume {job_id}</code> · <code>/bccancel {job_id}</code>")
+        if status == self.CANCELLED:
+            return f"🛑 <b>Broadcast Cancelled</b> (job #{job_id})\n\n[{bar}] {percent}%\n{lines}"
+
+        duration = round((job['finished'] or job['created']) - job['created'], 2)
+        if not counts.get('failed'):
+            headline = "✨ <b>Broadcast Successfully Completed!</b> ✨"
+        elif not counts.get('sent'):
+            headline = "❌ <b>Broadcast Failed</b> (no target received it)"
+        else:
+            headline = "⚠️ <b>Broadcast Completed with Errors</b>"
+        return (
+            f"{headline}\n\n"
+            f"📊 <b>Final Report:</b>\n"
+            f"{lines}\n"
+            f"⏱️ <b>Time Taken:</b> {duration}s\n\n"
+            f"<i>Powered by Niyati & Kavya Network</i>"
+        )
+
+    async def _report(self, bot, job: Dict[str, Any], run: Dict[str, float] = None, final: bool = False):
+        if not job['status_message_id']:
+            return
+        try:
+            await bot.edit_message_text(chat_id=job['admin_chat_id'], message_id=job['status_message_id'],
+                                        text=self.progress_text(job['id'], None if final else run),
+                                        parse_mode=ParseMode.HTML)
+        except:
+            pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'active_jobs': len(self.tasks), **self.stats}
+
+broadcast_engine = BroadcastEngine(local_store)
+
+# ============================================================================
+# FAN-OUT SCHEDULER (scheduled jobs, spread over a delivery window)
+# ============================================================================
+
+class FanoutRun:
+    """Counters for one run of a scheduled fan-out job."""
+
+    __slots__ = ('name', 'started', 'finished', 'window', 'targets', 'sent', 'failed', 'skipped')
+
+    def __init__(self, name: str, targets: int, window: float):
+        self.name = name
+        self.started = datetime.now(timezone.utc)
+        self.finished: Optional[datetime] = None
+        self.window = window
+        self.targets = targets
+        self.sent = 0
+        self.failed = 0
+        self.skipped = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        end = self.finished or datetime.now(timezone.utc)
+        duration = (end - self.started).total_seconds()
+        handled = self.sent + self.failed + self.skipped
+        return {
+            'started': self.started.isoformat(),
+            'duration_s': round(duration, 1),
+            'window_s': self.window,
+            'targets': self.targets,
+            'sent': self.sent,
+            'failed': self.failed,
+            'skipped': self.skipped,
+            'per_second': round(self.sent / duration, 2) if duration > 0 else 0.0,
+            'completion': round(handled / self.targets, 3) if self.targets else 1.0,
+            'running': self.finished is None
+        }
+
+
+class FanoutScheduler:
+    """
+    Spreads a scheduled job's sends evenly over a delivery window instead of
+    looping serially with sleeps. Target i is released at start + i * window / n,
+    at most FANOUT_CONCURRENCY sends are in flight, and every send still goes
+    through the outbound limits. One lock per job name keeps runs from overlapping.
+    """
+
+    def __init__(self):
+        self.locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self.runs: Dict[str, FanoutRun] = {}
+        self.stats = defaultdict(int)
+
+    def busy(self, name: str) -> bool:
+        return self.locks[name].locked()
+
+    async def run(self, name: str, bot, targets: List[int], send, window: float, keep=None) -> Optional[FanoutRun]:
+        """
+        Deliver `send(chat_id)` to every target within `window` seconds.
+        `keep(chat_id)` is an optional async filter checked just before sending.
+        Returns None if the previous run of `name` is still going.
+        """
+        lock = self.locks[name]
+        if self.busy(name):
+            self.stats['overlaps_skipped'] += 1
+            logger.warning(f"⏭️ {name} still running, skipping this run")
+            return None
+
+        async with lock:
+            run = self.runs[name] = FanoutRun(name, len(targets), window)
+            self.stats['started'] += 1
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            interval = window / len(targets) if targets else 0.0
+            limit = asyncio.Semaphore(Config.FANOUT_CONCURRENCY)
+            pending = set()
+
+            for i, chat_id in enumerate(targets):
+                delay = start + i * interval - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await limit.acquire()
+                task = asyncio.create_task(self._deliver(run, bot, chat_id, send, keep, limit))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+
+            if pending:
+                await asyncio.gather(*pending)
+            run.finished = datetime.now(timezone.utc)
+            return run
+
+    async def _deliver(self, run: FanoutRun, bot, chat_id: int, send, keep, limit: asyncio.Semaphore):
+        try:
+            if keep is not None and not await keep(chat_id):
+                run.skipped += 1
+                return
+            await outbound.throttled(bot, chat_id, lambda: send(chat_id))
+            run.sent += 1
+            self.stats['sent'] += 1
+        except Exception as e:
+            run.failed += 1
+            self.stats['failed'] += 1
+            logger.debug(f"{run.name} send to {chat_id} failed: {e}")
+        finally:
+            limit.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'runs': {name: run.to_dict() for name, run in self.runs.items()}, **self.stats}
+
+fanout = FanoutScheduler()
+
+# ============================================================================
+# MEDIA REGISTRY (Telegram file_id reuse for repeated images)
+# ============================================================================
+
+class MediaRegistry:
+    """
+    Remembers the file_id Telegram returns for a remote asset, per bot, so
+    the same image is uploaded once instead of re-fetched from its URL on
+    every send. Kept in the local store; a rejected file_id is dropped and
+    the asset is sent from its URL again.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS media_file_ids (
+        bot_id INTEGER NOT NULL,
+        asset TEXT NOT NULL,
+        file_id TEXT NOT NULL,
+        updated REAL NOT NULL,
+        PRIMARY KEY (bot_id, asset)
+    );
+    """
+
+    STALE_FILE_ERRORS = ('wrong file identifier', 'file reference')
+
+    def __init__(self, store: LocalStore):
+        self.store = store
+        self.file_ids: Dict[Tuple[int, str], str] = {}
+        self._ready = False
+        self.stats = defaultdict(int)
+
+    def _ensure(self):
+        if not self._ready:
+            self.store.ensure(self.SCHEMA)
+            for bot_id, asset, file_id in self.store.query("SELECT bot_id, asset, file_id FROM media_file_ids"):
+                self.file_ids[(bot_id, asset)] = file_id
+            self._ready = True
+
+    def remember(self, bot_id: int, asset: str, message) -> Optional[str]:
+        attachment = getattr(message, 'effective_attachment', None)
+        if isinstance(attachment, (list, tuple)):
+            attachment = attachment[-1] if attachment else None  # largest PhotoSize
+        file_id = getattr(attachment, 'file_id', None)
+        if file_id and self.file_ids.get((bot_id, asset)) != file_id:
+            self.file_ids[(bot_id, asset)] = file_id
+            self.store.execute(
+                "INSERT OR REPLACE INTO media_file_ids (bot_id, asset, file_id, updated) VALUES (?, ?, ?, ?)",
+                (bot_id, asset, file_id, datetime.now(timezone.utc).timestamp())
+            )
+        return file_id
+
+    def forget(self, bot_id: int, asset: str):
+        self.file_ids.pop((bot_id, asset), None)
+        self.store.execute("DELETE FROM media_file_ids WHERE bot_id = ? AND asset = ?", (bot_id, asset))
+
+    async def send(self, bot, asset: str, send):
+        """
+        Call `send(media)` with the cached file_id for `asset`, or with the
+        asset URL itself on first use or after Telegram rejects the file_id.
+        """
+        self._ensure()
+        file_id = self.file_ids.get((bot.id, asset))
+        if file_id:
+            try:
+                result = await send(file_id)
+                self.stats['hits'] += 1
+                return result
+            except BadRequest as e:
+                # Only a stale file_id is worth a re-upload; anything else would fail from the URL too
+                if not any(marker in str(e).lower() for marker in self.STALE_FILE_ERRORS):
+                    raise
+                self.stats['rejected'] += 1
+                logger.warning(f"🖼️ Cached file_id rejected ({e}), re-uploading {asset[:60]}")
+                self.forget(bot.id, asset)
+        result = await send(asset)
+        self.stats['uploads'] += 1
+        self.remember(bot.id, asset, result)
+        return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        self._ensure()
+        return {'cached': len(self.file_ids), **self.stats}
+
+media_registry = MediaRegistry(local_store)
+
+# ============================================================================
+# UPDATE PROCESSOR (per-chat ordering, priority admission)
+# ============================================================================
+
+class ChatPriorityProcessor(BaseUpdateProcessor):
+    """
+    Replaces concurrent_updates(True). Updates from the same chat run one at a
+    time in arrival order, at most UPDATE_MAX_IN_FLIGHT run at once, and when
+    slots are short they go to private chats first, then direct mentions,
+    callbacks and finally ambient group chatter.
+
+    Handlers only decide admission; the reply itself (LLM call, sends, history)
+    is handed to `submit`, which runs a chat's replies one at a time in the
+    order they were submitted, each holding an in-flight slot of its class
+    until it returns. The handler is free again at once, so a newer message
+    can still be admitted and supersede a stale reply.
+    """
+
+    PRIVATE, MENTION, CALLBACK, AMBIENT = range(4)
+    CLASSES = ('private', 'mention', 'callback', 'ambient')
+    MAX_PENDING = 4096  # PTB's own gate, kept out of the way of the priority queue
+
+    def __init__(self, bot_username: str, max_in_flight: int = None):
+        super().__init__(self.MAX_PENDING)
+        self.mention = f"@{bot_username}".lower()
+        self.bot_username = bot_username.lower()
+        self.max_in_flight = max_in_flight or Config.UPDATE_MAX_IN_FLIGHT
+        self.in_flight = 0
+        self.waiting: List[Tuple[int, int, asyncio.Future]] = []  # heap of (class, seq, future)
+        self.seq = 0
+        self.chat_locks: Dict[int, List] = {}  # chat_id -> [lock, holders + waiters]
+        self.lanes: Dict[int, deque] = {}  # chat_id -> replies waiting their turn
+        self.lane_workers: Dict[int, asyncio.Task] = {}
+        self.waits = [deque(maxlen=500) for _ in self.CLASSES]  # submit -> reply start
+        self.processed = [0] * len(self.CLASSES)
+        self.updates = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def classify(self, update: object) -> int:
+        if not isinstance(update, Update):
+            return self.AMBIENT
+        if update.callback_query:
+            return self.CALLBACK
+        chat = update.effective_chat
+        if chat and chat.type == 'private':
+            return self.PRIVATE
+        message = update.effective_message
+        if message:
+            text = (message.text or message.caption or '').lower()
+            reply = message.reply_to_message
+            if (self.mention in text or text.startswith('/')
+                    or (reply and reply.from_user and (reply.from_user.username or '').lower() == self.bot_username)):
+                return self.MENTION
+        return self.AMBIENT
+
+    async def _acquire(self, cls: int):
+        if self.in_flight < self.max_in_flight and not self.waiting:
+            self.in_flight += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self.seq += 1
+        heapq.heappush(self.waiting, (cls, self.seq, future))
+        try:
+            await future  # the slot is handed over by _release
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release()  # granted just as we were cancelled: pass it on
+            raise
+
+    def _release(self):
+        while self.waiting:
+            _, _, future = heapq.heappop(self.waiting)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+    async def do_process_update(self, update: object, coroutine):
+        cls = self.classify(update)
+        chat = update.effective_chat if isinstance(update, Update) else None
+        entry = None
+        if chat:
+            entry = self.chat_locks.setdefault(chat.id, [asyncio.Lock(), 0])
+            entry[1] += 1
+        try:
+            if entry:
+                await entry[0].acquire()
+            try:
+                await self._acquire(cls)
+                try:
+                    await coroutine
+                finally:
+                    self._release()
+                    self.updates += 1
+            finally:
+                if entry:
+                    entry[0].release()
+        finally:
+            if entry:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    self.chat_locks.pop(chat.id, None)
+
+    def submit(self, chat_id: int, cls: int, factory) -> asyncio.Future:
+        """
+        Queue `factory()` (a coroutine function) as reply work for a chat. The
+        returned future resolves with its result; cancelling it cancels the work.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.lanes.setdefault(chat_id, deque()).append((cls, factory, future, loop.time()))
+        if chat_id not in self.lane_workers:
+            self.lane_workers[chat_id] = asyncio.create_task(self._lane(chat_id))
+        return future
+
+    async def _lane(self, chat_id: int):
+        loop = asyncio.get_running_loop()
+        lane = self.lanes[chat_id]
+        try:
+            while lane:
+                cls, factory, future, queued = lane.popleft()
+                if future.done():
+                    continue  # given up on while it waited
+                await self._acquire(cls)
+                self.waits[cls].append(loop.time() - queued)
+                try:
+                    # Own task, so cancelling a superseded reply leaves the lane running
+                    task = asyncio.create_task(factory())
+                    future.add_done_callback(lambda f, task=task: f.cancelled() and task.cancel())
+                    await asyncio.wait({task})
+                finally:
+                    self._release()
+                    self.processed[cls] += 1
+                if future.done():
+                    continue
+                if task.cancelled():
+                    future.cancel()
+                elif task.exception() is not None:
+                    logger.error(f"Reply in chat {chat_id} failed: {task.exception()}", exc_info=task.exception())
+                    future.set_exception(task.exception())
+                    future.exception()  # logged above; callers that don't wait on it stay quiet
+                else:
+                    future.set_result(task.result())
+        finally:
+            self.lane_workers.pop(chat_id, None)
+            if not lane:
+                self.lanes.pop(chat_id, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        depth = [0] * len(self.CLASSES)
+        for cls, _, future in self.waiting:
+            if not future.done():
+                depth[cls] += 1
+        for lane in self.lanes.values():
+            for cls, *_ in lane:
+                depth[cls] += 1
+        classes = {}
+        for cls, name in enumerate(self.CLASSES):
+            samples = sorted(self.waits[cls])
+            classes[name] = {
+                'queued': depth[cls],
+                'processed': self.processed[cls],
+                'wait_p50_ms': round(samples[len(samples) // 2] * 1000, 1) if samples else None,
+                'wait_p95_ms': round(samples[int(len(samples) * 0.95)] * 1000, 1) if samples else None,
+            }
+        return {
+            'in_flight': self.in_flight,
+            'max_in_flight': self.max_in_flight,
+            'active_chats': len(self.chat_locks),
+            'reply_lanes': len(self.lanes),
+            'updates': self.updates,
+            'classes': classes
+        }
+
+update_processors = {
+    'Niyati': ChatPriorityProcessor(Config.NIYATI_USERNAME),
+    'Kavya': ChatPriorityProcessor(Config.KAVYA_USERNAME)
+}
+
+# ============================================================================
+# SHARED HELPER FUNCTIONS
+# ============================================================================
+
+def send_multi_messages(bot, chat_id: int, messages: List[str], reply_to: int = None,
+                        parse_mode: str = None, auto_delete: bool = False) -> OutboundJob:
+    """Queue multiple messages; the chat's outbound worker sends them with HUMAN-LIKE typing delays."""
+    return outbound.enqueue(OutboundJob(bot, chat_id, messages, reply_to=reply_to,
+                                        parse_mode=parse_mode, auto_delete=auto_delete))
+
+async def prepare_voice_note(bot, chat_id, text, voice_type='niyati', rate='+0%', pitch='+0Hz') -> Optional[bytes]:
+    """TTS plus the "recording" pause, done before the upload is queued so no send slot waits on it."""
+    audio = await voice_generator.generate(text, voice_type=voice_type, rate=rate, pitch=pitch)
+    if not audio:
+        return None
     try:
-        audio = await voice_generator.generate(text, voice_type=voice_type, rate=rate, pitch=pitch)
-        if audio:
-            await bot.send_chat_action(chat_id=chat_id, action=ChatAction.RECORD_VOICE)
-            await asyncio.sleep(random.uniform(1.0, 2.5))
-            await bot.send_voice(chat_id=chat_id, voice=audio)
-            return True
-        return False
-    except Exception as e:
-        logger.error(f"Voice error: {e}")
+        await bot.send_chat_action(chat_id=chat_id, action=ChatAction.RECORD_VOICE)
+    except TelegramError:
+        pass
+    await asyncio.sleep(random.uniform(1.0, 2.5))
+    return audio.getvalue()  # bytes, so a retried upload re-sends the whole note
+
+async def send_voice_message(bot, chat_id, text, voice_type='niyati', rate='+0%', pitch='+0Hz') -> bool:
+    """Returns False if no audio could be generated; send errors (RetryAfter included) propagate."""
+    audio = await prepare_voice_note(bot, chat_id, text, voice_type=voice_type, rate=rate, pitch=pitch)
+    if not audio:
         return False
+    await bot.send_voice(chat_id=chat_id, voice=audio)
+    return True
 
 async def admin_check(update: Update) -> bool:
     return update.effective_user.id in Config.ADMIN_IDS
@@ -1825,203 +4347,548 @@ async def is_group_admin(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return False
 
 # ============================================================================
-# UNIFIED MESSAGE HANDLER FACTORY
+# BURST COALESCING (private chats)
 # ============================================================================
 
-def create_message_handler(bot_name: str, bot_username: str, other_bot_username: str,
-                           ai_engine, rate_limiter: RateLimiter,
-                           voice_type: str, voice_rate: str, voice_pitch: str,
-                           voice_chance: float):
+class Burst:
+    __slots__ = ('bot', 'fragments', 'message_id', 'user_id', 'user_name', 'is_reply',
+                 'started', 'last_at', 'callback')
+
+    def __init__(self, bot, user_id: int, user_name: str, callback, now: float):
+        self.bot = bot
+        self.fragments: List[str] = []
+        self.message_id = None
+        self.user_id = user_id
+        self.user_name = user_name
+        self.is_reply = False
+        self.started = now
+        self.last_at = now
+        self.callback = callback
+
+
+class BurstCoalescer:
     """
-    Factory function that creates a message handler for either Niyati or Kavya.
-    This eliminates duplicate code and ensures both bots behave consistently.
+    People type in bursts ("hi" / "sun" / "ek baat batau"). Fragments from one
+    private chat that arrive within a short quiet window become one turn: the
+    flush fires on the timer wheel once the user pauses, with every fragment
+    in order. The window adapts to each user's own typing cadence.
     """
-    
-    async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        message = update.message
-        if not message or not message.text:
-            return
-        
-        user = update.effective_user
-        chat = update.effective_chat
-        user_message = message.text.strip()
-        
-        await db.update_user_activity(user.id)
-        
-        if user_message.startswith('/'):
-            return
-        
-        is_group = chat.type in ['group', 'supergroup']
-        is_private = chat.type == 'private'
-        bot_id = context.bot.id
-        
-        # Spam filter
-        if ContentFilter.detect_spam_link(user_message):
-            return
-        
-        # Ignore other bots to prevent loops
-        if message.from_user and message.from_user.is_bot:
+
+    CADENCE_USERS = 10000
+
+    def __init__(self):
+        self.bursts: Dict[Tuple[str, int], Burst] = {}
+        self.cadence: OrderedDict = OrderedDict()  # user_id -> EWMA gap between fragments
+        self.stats = defaultdict(int)
+
+    def is_open(self, bot_name: str, chat_id: int) -> bool:
+        return (bot_name, chat_id) in self.bursts
+
+    def window_for(self, user_id: int, text: str) -> float:
+        gap = self.cadence.get(user_id)
+        window = Config.BURST_WINDOW_MIN if gap is None else gap * 1.5
+        if len(text) < 15 and not text.rstrip().endswith(('?', '.', '!')):
+            window += 0.8  # short openers are usually followed by more
+        return min(Config.BURST_WINDOW_MAX, max(Config.BURST_WINDOW_MIN, window))
+
+    def _note_gap(self, user_id: int, gap: float):
+        previous = self.cadence.pop(user_id, None)
+        self.cadence[user_id] = gap if previous is None else previous * 0.7 + gap * 0.3
+        while len(self.cadence) > self.CADENCE_USERS:
+            self.cadence.popitem(last=False)
+
+    def add(self, bot, bot_name: str, chat_id: int, message_id: int, user_id: int, user_name: str,
+            text: str, is_reply: bool, callback) -> bool:
+        """
+        Buffer a fragment. `callback(bot, chat_id, message_id, user_id, user_name, text, is_reply)`
+        queues the turn once the burst closes. Returns True if this fragment opened a new burst.
+        """
+        now = asyncio.get_running_loop().time()
+        key = (bot_name, chat_id)
+        burst = self.bursts.get(key)
+        opened = burst is None
+        if opened:
+            burst = self.bursts[key] = Burst(bot, user_id, user_name, callback, now)
+            self.stats['bursts'] += 1
+        else:
+            self._note_gap(user_id, now - burst.last_at)
+            self.stats['merged'] += 1
+        burst.fragments.append(text)
+        burst.message_id = message_id
+        burst.is_reply = burst.is_reply or is_reply
+        burst.last_at = now
+        self.stats['fragments'] += 1
+
+        delay = min(self.window_for(user_id, text), burst.started + Config.BURST_MAX_SECONDS - now)
+        if len(burst.fragments) >= Config.BURST_MAX_FRAGMENTS or delay <= 0:
+            # Full or out of time: queue it now rather than waiting for the next tick
+            deferred_actions.cancel(('burst',) + key)
+            self._close(key)
+        else:
+            deferred_actions.schedule(delay, ('burst',) + key, self._flush, key, kind='burst')
+        return opened
+
+    async def _flush(self, key: Tuple[str, int]):
+        self._close(key)
+
+    def _close(self, key: Tuple[str, int]):
+        burst = self.bursts.pop(key, None)
+        if burst is None:
             return
-        
-        # Rate limit
-        allowed, reason = rate_limiter.check(user.id)
-        if not allowed:
-            if reason == "day":
-                msg = "Aaj ke liye bohot baat ho gayi 😅" if bot_name == 'Niyati' else "Aaj ke liye bahut ho gaya. Kal milte hain."
-                await message.reply_text(msg)
+        burst.callback(burst.bot, key[1], burst.message_id, burst.user_id, burst.user_name,
+                       "\n".join(burst.fragments), burst.is_reply)
+
+    def get_stats(self) -> Dict[str, Any]:
+        bursts = self.stats['bursts']
+        return {
+            'open': len(self.bursts),
+            'avg_fragments': round(self.stats['fragments'] / bursts, 2) if bursts else 0.0,
+            **self.stats
+        }
+
+burst_coalescer = BurstCoalescer()
+
+# ============================================================================
+# GENERATION TRACKING (supersede stale private replies)
+# ============================================================================
+
+class Generation:
+    __slots__ = ('key', 'task', 'user_message', 'job', 'voice_job', 'started')
+
+    def __init__(self, key: Tuple[str, int], task: asyncio.Task, user_message: str, started: float):
+        self.key = key
+        self.task = task
+        self.user_message = user_message
+        self.job: Optional[OutboundJob] = None
+        self.voice_job: Optional[OutboundJob] = None
+        self.started = started
+
+
+class GenerationTracker:
+    """
+    One live reply per (bot, private chat). When a newer turn is queued, an
+    older one still waiting on the LLM is cancelled and its text carried into
+    the new turn; one that is already sending has its not-yet-sent parts dropped.
+    """
+
+    def __init__(self):
+        self.active: Dict[Tuple[str, int], Generation] = {}
+        self.carried: Dict[Tuple[str, int], str] = {}  # text of cancelled turns, for the next begin()
+        self.stats = defaultdict(float)
+
+    def supersede(self, bot_name: str, chat_id: int):
+        """A newer turn for this chat was queued: stop or trim the one in flight."""
+        key = (bot_name, chat_id)
+        previous = self.active.pop(key, None)
+        if previous is None:
             return
+        self.stats['superseded'] += 1
+        if previous.job is None:
+            previous.task.cancel()
+            self.stats['cancelled_generations'] += 1
+            self.stats['cancelled_seconds'] += asyncio.get_running_loop().time() - previous.started
+            carried = self.carried.get(key)
+            self.carried[key] = f"{carried}\n{previous.user_message}" if carried else previous.user_message
+        elif not previous.job.cancelled:
+            unsent = len(previous.job.parts) - len(previous.job.sent_ids)
+            if unsent > 0:
+                previous.job.cancel()
+                self.stats['cancelled_parts'] += unsent
+        if previous.voice_job is not None and not previous.voice_job.cancelled:
+            previous.voice_job.cancel()
+            self.stats['cancelled_voice'] += 1
+
+    def begin(self, bot_name: str, chat_id: int, user_message: str) -> Tuple[Generation, str]:
+        """Register the current task as the chat's generation; returns it and the (possibly merged) text."""
+        key = (bot_name, chat_id)
+        self.supersede(bot_name, chat_id)
+        carried = self.carried.pop(key, None)
+        if carried:
+            user_message = f"{carried}\n{user_message}"
+            self.stats['merged_turns'] += 1
+        generation = self.active[key] = Generation(key, asyncio.current_task(), user_message,
+                                                   asyncio.get_running_loop().time())
+        self.stats['started'] += 1
+        return generation, user_message
+
+    def finish(self, generation: Generation):
+        if self.active.get(generation.key) is generation:
+            del self.active[generation.key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'active': len(self.active),
+            **{k: round(v, 2) if k == 'cancelled_seconds' else int(v) for k, v in self.stats.items()}
+        }
 
-        is_direct = False
-        other_bot_recent_reply = None
+generation_tracker = GenerationTracker()
 
-        # ========== GROUP LOGIC ==========
-        if is_group:
-            my_mention = f"@{bot_username}".lower()
-            other_mention = f"@{other_bot_username}".lower()
-            msg_lower = user_message.lower()
-            
-            is_reply_to_me = (message.reply_to_message and 
-                              message.reply_to_message.from_user and
-                              message.reply_to_message.from_user.id == bot_id)
-            is_mentioned = my_mention in msg_lower
-            is_direct = is_reply_to_me or is_mentioned
-            
-            is_other_bot_targeted = other_mention in msg_lower or (
-                message.reply_to_message and 
-                message.reply_to_message.from_user and
-                message.reply_to_message.from_user.id != bot_id and
-                message.reply_to_message.from_user.is_bot
+# ============================================================================
+# DEFERRED REPLIES (parked while LLM capacity is exhausted)
+# ============================================================================
+
+class DeferredReplyQueue:
+    """
+    When every LLM key is spent, a private turn is parked here instead of
+    answered with a "network issue" line. Rows live in the local store, one per
+    (bot, chat): later messages from the same chat are appended to the parked
+    turn so order is kept. A periodic drain answers the oldest turns first as
+    soon as capacity is back; turns older than DEFERRED_REPLY_MAX_AGE are
+    dropped (the user's text still goes into history).
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS deferred_replies (
+        bot_name TEXT NOT NULL,
+        chat_id INTEGER NOT NULL,
+        message_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        user_name TEXT,
+        user_message TEXT NOT NULL,
+        is_reply INTEGER NOT NULL DEFAULT 0,
+        created REAL NOT NULL,
+        PRIMARY KEY (bot_name, chat_id)
+    );
+    CREATE INDEX IF NOT EXISTS deferred_replies_created ON deferred_replies (created);
+    """
+
+    def __init__(self, store: LocalStore):
+        self.store = store
+        self.bots: Dict[str, Any] = {}
+        self.responders: Dict[str, Any] = {}
+        self.lock = asyncio.Lock()
+        self._ready = False
+        self.stats = defaultdict(int)
+
+    def _ensure(self):
+        if not self._ready:
+            self.store.ensure(self.SCHEMA)
+            self._ready = True
+
+    def register_bot(self, bot_name: str, bot):
+        self.bots[bot_name] = bot
+
+    def register_responder(self, bot_name: str, responder):
+        """
+        `responder(bot, chat_id, message_id, user_id, user_name, user_message, is_reply, parked_at=)`
+        queues a turn and returns a future that resolves True if it had to park it again.
+        """
+        self.responders[bot_name] = responder
+
+    def has_pending(self, bot_name: str, chat_id: int) -> bool:
+        self._ensure()
+        return bool(self.store.query(
+            "SELECT 1 FROM deferred_replies WHERE bot_name = ? AND chat_id = ?", (bot_name, chat_id)
+        ))
+
+    def park(self, bot_name: str, chat_id: int, message_id: int, user_id: int, user_name: str,
+             user_message: str, is_reply: bool, created: float = None) -> bool:
+        """
+        Queue a turn for later. False if the queue is full and the caller must answer now.
+        A turn that failed again after being drained passes its original `created`.
+        """
+        self._ensure()
+        merged = self.store.execute(
+            "UPDATE deferred_replies SET user_message = user_message || char(10) || ?, message_id = ?, "
+            "is_reply = MAX(is_reply, ?) WHERE bot_name = ? AND chat_id = ?",
+            (user_message, message_id, int(is_reply), bot_name, chat_id)
+        ).rowcount
+        if not merged:
+            if self.store.query("SELECT COUNT(*) FROM deferred_replies")[0][0] >= Config.DEFERRED_REPLY_MAX:
+                self.stats['overflow'] += 1
+                return False
+            self.store.execute(
+                "INSERT INTO deferred_replies (bot_name, chat_id, message_id, user_id, user_name, user_message, "
+                "is_reply, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (bot_name, chat_id, message_id, user_id, user_name, user_message, int(is_reply),
+                 created or datetime.now(timezone.utc).timestamp())
             )
-            
-            plan = None
-            async with group_turn_locks[chat.id]:
-                turn_state = group_turn_manager[chat.id]
-                pending = turn_state['pending_bot_replies'].get(message.message_id)
-                if not pending:
-                    direct_target = None
-                    if is_mentioned and my_mention in msg_lower and other_mention not in msg_lower:
-                        direct_target = bot_name
-                    elif is_mentioned and other_mention in msg_lower and my_mention not in msg_lower:
-                        direct_target = 'Niyati' if bot_name == 'Kavya' else 'Kavya'
-                    elif is_reply_to_me:
-                        direct_target = bot_name
-                    elif is_other_bot_targeted:
-                        direct_target = 'Niyati' if bot_name == 'Kavya' else 'Kavya'
-
-                    if direct_target:
-                        first_bot = direct_target
-                        second_bot = 'Kavya' if first_bot == 'Niyati' else 'Niyati'
-                    else:
-                        first_bot, second_bot = random.sample(['Niyati', 'Kavya'], 2)
-
-                    base_first_chance = 1.0 if direct_target else Config.GROUP_RESPONSE_RATE
-                    allow_first = random.random() < base_first_chance
-                    pending = {
-                        'first_bot': first_bot,
-                        'second_bot': second_bot,
-                        'allow_first': allow_first,
-                        'second_base_chance': 0.6,
-                        'first_response_len': 0,
-                        'human_text': user_message,
-                        'user_name': user.first_name,
-                        'user_id': user.id
-                    }
-                    turn_state['pending_bot_replies'][message.message_id] = pending
-
-                    if message.message_id not in turn_state['processed_human_messages']:
-                        db.add_group_message(chat.id, user.first_name, user_message)
-                        shared_group_memory.setdefault(chat.id, []).append({
-                            'username': user.first_name,
-                            'content': user_message,
-                            'role': 'user',
-                            'timestamp': datetime.now(timezone.utc).isoformat()
-                        })
-                        if len(shared_group_memory[chat.id]) > 30:
-                            shared_group_memory[chat.id] = shared_group_memory[chat.id][-30:]
-                        turn_state['processed_human_messages'].add(message.message_id)
+        self.stats['parked'] += 1
+        return True
 
-                    turn_state['last_human_at'] = datetime.now(timezone.utc)
-                    turn_state['exchange_count'] = 0
+    async def _expire(self):
+        cutoff = datetime.now(timezone.utc).timestamp() - Config.DEFERRED_REPLY_MAX_AGE
+        rows = self.store.query(
+            "SELECT bot_name, chat_id, user_id, user_message FROM deferred_replies WHERE created < ?", (cutoff,)
+        )
+        for bot_name, chat_id, user_id, user_message in rows:
+            self.store.execute("DELETE FROM deferred_replies WHERE bot_name = ? AND chat_id = ?", (bot_name, chat_id))
+            await db.save_message(user_id, 'user', user_message, bot_name=bot_name)
+            self.stats['expired'] += 1
+
+    async def drain(self):
+        """Answer parked turns, oldest first, while the LLM has capacity."""
+        if self.lock.locked():
+            return
+        async with self.lock:
+            self._ensure()
+            await self._expire()
+            while llm_gateway.has_capacity():
+                rows = self.store.query(
+                    "SELECT bot_name, chat_id, message_id, user_id, user_name, user_message, is_reply, created "
+                    "FROM deferred_replies ORDER BY created LIMIT 1"
+                )
+                if not rows:
+                    return
+                bot_name, chat_id, message_id, user_id, user_name, user_message, is_reply, created = rows[0]
+                self.store.execute("DELETE FROM deferred_replies WHERE bot_name = ? AND chat_id = ?", (bot_name, chat_id))
+                bot, responder = self.bots.get(bot_name), self.responders.get(bot_name)
+                if bot is None or responder is None:
+                    self.stats['dropped'] += 1
+                    continue
+                # The reply runs on the chat's lane; a newer message may supersede (cancel)
+                # it, which must not take the rest of the drain down with it
+                future = responder(bot, chat_id, message_id, user_id, user_name,
+                                   user_message, bool(is_reply), parked_at=created)
+                await asyncio.wait({future})
+                if future.cancelled():
+                    self.stats['superseded'] += 1  # folded into the newer turn
+                elif future.exception() is not None:
+                    self.stats['failed'] += 1  # the lane has logged it
+                elif future.result():
+                    return  # capacity ran out again and the turn went back in the queue
+                else:
+                    self.stats['answered'] += 1
 
-                plan = pending
+    def get_stats(self) -> Dict[str, Any]:
+        self._ensure()
+        pending, oldest = self.store.query("SELECT COUNT(*), MIN(created) FROM deferred_replies")[0]
+        age = datetime.now(timezone.utc).timestamp() - oldest if oldest else 0.0
+        return {'pending': pending, 'oldest_age_s': round(age, 1), **self.stats}
 
-            # Clean mention from message
-            user_message = re.sub(rf'@{bot_username}', '', user_message, flags=re.IGNORECASE).strip() or user_message
+deferred_replies = DeferredReplyQueue(local_store)
 
-            if not plan.get('allow_first'):
-                async with group_turn_locks[chat.id]:
-                    group_turn_manager[chat.id]['pending_bot_replies'].pop(message.message_id, None)
-                return
+async def deferred_reply_job(context: ContextTypes.DEFAULT_TYPE):
+    await deferred_replies.drain()
 
-            if bot_name == plan.get('second_bot'):
-                await asyncio.sleep(random.uniform(4.0, 8.0))
-                async with group_turn_locks[chat.id]:
-                    turn_state = group_turn_manager[chat.id]
-                    active_plan = turn_state['pending_bot_replies'].get(message.message_id, {})
-                    if active_plan.get('first_response_len', 0) > 220:
-                        active_plan['second_base_chance'] = min(active_plan.get('second_base_chance', 0.6), 0.35)
-                    if turn_state.get('exchange_count', 0) >= 2:
-                        active_plan['second_base_chance'] = min(active_plan.get('second_base_chance', 0.6), 0.25)
-                    if check_bot_loop(chat.id):
-                        turn_state['pending_bot_replies'].pop(message.message_id, None)
-                        return
-                    if random.random() >= active_plan.get('second_base_chance', 0.6):
-                        turn_state['pending_bot_replies'].pop(message.message_id, None)
-                        return
-                    other_bot_recent_reply = active_plan.get('first_reply')
-            elif bot_name != plan.get('first_bot'):
-                return
-            
-            await db.get_or_create_group(chat.id, chat.title)
+# ============================================================================
+# UNIFIED MESSAGE HANDLER FACTORY
+# ============================================================================
 
-        # ========== PRIVATE LOGIC ==========
-        if is_private:
-            await db.get_or_create_user(user.id, user.first_name, user.username)
+class AdmissionCounters:
+    """Per-bot counts of admitted messages and of each rejection reason."""
 
+    def __init__(self):
+        self.counts: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    def admit(self, bot_name: str):
+        self.counts[bot_name]['admitted'] += 1
+        request_counters.record(bot_name)
+
+    def reject(self, bot_name: str, reason: str):
+        self.counts[bot_name][reason] += 1
+
+    def coalesced(self, bot_name: str):
+        """A fragment folded into an open burst: no new request, no rejection."""
+        self.counts[bot_name]['coalesced'] += 1
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        return {bot: dict(reasons) for bot, reasons in self.counts.items()}
+
+admission_counters = AdmissionCounters()
+
+DAILY_LIMIT_MESSAGES = {
+    'Niyati': "Aaj ke liye bohot baat ho gayi 😅",
+    'Kavya': "Aaj ke liye bahut ho gaya. Kal milte hain."
+}
+
+def plan_group_turn(message, user_message: str, bot_name: str, bot_id: int,
+                    my_mention: str, other_mention: str) -> Dict:
+    """
+    Decide, once per human group message, which bot speaks first and whether
+    anyone replies at all. Synchronous only: spam, targeting and sampling.
+    """
+    other_bot = 'Niyati' if bot_name == 'Kavya' else 'Kavya'
+    user = message.from_user
+    plan = {
+        'first_bot': bot_name,
+        'second_bot': other_bot,
+        'allow_first': False,
+        'second_base_chance': 0.6,
+        'first_response_len': 0,
+        'human_text': user_message,
+        'user_name': user.first_name,
+        'user_id': user.id
+    }
+
+    if ContentFilter.detect_spam_link(user_message):
+        plan['rejected'] = 'spam'
+        return plan
+
+    msg_lower = user_message.lower()
+    reply_from = message.reply_to_message.from_user if message.reply_to_message else None
+    is_reply_to_me = bool(reply_from and reply_from.id == bot_id)
+    is_mentioned = my_mention in msg_lower
+    is_other_bot_targeted = other_mention in msg_lower or bool(
+        reply_from and reply_from.id != bot_id and reply_from.is_bot
+    )
+
+    direct_target = None
+    if is_mentioned and other_mention not in msg_lower:
+        direct_target = bot_name
+    elif is_mentioned and other_mention in msg_lower and my_mention not in msg_lower:
+        direct_target = other_bot
+    elif is_reply_to_me:
+        direct_target = bot_name
+    elif is_other_bot_targeted:
+        direct_target = other_bot
+
+    if direct_target:
+        plan['first_bot'] = direct_target
+        plan['second_bot'] = 'Kavya' if direct_target == 'Niyati' else 'Niyati'
+    else:
+        plan['first_bot'], plan['second_bot'] = random.sample(['Niyati', 'Kavya'], 2)
+
+    base_first_chance = 1.0 if direct_target else budget_governor.group_response_rate()
+    plan['allow_first'] = random.random() < base_first_chance
+    return plan
+
+async def await_group_admission(chat_id: int, message_id: int, plan: Dict, timeout: float = 2.0) -> Dict:
+    """
+    The other bot claimed this turn and is still charging the rate limiter.
+    Wait briefly for its verdict; if it never lands, stay quiet.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while loop.time() < deadline:
+        await asyncio.sleep(0.1)
+        current = await group_state.get_plan(chat_id, message_id)
+        if current is None:
+            break
+        if current.get('admission') != 'pending':
+            return current
+    return {**plan, 'allow_first': False, 'rejected': 'admission_timeout'}
+
+async def await_joint_lines(chat_id: int, message_id: int, plan: Dict, timeout: float) -> Dict:
+    """
+    In joint mode the first bot writes the second bot's lines into the plan.
+    Wait for them, or for the first bot's own reply (the joint call fell back),
+    so a slow joint generation does not cost a second LLM call.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while plan and 'second_lines' not in plan and 'first_reply' not in plan and loop.time() < deadline:
+        await asyncio.sleep(0.25)
+        plan = await group_state.get_plan(chat_id, message_id) or {}
+    return plan
+
+async def ingest_group_message(update: Update, user_message: str, plan: Dict):
+    """
+    Per-message bookkeeping for a human group message, done by whichever bot
+    claimed it. Unanswered messages still feed the timeline but touch no database.
+    """
+    user = update.effective_user
+    chat = update.effective_chat
+    if plan.get('rejected') == 'spam':
+        return
+    if await group_state.mark_human_message(chat.id, update.message.message_id):
+        await group_state.append_line(chat.id, GroupLine.HUMAN, user.first_name, user_message)
+    if plan.get('allow_first'):
+        await db.update_user_activity(user.id)
+        await db.get_or_create_group(chat.id, chat.title)
+
+
+def create_message_handler(bot_name: str, bot_username: str, other_bot_username: str,
+                           ai_engine,
+                           voice_type: str, voice_rate: str, voice_pitch: str,
+                           voice_chance: float):
+    """
+    Factory function that creates a message handler for either Niyati or Kavya.
+    This eliminates duplicate code and ensures both bots behave consistently.
+    """
+    lane = update_processors[bot_name]  # per-chat reply lanes
+    
+    async def respond(bot, chat_id: int, message_id: int, user_id: int, user_name: str,
+                      user_message: str, is_group: bool, is_reply: bool = False,
+                      plan: Dict = None, other_bot_recent_reply: str = None,
+                      prepared: List[str] = None, prepared_tier: str = None,
+                      generation: Generation = None, parked_at: float = None) -> bool:
+        """
+        Generate and send this bot's reply. Needs only ids and text, so it can run
+        deferred. `prepared` lines (from a joint generation served by `prepared_tier`)
+        skip the LLM call.
+        Returns True if the turn was parked for later instead of answered;
+        `parked_at` keeps a re-parked turn's original queue time.
+        """
         # ========== DISTRESS CHECK ==========
         if any(kw in user_message.lower() for kw in ContentFilter.DISTRESS_KEYWORDS):
             crisis_msg = ("Hey, main tumhare saath hoon. 💛\nPlease iCall helpline pe call karo: <b>9152987821</b>"
                          if bot_name == 'Niyati' else
                          "Main yahan hoon. 💛\nKripya iCall helpline se sampark karein: <b>9152987821</b>")
-            await message.reply_text(crisis_msg, parse_mode=ParseMode.HTML)
-            return
+            await bot.send_message(chat_id=chat_id, text=crisis_msg, parse_mode=ParseMode.HTML,
+                                   reply_to_message_id=message_id if is_group else None)
+            return False
 
         # ========== AI GENERATION ==========
         try:
-            await context.bot.send_chat_action(chat_id=chat.id, action=ChatAction.TYPING)
-            
-            # Build context
-            if is_private:
-                context_msgs = await db.get_user_context(user.id, for_bot=bot_name)
-            else:
-                user_group_msgs = db.get_group_context(chat.id)
-                bot_shared_msgs = shared_group_memory.get(chat.id, [])
-                context_msgs = user_group_msgs + bot_shared_msgs
-                try:
-                    context_msgs.sort(key=lambda x: x.get('timestamp', ''))
-                except:
-                    pass
+            await bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
             
             mood = ai_engine._get_random_mood()
             time_period = TimeAware.get_time_period()
-            
-            input_message = user_message
-            if is_group and other_bot_recent_reply:
-                input_message = (
-                    f"(HUMAN): {user_message}\n"
-                    f"(CONTEXT): The other bot just said: {other_bot_recent_reply}\n"
-                    "You can agree, disagree, add to it, tease her, or ignore naturally."
-                )
+            llm_meta = {'tier': prepared_tier} if prepared is not None and prepared_tier else {}
+
+            # Fast path: low-information messages can reuse a cached reply
+            cache_key = None
+            responses = prepared
+            if responses is None and not other_bot_recent_reply and not is_reply:
+                cache_key = response_cache.key_for(user_message, bot_name, is_group)
+                if cache_key:
+                    responses = response_cache.get(cache_key, relaxed=budget_governor.fast_path())
+                    if responses:
+                        llm_meta['tier'] = 'cache'
+
+            if responses is None:
+                # Build context
+                if not is_group:
+                    context_msgs = await db.get_user_context(user_id, for_bot=bot_name)
+                else:
+                    context_msgs = await group_state.get_window(chat_id)
+
+                # Joint mode: the first bot writes both bots' lines in one call
+                if is_group and Config.GROUP_JOINT_GENERATION and plan and bot_name == plan.get('first_bot'):
+                    duo = await generate_duo_replies(
+                        user_name, context_msgs, user_message, bot_name, mood, time_period,
+                        user_id=user_id, chat_id=chat_id, meta=llm_meta
+                    )
+                    if duo is not None:
+                        responses = duo[bot_name]
+                        first_text = " ".join(responses)
+                        await group_state.update_plan(chat_id, message_id, {
+                            'second_lines': duo[plan['second_bot']],
+                            'second_lines_tier': llm_meta.get('tier'),
+                            'first_response_len': len(first_text),
+                            'first_reply': first_text
+                        })
 
-            responses = await ai_engine.generate_response(
-                user_message=input_message,
-                context=context_msgs,
-                user_name=user.first_name,
-                is_group=is_group,
-                mood=mood,
-                time_period=time_period,
-                user_id=user.id
-            )
+            if responses is None:
+                input_message = user_message
+                if is_group and other_bot_recent_reply:
+                    input_message = (
+                        f"(HUMAN): {user_message}\n"
+                        f"(CONTEXT): The other bot just said: {other_bot_recent_reply}\n"
+                        "You can agree, disagree, add to it, tease her, or ignore naturally."
+                    )
+
+                responses = await ai_engine.generate_response(
+                    user_message=input_message,
+                    context=context_msgs,
+                    user_name=user_name,
+                    is_group=is_group,
+                    mood=mood,
+                    time_period=time_period,
+                    user_id=user_id,
+                    meta=llm_meta,
+                    chat_id=chat_id
+                )
+                # Only real LLM answers go into the pool, never the network-error fallback
+                if cache_key and llm_meta.get('tier'):
+                    response_cache.put(cache_key, responses, user_name)
+                # Out of LLM capacity: park the private turn instead of the network-error line.
+                # A timeout or error with keys still free gets the normal fallback reply.
+                if (not is_group and not llm_meta.get('tier') and not llm_gateway.has_capacity() and
+                        deferred_replies.park(bot_name, chat_id, message_id, user_id, user_name,
+                                              user_message, is_reply, created=parked_at)):
+                    return True
             
             # Clean responses
             safe_responses = []
@@ -2033,65 +4900,253 @@ def create_message_handler(bot_name: str, bot_username: str, other_bot_username:
                     safe_responses.append(r)
             
             if not safe_responses:
-                return
+                return False
             
             # Send
             if is_group:
-                if not db.should_send_group_response(chat.id, safe_responses[0]):
-                    return
-                db.record_group_response(chat.id, safe_responses[0], bot_name=bot_name)
+                if not db.should_send_group_response(chat_id, safe_responses[0]):
+                    return False
+                db.record_group_response(chat_id, safe_responses[0], bot_name=bot_name,
+                                         tier=llm_meta.get('tier'))
             
-            await send_multi_messages(
-                context.bot, chat.id, safe_responses,
-                reply_to=message.message_id if is_group else None,
+            job = send_multi_messages(
+                bot, chat_id, safe_responses,
+                reply_to=message_id if is_group else None,
                 parse_mode=ParseMode.HTML,
                 auto_delete=is_group
             )
+            if generation:
+                generation.job = job  # past the LLM: a newer turn now only trims unsent parts
             
             # Save to shared memory
             if is_group:
-                await add_to_shared_memory(chat.id, bot_name, " ".join(safe_responses))
-                async with group_turn_locks[chat.id]:
-                    turn_state = group_turn_manager[chat.id]
-                    turn_state['last_speaker'] = bot_name
-                    turn_state['exchange_count'] = turn_state.get('exchange_count', 0) + 1
-                    pending_plan = turn_state['pending_bot_replies'].get(message.message_id)
-                    if pending_plan and bot_name == pending_plan.get('first_bot'):
-                        pending_plan['first_response_len'] = len(" ".join(safe_responses))
-                        pending_plan['first_reply'] = " ".join(safe_responses)
-                    elif pending_plan and bot_name == pending_plan.get('second_bot'):
-                        turn_state['pending_bot_replies'].pop(message.message_id, None)
+                full_reply = " ".join(safe_responses)
+                await add_to_shared_memory(chat_id, bot_name, full_reply)
+                await group_state.note_bot_reply(chat_id, bot_name)
+                if bot_name == plan.get('first_bot'):
+                    await group_state.update_plan(chat_id, message_id, {
+                        'first_response_len': len(full_reply),
+                        'first_reply': full_reply
+                    })
+                elif bot_name == plan.get('second_bot'):
+                    await group_state.drop_plan(chat_id, message_id)
             
             # Voice (private only)
-            if is_private:
-                prefs = await db.get_user_preferences(user.id)
-                if (prefs.get('voice_enabled', False) and Config.VOICE_ENABLED and 
+            if not is_group:
+                prefs = await db.get_user_preferences(user_id)
+                if (prefs.get('voice_enabled', False) and Config.VOICE_ENABLED and budget_governor.voice_enabled() and
                     len(' '.join(safe_responses)) >= Config.VOICE_MIN_TEXT_LENGTH):
                     if random.random() < voice_chance:
-                        await send_voice_message(
-                            context.bot, chat.id, ' '.join(safe_responses),
-                            voice_type=voice_type, rate=voice_rate, pitch=voice_pitch
-                        )
+                        audio = await prepare_voice_note(bot, chat_id, ' '.join(safe_responses),
+                                                         voice_type=voice_type, rate=voice_rate, pitch=voice_pitch)
+                        superseded = generation and generation_tracker.active.get(generation.key) is not generation
+                        if audio and not superseded:
+                            # Queued behind the text parts so the voice note arrives last
+                            voice_job = outbound.enqueue(OutboundJob(bot, chat_id, call=lambda: bot.send_voice(
+                                chat_id=chat_id, voice=audio
+                            )))
+                            if generation:
+                                generation.voice_job = voice_job
                 
                 # Save history
-                await db.save_message(user.id, 'user', user_message, bot_name=bot_name)
-                await db.save_message(user.id, 'assistant', ' '.join(safe_responses), bot_name=bot_name)
+                await db.save_message(user_id, 'user', user_message, bot_name=bot_name)
+                await db.save_message(user_id, 'assistant', ' '.join(safe_responses), bot_name=bot_name,
+                                      tier=llm_meta.get('tier'))
                 
                 # Extract diary info
-                important = await ai_engine.extract_important_info(user_message, user.id)
-                if important:
-                    await db.add_diary_entry(user.id, important)
+                if budget_governor.memory_enabled():
+                    important = await ai_engine.extract_important_info(user_message, user_id)
+                    if important:
+                        await db.add_diary_entry(user_id, important)
                     
         except Exception as e:
             logger.error(f"{bot_name} Handler Error: {e}", exc_info=True)
+        return False
+
+    async def respond_private(bot, chat_id: int, message_id: int, user_id: int, user_name: str,
+                              user_message: str, is_reply: bool, parked_at: float = None) -> bool:
+        """
+        One reply to a whole burst of private-chat fragments, run on the chat's reply lane.
+        Returns True if the turn was parked instead of answered.
+        """
+        generation, user_message = generation_tracker.begin(bot_name, chat_id, user_message)
+        try:
+            if deferred_replies.has_pending(bot_name, chat_id):
+                # An earlier turn is still parked: queue behind it to keep the order
+                if deferred_replies.park(bot_name, chat_id, message_id, user_id, user_name, user_message, is_reply):
+                    return True
+            return await respond(bot, chat_id, message_id, user_id, user_name, user_message,
+                                 is_group=False, is_reply=is_reply, generation=generation,
+                                 parked_at=parked_at)
+        finally:
+            generation_tracker.finish(generation)
+
+    def queue_private(bot, chat_id: int, message_id: int, user_id: int, user_name: str,
+                      user_message: str, is_reply: bool, parked_at: float = None) -> asyncio.Future:
+        """
+        Put a private turn on the chat's reply lane. An older reply still waiting on
+        the LLM is cancelled now, and its text folds into this turn when it starts.
+        """
+        generation_tracker.supersede(bot_name, chat_id)
+        return lane.submit(chat_id, lane.PRIVATE, lambda: respond_private(
+            bot, chat_id, message_id, user_id, user_name, user_message, is_reply, parked_at=parked_at
+        ))
+
+    async def follow_up(bot, chat_id: int, message_id: int, user_id: int, user_name: str,
+                        user_message: str, plan: Dict, cls: int):
+        """Second bot's turn, fired from the deferred scheduler after the first bot had its say."""
+        active_plan = await group_state.get_plan(chat_id, message_id) or {}
+        if Config.GROUP_JOINT_GENERATION:
+            active_plan = await await_joint_lines(chat_id, message_id, active_plan,
+                                                  Config.GROUP_JOINT_WAIT_SECONDS)
+        turn_state = await group_state.get_turn_state(chat_id)
+        second_chance = active_plan.get('second_base_chance', 0.6)
+        if active_plan.get('first_response_len', 0) > 220:
+            second_chance = min(second_chance, 0.35)
+        if turn_state.get('exchange_count', 0) >= 2:
+            second_chance = min(second_chance, 0.25)
+        if await group_state.check_bot_loop(chat_id) or random.random() >= second_chance:
+            await group_state.drop_plan(chat_id, message_id)
+            return
+        # Lines already written for us by a joint generation; an empty list means stay quiet
+        prepared = active_plan.get('second_lines')
+        if prepared is not None and not prepared:
+            await group_state.drop_plan(chat_id, message_id)
+            return
+        await lane.submit(chat_id, cls, lambda: respond(
+            bot, chat_id, message_id, user_id, user_name, user_message, is_group=True,
+            plan=plan, other_bot_recent_reply=active_plan.get('first_reply'),
+            prepared=prepared, prepared_tier=active_plan.get('second_lines_tier')
+        ))
+
+    async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # ========== STAGE 1: CHEAP SYNCHRONOUS FILTERS (no I/O) ==========
+        message = update.message
+        if not message or not message.text:
+            admission_counters.reject(bot_name, 'no_text')
+            return
+        
+        user = update.effective_user
+        chat = update.effective_chat
+        user_message = message.text.strip()
+        
+        if user_message.startswith('/'):
+            admission_counters.reject(bot_name, 'command')
+            return
+        
+        # Ignore other bots to prevent loops
+        if message.from_user and message.from_user.is_bot:
+            admission_counters.reject(bot_name, 'bot_sender')
+            return
+
+        is_group = chat.type in ['group', 'supergroup']
+        is_private = chat.type == 'private'
+        plan = None
+
+        # ========== STAGE 2: TURN DECISION ==========
+        if is_group:
+            # Shared ingestion: whichever bot sees the message first plans the
+            # turn once; the other just follows the plan.
+            plan = await group_state.get_plan(chat.id, message.message_id)
+            created = False
+            if plan is None:
+                plan = plan_group_turn(message, user_message, bot_name, context.bot.id,
+                                       f"@{bot_username}".lower(), f"@{other_bot_username}".lower())
+                if plan['allow_first']:
+                    plan['admission'] = 'pending'  # provisional until the claiming bot charges the limiter
+                plan, created = await group_state.claim_turn(chat.id, message.message_id, plan)
+                # Quota is only spent on messages someone will actually answer, and only once
+                if created and plan.get('admission') == 'pending':
+                    allowed, reason = await rate_limiter.check(user.id)
+                    fields = {'admission': 'done'}
+                    if not allowed:
+                        fields.update(allow_first=False, rejected=reason)
+                    plan.update(fields)
+                    await group_state.update_plan(chat.id, message.message_id, fields)
+            if plan.get('admission') == 'pending':
+                plan = await await_group_admission(chat.id, message.message_id, plan)
+
+            if plan.get('rejected'):
+                admission_counters.reject(bot_name, plan['rejected'])
+            elif not plan.get('allow_first'):
+                admission_counters.reject(bot_name, 'not_sampled')
+            elif bot_name not in (plan.get('first_bot'), plan.get('second_bot')):
+                admission_counters.reject(bot_name, 'not_my_turn')
+            else:
+                admission_counters.admit(bot_name)
+
+            # ========== STAGE 3: NETWORK I/O ==========
+            if created:
+                await ingest_group_message(update, user_message, plan)
+                if plan.get('rejected') == 'day':
+                    await message.reply_text(DAILY_LIMIT_MESSAGES[bot_name])
+
+            if not plan.get('allow_first') or bot_name not in (plan.get('first_bot'), plan.get('second_bot')):
+                # Leave the plan to expire so the other bot sees the same decision
+                return
+
+            # Clean mention from message
+            user_message = re.sub(rf'@{bot_username}', '', user_message, flags=re.IGNORECASE).strip() or user_message
+
+            if bot_name == plan.get('second_bot'):
+                # Free this handler now; the follow-up is resumed by the timer wheel
+                deferred_actions.schedule(
+                    random.uniform(4.0, 8.0), ('follow_up', bot_name, chat.id, message.message_id),
+                    follow_up, context.bot, chat.id, message.message_id, user.id, user.first_name,
+                    user_message, plan, lane.classify(update), kind='follow_up'
+                )
+                return
+
+        else:
+            # Spam filter
+            if ContentFilter.detect_spam_link(user_message):
+                admission_counters.reject(bot_name, 'spam')
+                return
+
+            # Later fragments of an open burst ride on its admission (no cooldown drop)
+            if is_private and burst_coalescer.is_open(bot_name, chat.id):
+                admission_counters.coalesced(bot_name)
+                burst_coalescer.add(context.bot, bot_name, chat.id, message.message_id, user.id,
+                                    user.first_name, user_message, bool(message.reply_to_message),
+                                    queue_private)
+                return
+
+            # Rate limit
+            allowed, reason = await rate_limiter.check(user.id)
+            if not allowed:
+                admission_counters.reject(bot_name, reason)
+                if reason == "day":
+                    await message.reply_text(DAILY_LIMIT_MESSAGES[bot_name])
+                return
+            admission_counters.admit(bot_name)
+
+            # ========== STAGE 3: NETWORK I/O ==========
+            await db.update_user_activity(user.id)
+            if is_private:
+                await db.get_or_create_user(user.id, user.first_name, user.username)
+                if Config.BURST_COALESCE_ENABLED:
+                    burst_coalescer.add(context.bot, bot_name, chat.id, message.message_id, user.id,
+                                        user.first_name, user_message, bool(message.reply_to_message),
+                                        queue_private)
+                else:
+                    queue_private(context.bot, chat.id, message.message_id, user.id,
+                                  user.first_name, user_message, bool(message.reply_to_message))
+                return
+
+        # The reply runs on the chat's lane: in order, bounded, and off this handler
+        lane.submit(chat.id, lane.classify(update), lambda: respond(
+            context.bot, chat.id, message.message_id, user.id, user.first_name, user_message,
+            is_group=is_group, is_reply=bool(message.reply_to_message), plan=plan
+        ))
     
+    deferred_replies.register_responder(bot_name, queue_private)
     return handle_message
 
 # Create handlers for both bots
 niyati_handle_message = create_message_handler(
     bot_name='Niyati', bot_username=Config.NIYATI_USERNAME,
     other_bot_username=Config.KAVYA_USERNAME,
-    ai_engine=niyati_ai, rate_limiter=niyati_rate_limiter,
+    ai_engine=niyati_ai,
     voice_type='niyati', voice_rate='+10%', voice_pitch='+5Hz',
     voice_chance=Config.NIYATI_VOICE_CHANCE
 )
@@ -2099,7 +5154,7 @@ niyati_handle_message = create_message_handler(
 kavya_handle_message = create_message_handler(
     bot_name='Kavya', bot_username=Config.KAVYA_USERNAME,
     other_bot_username=Config.NIYATI_USERNAME,
-    ai_engine=kavya_ai, rate_limiter=kavya_rate_limiter,
+    ai_engine=kavya_ai,
     voice_type='kavya', voice_rate='-5%', voice_pitch='-3Hz',
     voice_chance=Config.KAVYA_VOICE_CHANCE
 )
@@ -2135,11 +5190,11 @@ def create_start_handler(bot_name: str, bot_username: str, image_url: str,
         caption = f"{greeting} {user.first_name}! 👋\n\n{greeting_extra}\n\n<i>💡 Tip: Raat ko 10 baje secret diary aati hai!</i>"
         
         try:
-            await context.bot.send_photo(
-                chat_id=chat.id, photo=image_url,
+            await media_registry.send(context.bot, image_url, lambda photo: context.bot.send_photo(
+                chat_id=chat.id, photo=photo,
                 caption=caption, reply_markup=InlineKeyboardMarkup(keyboard),
                 parse_mode=ParseMode.HTML
-            )
+            ))
         except:
             await context.bot.send_message(
                 chat_id=chat.id, text=caption,
@@ -2166,7 +5221,7 @@ kavya_start = create_start_handler(
 
 def create_simple_command(bot_name: str, responses: List[str]):
     async def handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        await send_multi_messages(context.bot, update.effective_chat.id, responses)
+        send_multi_messages(context.bot, update.effective_chat.id, responses)
     return handler
 
 def create_help_command(bot_name: str):
@@ -2204,7 +5259,7 @@ def create_mood_command(ai_engine, bot_name: str):
             msgs = [f"aaj ka mood? {mood.upper()} vibes 😏", f"waise {time_period} ho gayi..."]
         else:
             msgs = [f"Aaj ka mood: {mood.upper()} 🌸", f"{time_period} ka samay hai."]
-        await send_multi_messages(context.bot, update.effective_chat.id, msgs)
+        send_multi_messages(context.bot, update.effective_chat.id, msgs)
     return handler
 
 def create_forget_command(bot_name: str):
@@ -2214,7 +5269,7 @@ def create_forget_command(bot_name: str):
             msgs = ["done! 🧹", "sab bhool gayi", "fresh start? chaloooo ✨"]
         else:
             msgs = ["Kshama karein, sab bhool gayi. 🧹", "Nayi shuruaat? ✨"]
-        await send_multi_messages(context.bot, update.effective_chat.id, msgs)
+        send_multi_messages(context.bot, update.effective_chat.id, msgs)
     return handler
 
 def create_toggle_command(pref_key: str, display_name: str):
@@ -2275,13 +5330,18 @@ def create_stats_command(bot_name: str):
         if user.id in Config.ADMIN_IDS:
             user_count = await db.get_user_count()
             group_count = await db.get_group_count()
-            daily = niyati_rate_limiter.get_daily_total() + kavya_rate_limiter.get_daily_total()
+            requests = request_counters.totals()
+            admission = admission_counters.get_stats().get(bot_name, {})
+            admission_line = ", ".join(
+                f"{reason} {n}" for reason, n in sorted(admission.items(), key=lambda x: -x[1])
+            ) or "—"
             
             stats += f"""
 👑 <b>Admin View (Global Stats)</b>
 <b>Total Users:</b> {user_count}
 <b>Total Groups:</b> {group_count}
-<b>API Requests Today:</b> {daily}
+<b>Requests (min/hour/24h):</b> {requests['minute']} / {requests['hour']} / {requests['day']}
+<b>Admission ({bot_name}):</b> {admission_line}
 """
         await update.message.reply_html(stats)
     return handler
@@ -2352,7 +5412,7 @@ def create_new_member_handler(bot_name: str):
                 msgs = [f"Arre! {mention} aaya group mein 🎉", f"Welcome yaar! Niyati hun main ✨"]
             else:
                 msgs = [f"Namaste {mention} ji, aapka swagat hai 🌸"]
-            await send_multi_messages(context.bot, chat.id, msgs, parse_mode=ParseMode.HTML)
+            send_multi_messages(context.bot, chat.id, msgs, parse_mode=ParseMode.HTML)
     return handler
 
 # ========== Diary Unlock Callback ==========
@@ -2402,7 +5462,7 @@ Rules:
             )}
         ]
         
-        ai_diary = await ai_engine._call_gpt(prompt, max_tokens=150)
+        ai_diary = await ai_engine._call_gpt(prompt, max_tokens=150, call_site='diary', user_id=user.id)
         final_diary = ai_diary if ai_diary and len(ai_diary) > 20 else f"Dear Diary...\nAaj {user.first_name} se baat karke achha laga ✨\n{diary_text}"
         
         final_caption = (
@@ -2416,9 +5476,9 @@ Rules:
         
         try:
             unlocked_image = "https://images.unsplash.com/photo-1517639493569-5666a7488662?w=800&q=80"
-            await query.edit_message_media(
-                media=InputMediaPhoto(media=unlocked_image, caption=final_caption, parse_mode=ParseMode.HTML)
-            )
+            await media_registry.send(context.bot, unlocked_image, lambda photo: query.edit_message_media(
+                media=InputMediaPhoto(media=photo, caption=final_caption, parse_mode=ParseMode.HTML)
+            ))
         except:
             try:
                 await context.bot.send_message(chat_id=user.id, text=final_caption, parse_mode=ParseMode.HTML)
@@ -2465,19 +5525,54 @@ async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     user_count = await db.get_user_count()
     group_count = await db.get_group_count()
-    daily = niyati_rate_limiter.get_daily_total() + kavya_rate_limiter.get_daily_total()
+    requests = request_counters.snapshot()
+    request_lines = "\n".join(
+        f"• {name}: {t['minute']} / {t['hour']} / {t['day']}" for name, t in requests.items()
+    ) or "• —"
     uptime = datetime.now(timezone.utc) - health_server.start_time
     hours = int(uptime.total_seconds() // 3600)
     minutes = int((uptime.total_seconds() % 3600) // 60)
+    llm = llm_gateway.get_stats()
+    tier_lines = "\n".join(
+        f"• {name}: {t['served']} served {'🟢' if t['healthy'] else '🔴'}" for name, t in llm['tiers'].items()
+    )
+    usage = usage_accountant.snapshot(n=3)
+    cache = response_cache.get_stats()
+    usage_lines = "\n".join(
+        f"• {label}: " + (", ".join(f"<code>{e['id']}</code> {e['tokens']}" for e in usage['top'][dim]) or "—")
+        for label, dim in [('Users', 'user'), ('Chats', 'chat'), ('Call sites', 'call_site'), ('Keys', 'key')]
+    )
+    admission_lines = "\n".join(
+        f"• {bot}: " + ", ".join(f"{reason} {n}" for reason, n in sorted(reasons.items(), key=lambda x: -x[1]))
+        for bot, reasons in admission_counters.get_stats().items()
+    ) or "• —"
     
     await update.message.reply_html(f"""
 📊 <b>Combined Bot Stats</b>
 
 <b>Users:</b> {user_count}
 <b>Groups:</b> {group_count}
-<b>Today's Requests:</b> {daily}
+<b>Requests (min/hour/24h):</b>
+{request_lines}
 <b>Uptime:</b> {hours}h {minutes}m
 <b>Database:</b> {"🟢 Connected" if db.connected else "🔴 Local"}
+<b>Budget Level:</b> {budget_governor.level} ({budget_governor.LEVELS[budget_governor.level]}), pressure {budget_governor.pressure:.2f}
+
+⚡ <b>LLM Latency</b>
+<b>Calls:</b> {llm['calls']} | <b>Failed:</b> {llm['failed']} | <b>Timeouts:</b> {llm['timeouts']}
+<b>Hedge Rate:</b> {llm['hedge_rate'] * 100:.1f}% | <b>Hedge Wins:</b> {llm['hedge_wins']}
+<b>Hedge Time Saved:</b> {llm['hedge_saved_s']}s (est. vs. the outrun primary's p95)
+<b>Fallbacks:</b> {llm['fallbacks']}
+{tier_lines}
+
+⚡ <b>Response Cache:</b> {cache['hits']} hits / {cache['eligible']} eligible ({cache['hit_rate'] * 100:.1f}%), {cache['keys']} keys
+
+🧮 <b>Token Usage</b> (last {usage['window_hours']}h)
+<b>Prompt:</b> {usage['prompt_tokens']} | <b>Completion:</b> {usage['completion_tokens']} | <b>Calls:</b> {usage['calls']}
+{usage_lines}
+
+🚦 <b>Admission</b>
+{admission_lines}
 """)
 
 async def admin_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -2516,44 +5611,30 @@ async def admin_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await status_msg.edit_text("❌ <b>No targets found in the database.</b>", parse_mode=ParseMode.HTML)
         return
     
-    await status_msg.edit_text(f"🚀 <b>Broadcast Started</b>\n\n🎯 <b>Targets:</b> {len(targets)}\n⏳ <b>Status:</b> Sending...", parse_mode=ParseMode.HTML)
-    
-    success = failed = 0
-    start_time = datetime.now()
-    for i, chat_id in enumerate(targets):
-        try:
-            if reply_msg:
-                await context.bot.copy_message(chat_id=chat_id, from_chat_id=update.effective_chat.id, message_id=reply_msg.message_id)
-            else:
-                await context.bot.send_message(chat_id=chat_id, text=html.escape(message_text), parse_mode=ParseMode.HTML)
-            success += 1
-        except (Forbidden, RetryAfter):
-            failed += 1
-        except:
-            failed += 1
-        
-        if i % 15 == 0 and i > 0:
-            try:
-                percent = int((i / len(targets)) * 100)
-                bar = "█" * (percent // 10) + "░" * (10 - (percent // 10))
-                await status_msg.edit_text(f"🚀 <b>Broadcasting...</b>\n\n[{bar}] {percent}%\n✅ <b>Sent:</b> {success}\n❌ <b>Failed:</b> {failed}\n🎯 <b>Total:</b> {len(targets)}", parse_mode=ParseMode.HTML)
-            except:
-                pass
-        await asyncio.sleep(0.05)
-    
-    end_time = datetime.now()
-    duration = round((end_time - start_time).total_seconds(), 2)
-    
-    final_report = (
-        f"✨ <b>Broadcast Successfully Completed!</b> ✨\n\n"
-        f"📊 <b>Final Report:</b>\n"
-        f"✅ <b>Delivered:</b> {success}\n"
-        f"❌ <b>Blocked/Failed:</b> {failed}\n"
-        f"🎯 <b>Total Targets:</b> {len(targets)}\n"
-        f"⏱️ <b>Time Taken:</b> {duration}s\n\n"
-        f"<i>Powered by Niyati & Kavya Network</i>"
-    )
-    await status_msg.edit_text(final_report, parse_mode=ParseMode.HTML)
+    if reply_msg:
+        job_id = broadcast_engine.create(context.bot, targets, update.effective_chat.id, status_msg.message_id,
+                                         from_chat_id=update.effective_chat.id, from_message_id=reply_msg.message_id)
+    else:
+        job_id = broadcast_engine.create(context.bot, targets, update.effective_chat.id, status_msg.message_id,
+                                         text=message_text)
+    total = broadcast_engine.job(job_id)['total']
+    await status_msg.edit_text(f"🚀 <b>Broadcast Started</b> (job #{job_id})\n\n🎯 <b>Targets:</b> {total}\n⏳ <b>Status:</b> Sending...", parse_mode=ParseMode.HTML)
+    broadcast_engine.start(job_id)
+
+def create_broadcast_control(action: str):
+    async def handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if not await admin_check(update):
+            return
+        args = context.args
+        job_id = int(args[0]) if args and args[0].isdigit() else broadcast_engine.latest()
+        if not job_id or not broadcast_engine.job(job_id):
+            await update.message.reply_html("❌ <b>No broadcast job found.</b>")
+            return
+        if action != 'status' and not getattr(broadcast_engine, action)(job_id):
+            await update.message.reply_html(f"⚠️ Job #{job_id} is <b>{broadcast_engine.job(job_id)['status']}</b>, can't {action} it.")
+            return
+        await update.message.reply_html(broadcast_engine.progress_text(job_id))
+    return handler
 
 # ========== Group Admin Commands ==========
 
@@ -2580,11 +5661,14 @@ def create_group_toggle(setting_key: str, display_name: str):
 # ============================================================================
 
 async def send_daily_geeta(context: ContextTypes.DEFAULT_TYPE):
+    if fanout.busy('geeta'):
+        logger.warning("⏭️ geeta still running, skipping this run")
+        return
     groups = await db.get_all_groups()
     quote = await niyati_ai.generate_geeta_quote()
     if not quote:
         quote = random.choice(GEETA_FALLBACK_QUOTES)
-    sent = 0
+    targets = []
     for group in groups:
         settings = group.get('settings', {})
         if isinstance(settings, str):
@@ -2592,20 +5676,28 @@ async def send_daily_geeta(context: ContextTypes.DEFAULT_TYPE):
                 settings = json.loads(settings)
             except:
                 settings = {}
-        if not settings.get('geeta_enabled', True):
-            continue
-        try:
-            await context.bot.send_message(chat_id=group['chat_id'], text=quote, parse_mode=ParseMode.HTML)
-            sent += 1
-            await asyncio.sleep(0.1)
-        except:
-            pass
-    logger.info(f"📿 Geeta sent to {sent} groups")
+        if settings.get('geeta_enabled', True) and group.get('chat_id'):
+            targets.append(group['chat_id'])
+    
+    run = await fanout.run('geeta', context.bot, targets,
+                           lambda chat_id: context.bot.send_message(chat_id=chat_id, text=quote, parse_mode=ParseMode.HTML),
+                           window=Config.GEETA_WINDOW_MINUTES * 60)
+    if run:
+        logger.info(f"📿 Geeta sent to {run.sent} groups")
+
+async def usage_flush_job(context: ContextTypes.DEFAULT_TYPE):
+    rows = usage_accountant.drain()
+    await db.save_llm_usage(rows)
+    if rows:
+        logger.info(f"🧮 Flushed {len(rows)} LLM usage rows")
 
 async def cleanup_job(context: ContextTypes.DEFAULT_TYPE):
-    niyati_rate_limiter.cleanup()
-    kavya_rate_limiter.cleanup()
+    rate_limiter.cleanup()
+    outbound.sweep()
     await db.cleanup_local_cache()
+    swept = await group_state.sweep()
+    if swept:
+        logger.info(f"🧹 Swept turn state for {swept} idle groups")
 
 async def send_locked_diary_card(context: ContextTypes.DEFAULT_TYPE):
     users = await db.get_active_users(days=Config.DIARY_MIN_ACTIVE_DAYS)
@@ -2618,33 +5710,27 @@ async def send_locked_diary_card(context: ContextTypes.DEFAULT_TYPE):
         return
     
     locked_image = "https://images.unsplash.com/photo-1517639493569-5666a7488662?w=600&q=80&blur=50"
-    sent = 0
+    caption = f"🔒 <b>Secret Memory Created!</b>\n\nDate: {datetime.now(ist).strftime('%d %b, %Y')}\nChoose whose diary to unlock..."
     
-    for user in users:
-        user_id = user.get('user_id')
-        if not user_id:
-            continue
+    async def diary_enabled(user_id: int) -> bool:
         prefs = await db.get_user_preferences(user_id)
-        if not prefs.get('diary_enabled', True):
-            continue
-        
+        return prefs.get('diary_enabled', True)
+    
+    def send_card(user_id: int):
         keyboard = [[
             InlineKeyboardButton("✨ Unlock Niyati Diary", callback_data=f"niyati_unlock_diary_{user_id}"),
             InlineKeyboardButton("🌿 Unlock Kavya Diary", callback_data=f"kavya_unlock_diary_{user_id}")
         ]]
-        caption = f"🔒 <b>Secret Memory Created!</b>\n\nDate: {datetime.now(ist).strftime('%d %b, %Y')}\nChoose whose diary to unlock..."
-        
-        try:
-            await context.bot.send_photo(
-                chat_id=user_id, photo=locked_image, caption=caption,
-                reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML
-            )
-            sent += 1
-            await asyncio.sleep(0.5)
-        except:
-            pass
+        return media_registry.send(context.bot, locked_image, lambda photo: context.bot.send_photo(
+            chat_id=user_id, photo=photo, caption=caption,
+            reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML
+        ))
     
-    logger.info(f"🔒 Diary cards sent to {sent} users")
+    targets = [u['user_id'] for u in users if u.get('user_id')]
+    run = await fanout.run('diary', context.bot, targets, send_card,
+                           window=Config.DIARY_WINDOW_MINUTES * 60, keep=diary_enabled)
+    if run:
+        logger.info(f"🔒 Diary cards sent to {run.sent} users")
 
 async def routine_message_job(context: ContextTypes.DEFAULT_TYPE):
     job_data = context.job.data
@@ -2653,6 +5739,9 @@ async def routine_message_job(context: ContextTypes.DEFAULT_TYPE):
     
     if job_data == 'random' and (current_hour >= 23 or current_hour < 8):
         return
+    if fanout.busy(f'routine_{job_data}'):
+        logger.warning(f"⏭️ routine_{job_data} still running, skipping this run")
+        return
     
     users = await db.get_active_users(days=2)
     if not users and not db.connected:
@@ -2666,7 +5755,8 @@ async def routine_message_job(context: ContextTypes.DEFAULT_TYPE):
         else:
             prompt = "Generate 3 different extremely short, casual, natural Gen-Z random check-in texts (in Hinglish). Each on a new line. No list numbers. Example: 'kya kar raha hai yaar? bore ho gayi main'"
             
-        res = await niyati_ai._call_gpt([{"role": "user", "content": prompt}], max_tokens=100)
+        res = await niyati_ai._call_gpt([{"role": "user", "content": prompt}], max_tokens=100, lane='background',
+                                        call_site=f'routine_{job_data}')
         if res:
             # Clean up the response
             messages_pool = [m.replace('- ', '').replace('1. ', '').replace('2. ', '').replace('3. ', '').strip() for m in res.split('\n') if len(m.strip()) > 3]
@@ -2678,23 +5768,16 @@ async def routine_message_job(context: ContextTypes.DEFAULT_TYPE):
     if not messages_pool:
         messages_pool = ["hello!"]
         
-    count = 0
-    for user in users:
-        uid = user.get('user_id')
-        if not uid:
-            continue
-        if job_data == 'random' and random.random() > 0.3:
-            continue
-            
-        msg = random.choice(messages_pool)
-        
-        try:
-            await asyncio.sleep(random.uniform(0.5, 2.0))
-            await context.bot.send_message(chat_id=uid, text=msg)
-            count += 1
-        except:
-            pass
-    logger.info(f"✨ Routine message ({job_data}) sent to {count} users")
+    targets = [u['user_id'] for u in users if u.get('user_id')]
+    if job_data == 'random':
+        targets = [uid for uid in targets if random.random() <= 0.3]
+    random.shuffle(targets)  # nobody is always first or last in the window
+    
+    run = await fanout.run(f'routine_{job_data}', context.bot, targets,
+                           lambda uid: context.bot.send_message(chat_id=uid, text=random.choice(messages_pool)),
+                           window=Config.ROUTINE_WINDOW_MINUTES * 60)
+    if run:
+        logger.info(f"✨ Routine message ({job_data}) sent to {run.sent} users")
 
 # ============================================================================
 # ERROR HANDLER
@@ -2746,6 +5829,10 @@ Sassy 💁‍♀️ Emotional 🥺 Full Filmy 🎬
     app.add_handler(CommandHandler("adminstats", admin_stats))
     app.add_handler(CommandHandler("users", admin_users))
     app.add_handler(CommandHandler("broadcast", admin_broadcast))
+    app.add_handler(CommandHandler("bcstatus", create_broadcast_control('status')))
+    app.add_handler(CommandHandler("bcpause", create_broadcast_control('pause')))
+    app.add_handler(CommandHandler("bcresume", create_broadcast_control('resume')))
+    app.add_handler(CommandHandler("bccancel", create_broadcast_control('cancel')))
     
     # Callbacks
     app.add_handler(CallbackQueryHandler(create_diary_callback('Niyati', niyati_ai), pattern="^niyati_unlock_diary_"))
@@ -2788,6 +5875,10 @@ Composed 💁‍♀️ Thoughtful 📝 Gentle 🌿
     app.add_handler(CommandHandler("adminstats", admin_stats))
     app.add_handler(CommandHandler("users", admin_users))
     app.add_handler(CommandHandler("broadcast", admin_broadcast))
+    app.add_handler(CommandHandler("bcstatus", create_broadcast_control('status')))
+    app.add_handler(CommandHandler("bcpause", create_broadcast_control('pause')))
+    app.add_handler(CommandHandler("bcresume", create_broadcast_control('resume')))
+    app.add_handler(CommandHandler("bccancel", create_broadcast_control('cancel')))
     
     app.add_handler(CallbackQueryHandler(create_diary_callback('Kavya', kavya_ai), pattern="^kavya_unlock_diary_"))
     app.add_handler(CallbackQueryHandler(create_diary_callback('Niyati', niyati_ai), pattern="^niyati_unlock_diary_"))
@@ -2822,6 +5913,23 @@ async def start_polling_with_retry(app: Application, bot_name: str):
             await asyncio.sleep(backoff)
             backoff = min(backoff * 2, 60)
 
+async def start_webhook_with_retry(app: Application, bot_name: str):
+    path, secret = webhook_secrets(app.bot.token)
+    health_server.add_webhook(app, path, secret)
+    backoff = 5
+    while True:
+        try:
+            await app.bot.set_webhook(
+                url=f"{Config.WEBHOOK_URL}/webhook/{path}", secret_token=secret,
+                allowed_updates=Update.ALL_TYPES, drop_pending_updates=True
+            )
+            logger.info(f"✅ {bot_name} webhook set")
+            return
+        except Exception as e:
+            logger.error(f"❌ {bot_name} set_webhook failed: {e}. Retrying in {backoff}s...")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 60)
+
 async def main():
     if not Config.NIYATI_TOKEN or not Config.KAVYA_TOKEN:
         logger.error("❌ Both NIYATI_BOT_TOKEN and KAVYA_BOT_TOKEN must be set!")
@@ -2835,14 +5943,14 @@ async def main():
     await db.initialize()
     await health_server.start()
 
-    # Build applications with concurrent updates enabled
+    # Build applications: updates run concurrently across chats, in order within a chat
     niyati_app = (Application.builder()
                   .token(Config.NIYATI_TOKEN)
-                  .concurrent_updates(True)
+                  .concurrent_updates(update_processors['Niyati'])
                   .build())
     kavya_app = (Application.builder()
                  .token(Config.KAVYA_TOKEN)
-                 .concurrent_updates(True)
+                 .concurrent_updates(update_processors['Kavya'])
                  .build())
 
     # Setup handlers
@@ -2858,20 +5966,38 @@ async def main():
     jq.run_daily(send_locked_diary_card, time=time(hour=17, minute=0), name='diary')
     jq.run_daily(send_daily_geeta, time=time(hour=1, minute=30), name='geeta')
     jq.run_repeating(cleanup_job, interval=timedelta(hours=1), first=30, name='cleanup')
+    jq.run_repeating(budget_governor_job, interval=Config.BUDGET_EVAL_SECONDS, first=Config.BUDGET_EVAL_SECONDS,
+                     name='budget_governor')
+    jq.run_repeating(delete_queue_job, interval=Config.DELETE_QUEUE_INTERVAL, first=10, name='auto_delete')
+    jq.run_repeating(deferred_reply_job, interval=Config.DEFERRED_REPLY_INTERVAL, first=15, name='deferred_replies')
+    jq.run_repeating(usage_flush_job, interval=timedelta(minutes=Config.USAGE_FLUSH_MINUTES), first=120, name='usage_flush')
 
     # Initialize & start
     logger.info("⏳ Initializing bots...")
     await niyati_app.initialize()
     await kavya_app.initialize()
+    delete_queue.register_bot(niyati_app.bot)
+    delete_queue.register_bot(kavya_app.bot)
+    broadcast_engine.register_bot(niyati_app.bot)
+    broadcast_engine.register_bot(kavya_app.bot)
+    deferred_replies.register_bot('Niyati', niyati_app.bot)
+    deferred_replies.register_bot('Kavya', kavya_app.bot)
     await niyati_app.start()
     await kavya_app.start()
+    broadcast_engine.resume_all()
 
-    # Start polling
+    # Receive updates: webhooks on the health server's port, or long polling
     logger.info("🚀 Niyati + Kavya are LIVE! Human-like conversations enabled.")
-    await asyncio.gather(
-        start_polling_with_retry(niyati_app, "Niyati"),
-        start_polling_with_retry(kavya_app, "Kavya")
-    )
+    if Config.WEBHOOK_URL:
+        await asyncio.gather(
+            start_webhook_with_retry(niyati_app, "Niyati"),
+            start_webhook_with_retry(kavya_app, "Kavya")
+        )
+    else:
+        await asyncio.gather(
+            start_polling_with_retry(niyati_app, "Niyati"),
+            start_polling_with_retry(kavya_app, "Kavya")
+        )
 
     # Keep alive
     await asyncio.Event().wait()
@@ -0,0 +1,345 @@
+"""
+╔════════════════════════════════════════════════════════════════════════════╗
+║              MOCK LLM SERVER — OpenAI-compatible stand-in                ║
+║        Offline /v1/chat/completions for load and latency testing         ║
+╚════════════════════════════════════════════════════════════════════════════╝
+
+Point the bots at it instead of Groq:
+
+    python mock_llm_server.py
+    GROQ_BASE_URL=http://127.0.0.1:8089/v1 python main.py
+
+Modes (MOCK_LLM_MODE):
+- synthetic: deterministic Hinglish replies, no network at all
+- record:    forward to MOCK_LLM_UPSTREAM and append every exchange to the tape
+- replay:    answer from the tape (exact request match first, then in order)
+
+Latency (MOCK_LLM_LATENCY) is one of:
+    fixed:0.4 | uniform:0.2,1.5 | normal:0.8,0.2 | lognormal:-0.5,0.6
+
+Rate limits are emulated per API key with Groq-style 429 bodies and
+x-ratelimit-* / retry-after headers. MOCK_LLM_429_RATE and
+MOCK_LLM_ERROR_RATE inject extra failures on top of that.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import hashlib
+import logging
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from aiohttp import web, ClientSession, ClientTimeout
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+class MockConfig:
+    HOST = os.getenv('MOCK_LLM_HOST', '127.0.0.1')
+    PORT = int(os.getenv('MOCK_LLM_PORT', '8089'))
+    MODE = os.getenv('MOCK_LLM_MODE', 'synthetic')
+    SEED = int(os.getenv('MOCK_LLM_SEED', '42'))
+
+    LATENCY = os.getenv('MOCK_LLM_LATENCY', 'lognormal:-0.7,0.5')
+    TOKEN_DELAY = float(os.getenv('MOCK_LLM_TOKEN_DELAY', '0.01'))
+
+    RPM = int(os.getenv('MOCK_LLM_RPM', '30'))
+    TPM = int(os.getenv('MOCK_LLM_TPM', '6000'))
+    RATE_429 = float(os.getenv('MOCK_LLM_429_RATE', '0.0'))
+    ERROR_RATE = float(os.getenv('MOCK_LLM_ERROR_RATE', '0.0'))
+
+    TAPE_PATH = os.getenv('MOCK_LLM_TAPE', 'mock_llm_tape.jsonl')
+    UPSTREAM = os.getenv('MOCK_LLM_UPSTREAM', 'https://api.groq.com/openai/v1')
+    UPSTREAM_KEY = os.getenv('MOCK_LLM_UPSTREAM_KEY', '')
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler(sys.stdout)]
+)
+logger = logging.getLogger(__name__)
+
+SYNTHETIC_REPLIES = [
+    "haan yaar sahi bola",
+    "lol kya scene hai",
+    "acha fir kya hua?",
+    "hmm... samajh rahi hu main",
+    "arre wah ✨",
+    "sach me? 😳",
+    "chal koi na, ho jayega sab",
+    "ek sec... haan bolo",
+    "bas yaar aise hi, tu bata",
+    "pata nahi yaar mujhe toh",
+]
+
+# ============================================================================
+# LATENCY & RATE LIMITS
+# ============================================================================
+
+def parse_latency_spec(spec: str) -> Tuple[str, List[float]]:
+    kind, _, args = spec.partition(':')
+    values = [float(v) for v in args.split(',') if v.strip()]
+    if kind not in ('fixed', 'uniform', 'normal', 'lognormal') or not values:
+        raise ValueError(f"Bad MOCK_LLM_LATENCY spec: {spec}")
+    return kind, values
+
+def sample_latency(rng: random.Random, kind: str, values: List[float]) -> float:
+    if kind == 'fixed':
+        return values[0]
+    if kind == 'uniform':
+        return rng.uniform(values[0], values[1])
+    if kind == 'normal':
+        return max(0.0, rng.gauss(values[0], values[1]))
+    return rng.lognormvariate(values[0], values[1])
+
+def format_duration(seconds: float) -> str:
+    """Groq-style durations: '7.66s', '2m59.56s'."""
+    minutes, secs = divmod(max(0.0, seconds), 60)
+    return f"{int(minutes)}m{secs:.2f}s" if minutes else f"{secs:.2f}s"
+
+
+class KeyWindow:
+    """Fixed one-minute request/token window for a single API key."""
+
+    def __init__(self):
+        self.window_start = time.monotonic()
+        self.requests = 0
+        self.tokens = 0
+
+    def roll(self):
+        if time.monotonic() - self.window_start >= 60:
+            self.window_start = time.monotonic()
+            self.requests = 0
+            self.tokens = 0
+
+    def reset_in(self) -> float:
+        return max(0.0, 60 - (time.monotonic() - self.window_start))
+
+    def headers(self) -> Dict[str, str]:
+        reset = format_duration(self.reset_in())
+        return {
+            'x-ratelimit-limit-requests': str(MockConfig.RPM),
+            'x-ratelimit-limit-tokens': str(MockConfig.TPM),
+            'x-ratelimit-remaining-requests': str(max(0, MockConfig.RPM - self.requests)),
+            'x-ratelimit-remaining-tokens': str(max(0, MockConfig.TPM - self.tokens)),
+            'x-ratelimit-reset-requests': reset,
+            'x-ratelimit-reset-tokens': reset,
+        }
+
+# ============================================================================
+# TAPE (record / replay)
+# ============================================================================
+
+def request_fingerprint(body: Dict) -> str:
+    key = json.dumps({'model': body.get('model'), 'messages': body.get('messages')},
+                     sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+class Tape:
+    def __init__(self, path: str):
+        self.path = path
+        self.by_fingerprint: Dict[str, List[Dict]] = defaultdict(list)
+        self.ordered: List[Dict] = []
+        self.cursor = 0
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                entry = json.loads(line)
+                self.by_fingerprint[entry['fingerprint']].append(entry['response'])
+                self.ordered.append(entry['response'])
+        logger.info(f"📼 Loaded {len(self.ordered)} recorded responses from {self.path}")
+
+    def append(self, fingerprint: str, request: Dict, response: Dict):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'fingerprint': fingerprint, 'request': request, 'response': response},
+                               ensure_ascii=False) + "\n")
+        self.by_fingerprint[fingerprint].append(response)
+        self.ordered.append(response)
+
+    def lookup(self, fingerprint: str) -> Optional[Dict]:
+        matches = self.by_fingerprint.get(fingerprint)
+        if matches:
+            return matches[0]
+        if not self.ordered:
+            return None
+        response = self.ordered[self.cursor % len(self.ordered)]
+        self.cursor += 1
+        return response
+
+# ============================================================================
+# SERVER
+# ============================================================================
+
+class MockLLMServer:
+    def __init__(self):
+        self.app = web.Application()
+        self.app.router.add_post('/v1/chat/completions', self.chat_completions)
+        self.app.router.add_get('/v1/models', self.models)
+        self.app.router.add_get('/stats', self.stats_view)
+        self.rng = random.Random(MockConfig.SEED)
+        self.latency_kind, self.latency_values = parse_latency_spec(MockConfig.LATENCY)
+        self.windows: Dict[str, KeyWindow] = defaultdict(KeyWindow)
+        self.tape = Tape(MockConfig.TAPE_PATH)
+        self.session: Optional[ClientSession] = None
+        self.stats = {'requests': 0, 'ok': 0, 'rate_limited': 0, 'errors': 0, 'streamed': 0}
+        self.app.on_startup.append(self._on_startup)
+        self.app.on_cleanup.append(self._on_cleanup)
+
+    async def _on_startup(self, app):
+        if MockConfig.MODE in ('replay', 'record'):
+            self.tape.load()
+        if MockConfig.MODE == 'record':
+            self.session = ClientSession(timeout=ClientTimeout(total=60))
+        logger.info(f"🧪 Mock LLM ({MockConfig.MODE}) on http://{MockConfig.HOST}:{MockConfig.PORT}/v1")
+
+    async def _on_cleanup(self, app):
+        if self.session:
+            await self.session.close()
+
+    async def models(self, request):
+        return web.json_response({'object': 'list', 'data': [{'id': 'mock', 'object': 'model'}]})
+
+    async def stats_view(self, request):
+        return web.json_response(self.stats)
+
+    RATE_LIMITS = {
+        'requests': ('requests per minute (RPM)', 'RPM'),
+        'tokens': ('tokens per minute (TPM)', 'TPM'),
+    }
+
+    def _rate_limited(self, model: str, window: KeyWindow, limit: str) -> web.Response:
+        """429 for the limit that tripped ('requests' or 'tokens'), shaped like Groq's."""
+        self.stats['rate_limited'] += 1
+        label, setting = self.RATE_LIMITS[limit]
+        used = window.requests if limit == 'requests' else window.tokens
+        retry_in = window.reset_in()
+        message = (f"Rate limit reached for model `{model}` on {label}: "
+                   f"Limit {getattr(MockConfig, setting)}, Used {used}. "
+                   f"Please try again in {format_duration(retry_in)}.")
+        headers = window.headers()
+        headers[f'x-ratelimit-remaining-{limit}'] = '0'
+        headers['retry-after'] = str(int(retry_in) + 1)
+        return web.json_response(
+            {'error': {'message': message, 'type': limit, 'code': 'rate_limit_exceeded'}},
+            status=429, headers=headers
+        )
+
+    def _synthetic(self, body: Dict) -> Dict:
+        messages = body.get('messages') or []
+        seed = request_fingerprint(body)
+        rng = random.Random(f"{MockConfig.SEED}:{seed}")
+        parts = rng.sample(SYNTHETIC_REPLIES, k=rng.choice([1, 1, 2]))
+        content = " ||| ".join(parts)
+        prompt_tokens = sum(len(str(m.get('content', ''))) for m in messages) // 4 + 1
+        completion_tokens = len(content) // 4 + 1
+        return {
+            'id': f"chatcmpl-mock-{seed[:12]}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'mock'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                      'total_tokens': prompt_tokens + completion_tokens},
+        }
+
+    async def _upstream(self, body: Dict) -> Dict:
+        upstream_body = dict(body, stream=False)
+        async with self.session.post(
+            f"{MockConfig.UPSTREAM.rstrip('/')}/chat/completions",
+            json=upstream_body,
+            headers={'Authorization': f"Bearer {MockConfig.UPSTREAM_KEY}"}
+        ) as resp:
+            data = await resp.json()
+            if resp.status != 200:
+                raise web.HTTPBadGateway(text=json.dumps(data), content_type='application/json')
+            return data
+
+    async def _completion_for(self, body: Dict) -> Dict:
+        fingerprint = request_fingerprint(body)
+        if MockConfig.MODE == 'record':
+            response = await self._upstream(body)
+            self.tape.append(fingerprint, {'model': body.get('model'), 'messages': body.get('messages')}, response)
+            return response
+        if MockConfig.MODE == 'replay':
+            response = self.tape.lookup(fingerprint)
+            if response:
+                return response
+        return self._synthetic(body)
+
+    async def _stream(self, request, completion: Dict, headers: Dict) -> web.StreamResponse:
+        self.stats['streamed'] += 1
+        response = web.StreamResponse(headers={**headers, 'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        content = completion['choices'][0]['message']['content']
+        base = {'id': completion['id'], 'object': 'chat.completion.chunk',
+                'created': completion['created'], 'model': completion['model']}
+        words = content.split(' ')
+        for i, word in enumerate(words):
+            delta = {'content': word if i == 0 else f" {word}"}
+            if i == 0:
+                delta['role'] = 'assistant'
+            chunk = dict(base, choices=[{'index': 0, 'delta': delta, 'finish_reason': None}])
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+            await asyncio.sleep(MockConfig.TOKEN_DELAY)
+        final = dict(base, choices=[{'index': 0, 'delta': {}, 'finish_reason': 'stop'}],
+                     usage=completion.get('usage'))
+        await response.write(f"data: {json.dumps(final)}\n\n".encode('utf-8'))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def chat_completions(self, request):
+        self.stats['requests'] += 1
+        try:
+            body = await request.json()
+        except Exception:
+            return web.json_response({'error': {'message': 'invalid JSON body'}}, status=400)
+
+        api_key = request.headers.get('Authorization', '').replace('Bearer ', '') or 'anonymous'
+        model = body.get('model', 'mock')
+        window = self.windows[api_key]
+        window.roll()
+
+        if window.requests >= MockConfig.RPM:
+            return self._rate_limited(model, window, 'requests')
+        if window.tokens >= MockConfig.TPM:
+            return self._rate_limited(model, window, 'tokens')
+        if self.rng.random() < MockConfig.RATE_429:
+            # Injected 429s behave like a spent request quota
+            return self._rate_limited(model, window, 'requests')
+
+        await asyncio.sleep(sample_latency(self.rng, self.latency_kind, self.latency_values))
+
+        if self.rng.random() < MockConfig.ERROR_RATE:
+            self.stats['errors'] += 1
+            return web.json_response({'error': {'message': 'mock upstream error', 'type': 'server_error'}}, status=500)
+
+        completion = await self._completion_for(body)
+        usage = completion.get('usage') or {}
+        window.requests += 1
+        window.tokens += usage.get('total_tokens', 0)
+        self.stats['ok'] += 1
+
+        if body.get('stream'):
+            return await self._stream(request, completion, window.headers())
+        return web.json_response(completion, headers=window.headers())
+
+
+def main():
+    server = MockLLMServer()
+    web.run_app(server.app, host=MockConfig.HOST, port=MockConfig.PORT, print=None)
+
+if __name__ == "__main__":
+    main()
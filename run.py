@@ -1,10 +1,15 @@
 import sys
 import os
+import asyncio
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from app import app  # Adjust based on your structure
-import uvicorn
+# main.py serves health, status and both bots' webhooks (WEBHOOK_URL set) from one aiohttp app on PORT
+from main import main, logger
 
 if __name__ == "__main__":
-    port = int(os.environ.get("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    try:
+        if sys.platform.startswith("win"):
+            asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("Bot stopped by user.")
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# main.py validates its config at import time
+os.environ.setdefault('NIYATI_BOT_TOKEN', 'test-niyati')
+os.environ.setdefault('KAVYA_BOT_TOKEN', 'test-kavya')
+os.environ.setdefault('GROQ_API_KEYS', 'test-key')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,127 @@
+"""
+Both group-state backends must agree on turn claiming, plan updates and the
+bot-loop check. The Redis backend runs its Lua scripts against fakeredis.
+"""
+import asyncio
+
+import pytest
+
+import main
+
+
+def in_process():
+    return main.InProcessGroupState()
+
+
+def redis_backed():
+    fakeredis = pytest.importorskip('fakeredis')
+    pytest.importorskip('lupa')  # fakeredis needs it for EVALSHA
+    return main.RedisGroupState('test', client=fakeredis.FakeAsyncRedis(decode_responses=True))
+
+
+@pytest.fixture(params=[in_process, redis_backed], ids=['memory', 'redis'])
+def backend(request):
+    return request.param()
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_claim_turn_first_plan_wins(backend):
+    async def scenario():
+        plan, created = await backend.claim_turn(-1, 10, {'first_bot': 'Niyati', 'allow_first': True})
+        other, other_created = await backend.claim_turn(-1, 10, {'first_bot': 'Kavya', 'allow_first': False})
+        return plan, created, other, other_created
+
+    plan, created, other, other_created = run(scenario())
+    assert created and not other_created
+    assert other == plan == {'first_bot': 'Niyati', 'allow_first': True}
+
+
+def test_claim_turn_is_per_message(backend):
+    async def scenario():
+        _, first = await backend.claim_turn(-1, 10, {'first_bot': 'Niyati'})
+        _, second = await backend.claim_turn(-1, 11, {'first_bot': 'Kavya'})
+        _, other_chat = await backend.claim_turn(-2, 10, {'first_bot': 'Kavya'})
+        return first, second, other_chat
+
+    assert run(scenario()) == (True, True, True)
+
+
+def test_claim_turn_resets_exchange_count(backend):
+    async def scenario():
+        await backend.claim_turn(-1, 10, {'first_bot': 'Niyati'})
+        await backend.note_bot_reply(-1, 'Niyati')
+        await backend.note_bot_reply(-1, 'Kavya')
+        before = await backend.get_turn_state(-1)
+        await backend.claim_turn(-1, 11, {'first_bot': 'Kavya'})
+        after = await backend.get_turn_state(-1)
+        return before, after
+
+    before, after = run(scenario())
+    assert before['exchange_count'] == 2 and before['last_speaker'] == 'Kavya'
+    assert after['exchange_count'] == 0
+    assert after['last_human_at'] is not None
+
+
+def test_update_plan_merges_fields(backend):
+    async def scenario():
+        await backend.claim_turn(-1, 10, {'first_bot': 'Niyati', 'allow_first': True, 'admission': 'pending'})
+        await backend.update_plan(-1, 10, {'admission': 'done', 'first_reply': 'hi'})
+        return await backend.get_plan(-1, 10)
+
+    assert run(scenario()) == {'first_bot': 'Niyati', 'allow_first': True,
+                               'admission': 'done', 'first_reply': 'hi'}
+
+
+def test_update_plan_without_plan_is_noop(backend):
+    async def scenario():
+        await backend.update_plan(-1, 99, {'first_reply': 'hi'})
+        return await backend.get_plan(-1, 99)
+
+    assert run(scenario()) is None
+
+
+def test_drop_plan_allows_new_claim(backend):
+    async def scenario():
+        await backend.claim_turn(-1, 10, {'first_bot': 'Niyati'})
+        await backend.drop_plan(-1, 10)
+        gone = await backend.get_plan(-1, 10)
+        plan, created = await backend.claim_turn(-1, 10, {'first_bot': 'Kavya'})
+        return gone, plan, created
+
+    gone, plan, created = run(scenario())
+    assert gone is None
+    assert created and plan['first_bot'] == 'Kavya'
+
+
+def test_check_bot_loop_caps_exchanges(backend, monkeypatch):
+    monkeypatch.setattr(main.Config, 'MAX_BOT_EXCHANGES', 3)
+    monkeypatch.setattr(main.Config, 'BOT_EXCHANGE_COOLDOWN', 300)
+
+    async def scenario():
+        await backend.claim_turn(-1, 10, {'first_bot': 'Niyati'})
+        return [await backend.check_bot_loop(-1) for _ in range(5)]
+
+    assert run(scenario()) == [False, False, False, True, True]
+
+
+def test_check_bot_loop_is_per_chat(backend, monkeypatch):
+    monkeypatch.setattr(main.Config, 'MAX_BOT_EXCHANGES', 1)
+    monkeypatch.setattr(main.Config, 'BOT_EXCHANGE_COOLDOWN', 300)
+
+    async def scenario():
+        first = [await backend.check_bot_loop(-1) for _ in range(2)]
+        other = await backend.check_bot_loop(-2)
+        return first, other
+
+    assert run(scenario()) == ([False, True], False)
+
+
+def test_mark_human_message_once(backend):
+    async def scenario():
+        return [await backend.mark_human_message(-1, 10), await backend.mark_human_message(-1, 10),
+                await backend.mark_human_message(-1, 11)]
+
+    assert run(scenario()) == [True, False, True]